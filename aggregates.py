@@ -0,0 +1,112 @@
+from array import array
+from bisect import bisect_left
+from datetime import date
+from dates import JULIAN_EPOCH, date_sql, day_number
+
+# SQL expression for each supported grouping, dates are stored as day numbers
+GROUP_EXPRESSIONS = {
+    "category": "category",
+    "day": date_sql("date"),
+    "week": f"strftime('%Y-W%W', date + {JULIAN_EPOCH})",
+    "month": f"strftime('%Y-%m', date + {JULIAN_EPOCH})",
+    "year": f"strftime('%Y', date + {JULIAN_EPOCH})",
+}
+
+
+# group of a transaction row (id, type, category, amount, date, notes), the same value GROUP_EXPRESSIONS computes
+def group_value(name, row):
+    if name == "category":
+        return row[2]
+    if name == "week":
+        return date.fromisoformat(row[4]).strftime('%Y-W%W')
+    return row[4][:{"day": 10, "month": 7, "year": 4}[name]]
+
+
+# income, expense, net and count per group, held in flat arrays instead of a list of tuples
+# amounts are integer cents in int64 arrays, so totals are exact
+class AggregateResult:
+    def __init__(self, group_by=()):
+        self.group_by = tuple(group_by)
+        self.keys = []    # one tuple of group values per row, empty tuple when ungrouped
+        self.income = array('q')
+        self.expense = array('q')
+        self.count = array('q')
+
+    def append(self, key, income, expense, count):
+        self.keys.append(key)
+        self.income.append(income)
+        self.expense.append(expense)
+        self.count.append(count)
+
+    @property
+    def net(self):
+        return array('q', (i - e for i, e in zip(self.income, self.expense)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    # yields (key, income, expense, net) for every group
+    def __iter__(self):
+        for key, income, expense in zip(self.keys, self.income, self.expense):
+            yield key, income, expense, income - expense
+
+    # adds (sign 1) or takes away (sign -1) one transaction row, e.g. to follow writes without querying again
+    # groups stay sorted by key and are dropped once their count reaches zero
+    def apply(self, row, sign=1):
+        if row[1] not in ("income", "expense"):
+            return
+        key = tuple(group_value(name, row) for name in self.group_by)
+        index = bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            if sign < 0:
+                return
+            self.keys.insert(index, key)
+            self.income.insert(index, 0)
+            self.expense.insert(index, 0)
+            self.count.insert(index, 0)
+
+        amounts = self.income if row[1] == "income" else self.expense
+        amounts[index] += sign * row[3]
+        self.count[index] += sign
+        if self.count[index] <= 0:
+            del self.keys[index], self.income[index], self.expense[index], self.count[index]
+
+    # grand totals over all groups: (income, expense, net)
+    def totals(self):
+        income = sum(self.income)
+        expense = sum(self.expense)
+        return income, expense, income - expense
+
+
+# computes income, expense and net over a date range in a single pass
+# reads the daily_totals rollup, so the cost grows with the number of days rather than transactions
+# group_by is a grouping name or a sequence of them, e.g. "month" or ("category", "month")
+# dates are inclusive YYYY-MM-DD, raises ValueError for malformed dates
+def aggregate_transactions(conn, start_date, end_date, group_by=()):
+    if isinstance(group_by, str):
+        group_by = (group_by,)
+    unknown = [name for name in group_by if name not in GROUP_EXPRESSIONS]
+    if unknown:
+        raise ValueError(f"Unknown grouping: {', '.join(unknown)}")
+
+    group_columns = [GROUP_EXPRESSIONS[name] for name in group_by]
+    select = group_columns + [
+        "COALESCE(SUM(CASE WHEN type = 'income' THEN total END), 0)",
+        "COALESCE(SUM(CASE WHEN type = 'expense' THEN total END), 0)",
+        "COALESCE(SUM(count), 0)",
+    ]
+
+    sql = f'''SELECT {", ".join(select)} FROM daily_totals
+              WHERE date BETWEEN ? AND ? AND type IN ('income', 'expense')'''
+    if group_columns:
+        positions = ", ".join(str(i) for i in range(1, len(group_columns) + 1))
+        sql += f" GROUP BY {positions} ORDER BY {positions}"
+
+    result = AggregateResult(group_by)
+    width = len(group_columns)
+    for row in conn.execute(sql, (day_number(start_date), day_number(end_date))):
+        if not group_columns and row[width + 2] == 0:
+            break    # no matching transactions
+        result.append(tuple(row[:width]), row[width], row[width + 1], row[width + 2])
+
+    return result
@@ -1,10 +1,15 @@
-from database import create_connection
-from ui import main_menu
+import sys
 
-def main():
-    conn = create_connection('budget_tracker.db')
-    main_menu(conn)
-    conn.close()
+# starts the budget tracker; the GUI modules are only imported here, so `import app` stays cheap
+# db_file defaults to gui.DB_FILE; returns the exit code of the Qt event loop
+def main(argv=None, db_file=None):
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication(sys.argv if argv is None else argv)
+
+    from gui import BudgetTrackerApp
+    window = BudgetTrackerApp(db_file)
+    window.show()
+    return app.exec_()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from database import ConnectionManager
+from query import TransactionQuery
+from transactions import (
+    add_transaction,
+    add_transactions_bulk,
+    get_transaction_by_id,
+    update_transaction,
+    delete_transaction_by_id,
+    update_transactions,
+    delete_transactions,
+    filter_transactions_by_type,
+    filter_transactions_by_date_range,
+    summarize_transactions,
+    search_transactions_by_notes
+)
+
+
+# asyncio front end for transactions.py, for services that can't block their event loop
+# blocking sqlite calls run on executor threads: several readers with pooled read-only connections
+# and a single writer; at most max_pending calls are in flight, further callers wait their turn
+class AsyncTransactions:
+    def __init__(self, db_file, max_readers=4, max_pending=64, timeout=30.0, config=None):
+        config = {**(config or {}), "read_pool_size": max_readers}
+        self.manager = ConnectionManager(db_file, config)
+        self.readers = ThreadPoolExecutor(max_readers, thread_name_prefix="transactions-read")
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="transactions-write")
+        self.pending = asyncio.Semaphore(max_pending)
+        self.timeout = timeout    # default seconds per call, None waits forever
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    # runs fn(conn, *args, **kwargs) on the writer or a reader thread
+    # raises asyncio.TimeoutError after timeout seconds, interrupting the query if it has started
+    async def call(self, fn, *args, write=False, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+
+        state = {"conn": None, "timed_out": False}
+        lock = threading.Lock()
+
+        def work():
+            with self.manager.write() if write else self.manager.read() as conn:
+                with lock:
+                    if state["timed_out"]:
+                        raise asyncio.TimeoutError()    # gave up while this call was queued
+                    state["conn"] = conn
+                try:
+                    return fn(conn, *args, **kwargs)
+                finally:
+                    with lock:
+                        state["conn"] = None
+
+        async with self.pending:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.writer if write else self.readers, work)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                with lock:
+                    state["timed_out"] = True
+                    if state["conn"] is not None:
+                        state["conn"].interrupt()
+                raise
+
+    async def add_transaction(self, transaction, timeout=None):
+        return await self.call(add_transaction, transaction, write=True, timeout=timeout)
+
+    async def update_transaction(self, transaction_id, updated_transaction, timeout=None):
+        return await self.call(update_transaction, transaction_id, updated_transaction, write=True, timeout=timeout)
+
+    async def delete_transaction(self, transaction_id, timeout=None):
+        return await self.call(delete_transaction_by_id, transaction_id, write=True, timeout=timeout)
+
+    # set-based versions: one statement for every transaction in ids or matching query, return the row count
+    async def update_transactions(self, patch, ids=None, query=None, timeout=None):
+        return await self.call(update_transactions, patch, ids, query, write=True, timeout=timeout)
+
+    async def delete_transactions(self, ids=None, query=None, timeout=None):
+        return await self.call(delete_transactions, ids, query, write=True, timeout=timeout)
+
+    async def get_transaction(self, transaction_id, timeout=None):
+        return await self.call(get_transaction_by_id, transaction_id, timeout=timeout)
+
+    async def filter_by_type(self, transaction_type, timeout=None):
+        return await self.call(filter_transactions_by_type, transaction_type, timeout=timeout)
+
+    async def filter_by_date_range(self, start_date, end_date, timeout=None):
+        return await self.call(filter_transactions_by_date_range, start_date, end_date, timeout=timeout)
+
+    async def summarize(self, start_date, end_date, timeout=None):
+        return await self.call(summarize_transactions, start_date, end_date, timeout=timeout)
+
+    async def search_notes(self, keyword, timeout=None):
+        return await self.call(search_transactions_by_notes, keyword, timeout=timeout)
+
+    # all rows matching a TransactionQuery
+    async def query(self, query, timeout=None):
+        return await self.call(query.fetch_all, timeout=timeout)
+
+    # async for row in db.iterate(query): ... reads one page of batch_size rows per call
+    # pages continue from the last row with a keyset cursor, so each one is an index seek
+    async def iterate(self, query=None, batch_size=1000, timeout=None):
+        query = query or TransactionQuery()
+        if query.sort_column == "relevance":
+            for row in await self.query(query, timeout):    # ranked results can't be paged by key
+                yield row
+            return
+
+        remaining = query.row_limit
+        page_query = query
+        while remaining is None or remaining > 0:
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            page = await self.call(page_query.limit(size).fetch_all, timeout=timeout)
+            for row in page:
+                yield row
+            if len(page) < size:
+                break
+            if remaining is not None:
+                remaining -= len(page)
+            page_query = query.after(query.sort_key(page[-1]))
+
+    # inserts rows from a regular or async iterable, one batch per writer call
+    # a regular iterable (e.g. a file being parsed) is read on an executor thread, not on the event loop
+    # duplicates is "insert", "skip" or "merge" like add_transactions_bulk, and applies to the whole import
+    # returns (number of rows inserted, [(row number, error message), ...]) like add_transactions_bulk
+    async def add_transactions_bulk(self, transactions, batch_size=10000, duplicates="insert", timeout=None):
+        inserted = 0
+        rejected = []
+        offset = 0
+        import_state = {}
+
+        async def insert(batch):
+            nonlocal inserted, offset
+            count, batch_rejected = await self.call(add_transactions_bulk, batch, batch_size, duplicates=duplicates,
+                                                    import_state=import_state, write=True, timeout=timeout)
+            inserted += count
+            rejected.extend((offset + row_number, error) for row_number, error in batch_rejected)
+            offset += len(batch)
+
+        if hasattr(transactions, "__aiter__"):
+            batch = []
+            async for row in transactions:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await insert(batch)
+                    batch = []
+            if batch:
+                await insert(batch)
+        else:
+            loop = asyncio.get_running_loop()
+            rows = iter(transactions)
+            while batch := await loop.run_in_executor(None, lambda: list(islice(rows, batch_size))):
+                await insert(batch)
+
+        return inserted, rejected
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.shutdown)
+
+    def shutdown(self):
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        self.manager.close()
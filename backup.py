@@ -0,0 +1,358 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+import zlib
+from datetime import datetime
+from database import attach_archives
+
+# pages copied per backup step; the copy sleeps STEP_PAUSE seconds between steps so it doesn't
+# compete with the application for disk bandwidth (4 MB per step with 4 KiB pages)
+PAGES_PER_STEP = 1024
+STEP_PAUSE = 0.002
+
+# snapshots between two full ones; restoring reads the last full snapshot and every delta after it
+FULL_EVERY = 24
+
+# full snapshots kept, each with the deltas that follow it; older ones are deleted
+KEEP_FULL = 2
+
+# gzip level of snapshot files, 1 is several times faster than 9 and ledger pages still shrink a lot
+COMPRESS_LEVEL = 1
+
+MANIFEST = "manifest.json"
+PAGE_HEADER = struct.Struct(">I")    # page number in front of every stored page
+
+
+# copies the database behind conn to target with the online backup API, PAGES_PER_STEP pages at a time
+# the copy holds one read transaction throughout: with WAL, writers carry on committing during the copy
+# and the copy is still the database as of its start (a plain paged backup restarts after every commit)
+# schema picks an attached database instead of the main one, e.g. archive_2019
+# progress(pages_copied, page_count) is called after every step if given
+def copy_database(conn, target, pages=PAGES_PER_STEP, pause=STEP_PAUSE, progress=None, schema="main"):
+    def step(status, remaining, total):
+        if progress:
+            progress(total - remaining, total)
+        if pause and remaining:
+            time.sleep(pause)
+
+    dest = sqlite3.connect(target)
+    started_transaction = not conn.in_transaction
+    try:
+        if started_transaction:
+            conn.execute("BEGIN")
+            conn.execute(f"SELECT 1 FROM {schema}.sqlite_master LIMIT 1")    # pins the read snapshot
+        conn.backup(dest, pages=pages, progress=step, name=schema)
+    finally:
+        if started_transaction:
+            conn.rollback()
+        dest.close()
+
+
+def manifest_path(backup_dir):
+    return os.path.join(backup_dir, MANIFEST)
+
+
+# the snapshots in backup_dir, oldest first, as dicts with the keys written by snapshot_database()
+def list_snapshots(backup_dir):
+    try:
+        with open(manifest_path(backup_dir)) as file:
+            return json.load(file)["snapshots"]
+    except FileNotFoundError:
+        return []
+
+
+# replaces path with content in one step, a crash leaves either the old or the new file
+def write_atomically(path, content, mode="w"):
+    temp = path + ".tmp"
+    with open(temp, mode) as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp, path)
+
+
+# file holding one 16-byte hash per page of a snapshot, to find the pages the next snapshot has to store
+def page_hashes_path(backup_dir, entry):
+    return os.path.join(backup_dir, os.path.splitext(entry["file"])[0] + ".pages")
+
+
+def read_page_hashes(backup_dir, entry):
+    try:
+        with open(page_hashes_path(backup_dir, entry), "rb") as file:
+            content = file.read()
+    except FileNotFoundError:
+        return None
+    return [content[offset:offset + 16] for offset in range(0, len(content), 16)]
+
+
+# reads a database file page by page; yields (page number, page bytes, 16-byte hash of the page)
+def read_pages(filename, page_size):
+    with open(filename, "rb") as file:
+        number = 0
+        while page := file.read(page_size):
+            yield number, page, hashlib.blake2b(page, digest_size=16).digest()
+            number += 1
+
+
+def file_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        while block := file.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# stores a gzip copy of each archive database in archives, the (year, file) rows of the snapshot's archives
+# table, and returns their manifest entries. Copies are named after their content, an archive that didn't
+# change since an earlier snapshot is kept once. Archives are copied after the main database: a year
+# archived meanwhile can be in both, the state an interrupted archive_year() leaves, which archiving it
+# again clears up
+def snapshot_archives(conn, backup_dir, archives):
+    if archives:
+        attach_archives(conn)
+    entries = []
+    copy = os.path.join(backup_dir, "archive.tmp")
+    for year, file in archives:
+        try:
+            copy_database(conn, copy, schema=f"archive_{year}")
+            sha256 = file_sha256(copy)
+            stored = f"archive-{year}-{sha256[:16]}.gz"
+            path = os.path.join(backup_dir, stored)
+            if not os.path.exists(path):
+                with open(copy, "rb") as source, gzip.open(path + ".tmp", "wb", compresslevel=COMPRESS_LEVEL) as out:
+                    shutil.copyfileobj(source, out)
+                    out.flush()
+                    os.fsync(out.fileobj.fileno())
+                os.replace(path + ".tmp", path)
+        finally:
+            for temp in (copy, copy + "-journal"):
+                if os.path.exists(temp):
+                    os.remove(temp)
+        entries.append({"year": year, "file": file, "archive": stored, "sha256": sha256})
+    return entries
+
+
+# takes a snapshot of the database behind conn into backup_dir (created if needed) without stopping writers
+# a snapshot is a gzip file of changed pages: the first one, every FULL_EVERY-th one and any that
+# changes more than half of the database store every page, the others only the pages that changed since
+# the previous snapshot, found by comparing page hashes. The database is first copied with
+# copy_database() next to the snapshots, so that much free space is needed while it runs.
+# The archive databases registered in it are stored as well, see snapshot_archives()
+# returns the manifest entry of the new snapshot
+def snapshot_database(conn, backup_dir, full_every=FULL_EVERY, keep_full=KEEP_FULL, full=False, progress=None):
+    os.makedirs(backup_dir, exist_ok=True)
+    snapshots = list_snapshots(backup_dir)
+    previous = snapshots[-1] if snapshots else None
+    number = previous["number"] + 1 if previous else 1
+    file = f"snapshot-{number:06d}.gz"
+
+    copy = os.path.join(backup_dir, "copy.tmp")
+    started = time.perf_counter()
+    try:
+        copy_database(conn, copy, progress=progress)
+        check = sqlite3.connect(copy)
+        page_size = check.execute("PRAGMA page_size").fetchone()[0]
+        schema_version = check.execute("PRAGMA user_version").fetchone()[0]
+        has_archives = check.execute("SELECT 1 FROM sqlite_master WHERE name = 'archives'").fetchone()
+        archives = check.execute("SELECT year, file FROM archives ORDER BY year").fetchall() if has_archives else []
+        check.close()
+
+        deltas = 0
+        for entry in reversed(snapshots):
+            if entry["full"]:
+                break
+            deltas += 1
+        old_hashes = None
+        if not full and previous and previous["page_size"] == page_size and deltas + 1 < full_every:
+            old_hashes = read_page_hashes(backup_dir, previous)
+
+        # changed pages are found before anything is written, so a big change can become a full snapshot
+        digest = hashlib.sha256()
+        hashes, changed = [], []
+        for page_number, page, page_hash in read_pages(copy, page_size):
+            digest.update(page)
+            hashes.append(page_hash)
+            if old_hashes is None or page_number >= len(old_hashes) or old_hashes[page_number] != page_hash:
+                changed.append(page_number)
+        is_full = old_hashes is None or len(changed) * 2 > len(hashes)
+        stored = range(len(hashes)) if is_full else changed
+
+        with open(copy, "rb") as pages, gzip.open(os.path.join(backup_dir, file), "wb", compresslevel=COMPRESS_LEVEL) as out:
+            for page_number in stored:
+                pages.seek(page_number * page_size)
+                out.write(PAGE_HEADER.pack(page_number))
+                out.write(pages.read(page_size))
+            out.flush()
+            os.fsync(out.fileobj.fileno())
+        stored_archives = snapshot_archives(conn, backup_dir, archives)
+    finally:
+        for path in (copy, copy + "-journal", copy + "-wal", copy + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    entry = {
+        "number": number,
+        "file": file,
+        "full": is_full,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "page_size": page_size,
+        "page_count": len(hashes),
+        "stored_pages": len(stored),
+        "bytes": os.path.getsize(os.path.join(backup_dir, file)),
+        "sha256": digest.hexdigest(),
+        "schema_version": schema_version,
+        "archives": stored_archives,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    write_atomically(page_hashes_path(backup_dir, entry), b"".join(hashes), "wb")
+
+    # the manifest is written last: until then the new files are ignored, and the next snapshot overwrites them
+    snapshots.append(entry)
+    fulls = [index for index, item in enumerate(snapshots) if item["full"]]
+    dropped = snapshots[:fulls[-keep_full]] if len(fulls) > keep_full else []
+    write_atomically(manifest_path(backup_dir), json.dumps({"snapshots": snapshots[len(dropped):]}, indent=2))
+
+    stale = [os.path.join(backup_dir, item["file"]) for item in dropped]
+    if previous:
+        stale.append(page_hashes_path(backup_dir, previous))    # only the newest snapshot's page hashes are used
+    kept_archives = {archive["archive"] for item in snapshots[len(dropped):] for archive in item.get("archives", [])}
+    stale += [os.path.join(backup_dir, item["archive"]) for entry in dropped for item in entry.get("archives", [])
+              if item["archive"] not in kept_archives]
+    for path in stale:
+        if os.path.exists(path):
+            os.remove(path)
+    return entry
+
+
+# writes the pages of a chain of snapshots (a full one and the deltas after it) into target
+# and returns the sha256 of the result, which has the page count of the last snapshot
+def apply_snapshots(backup_dir, chain, target):
+    page_size = chain[-1]["page_size"]
+    with open(target, "wb") as out:
+        for entry in chain:
+            with gzip.open(os.path.join(backup_dir, entry["file"]), "rb") as file:
+                while header := file.read(PAGE_HEADER.size):
+                    page_number, = PAGE_HEADER.unpack(header)
+                    out.seek(page_number * page_size)
+                    out.write(file.read(page_size))
+        out.truncate(chain[-1]["page_count"] * page_size)
+        out.flush()
+        os.fsync(out.fileno())
+
+    digest = hashlib.sha256()
+    for _, page, _ in read_pages(target, page_size):
+        digest.update(page)
+    return digest.hexdigest()
+
+
+# rebuilds snapshot (a file name from list_snapshots(), the newest by default) and swaps it in for db_file
+# the rebuilt file must match the snapshot's checksum and pass PRAGMA quick_check before it replaces anything;
+# thorough=True runs PRAGMA integrity_check instead, which also compares every index with its table and
+# takes several times longer. The snapshot's archive databases are rebuilt and checked the same way and
+# replace the archive files next to db_file. The swap is a rename per file, the main database first.
+# Run it with the application closed; raises ValueError if the snapshot is missing or damaged, or an archive
+# it registers is neither in the snapshot nor next to db_file. Returns the manifest entry that was restored
+def restore_database(db_file, backup_dir, snapshot=None, thorough=False):
+    snapshots = list_snapshots(backup_dir)
+    files = [entry["file"] for entry in snapshots]
+    if not snapshots:
+        raise ValueError(f"No snapshots in {backup_dir}.")
+    if snapshot is not None and snapshot not in files:
+        raise ValueError(f"No snapshot {snapshot} in {backup_dir}.")
+    index = files.index(snapshot) if snapshot is not None else len(snapshots) - 1
+    start = max(position for position in range(index + 1) if snapshots[position]["full"])
+    chain = snapshots[start:index + 1]
+    entry = chain[-1]
+
+    temp = db_file + ".restore"
+    try:
+        try:
+            restored = apply_snapshots(backup_dir, chain, temp)
+        except (OSError, EOFError, zlib.error) as e:    # a missing or truncated file in the chain
+            raise ValueError(f"Snapshot {entry['file']} can't be read: {e}")
+        if restored != entry["sha256"]:
+            raise ValueError(f"Snapshot {entry['file']} doesn't match its checksum.")
+        check = sqlite3.connect(temp)
+        try:
+            problems = [row[0] for row in check.execute("PRAGMA integrity_check" if thorough else "PRAGMA quick_check")]
+        finally:
+            check.close()
+        if problems != ["ok"]:
+            raise ValueError(f"Snapshot {entry['file']} failed the integrity check: {problems[0]}")
+
+        archives = restore_archives(backup_dir, entry, temp, os.path.dirname(os.path.abspath(db_file)))
+        swap_database(temp, db_file)
+        for archive_temp, archive_file in archives:
+            swap_database(archive_temp, archive_file)
+    finally:
+        for path in (temp, temp + "-wal", temp + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        for archive in entry.get("archives", []):
+            path = os.path.join(os.path.dirname(os.path.abspath(db_file)), archive["file"] + ".restore")
+            if os.path.exists(path):
+                os.remove(path)
+    return entry
+
+
+# rebuilds the archive databases of a snapshot next to the restored database as <file>.restore and checks
+# their checksums; returns [(rebuilt file, archive file)]. Archives the restored database registers but the
+# snapshot doesn't hold (snapshots taken before archives were stored) have to exist already
+def restore_archives(backup_dir, entry, restored_file, directory):
+    check = sqlite3.connect(restored_file)
+    try:
+        has_archives = check.execute("SELECT 1 FROM sqlite_master WHERE name = 'archives'").fetchone()
+        registered = [row[0] for row in check.execute("SELECT file FROM archives")] if has_archives else []
+    finally:
+        check.close()
+
+    archives = []
+    for archive in entry.get("archives", []):
+        target = os.path.join(directory, archive["file"])
+        try:
+            with gzip.open(os.path.join(backup_dir, archive["archive"]), "rb") as source, \
+                    open(target + ".restore", "wb") as out:
+                shutil.copyfileobj(source, out)
+                out.flush()
+                os.fsync(out.fileno())
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValueError(f"Archive {archive['archive']} can't be read: {e}")
+        if file_sha256(target + ".restore") != archive["sha256"]:
+            raise ValueError(f"Archive {archive['archive']} doesn't match its checksum.")
+        archives.append((target + ".restore", target))
+
+    stored = {archive["file"] for archive in entry.get("archives", [])}
+    missing = [file for file in registered if file not in stored and not os.path.exists(os.path.join(directory, file))]
+    if missing:
+        raise ValueError(f"Snapshot {entry['file']} needs archive {missing[0]}, which is neither in the snapshot "
+                         f"nor next to the database.")
+    return archives
+
+
+# replaces db_file with the database file new_file in one rename
+# the old write-ahead log is checkpointed first; SQLite removes it when the last connection closes,
+# so a log that is still there means the application has the database open
+def swap_database(new_file, db_file):
+    if os.path.exists(db_file):
+        conn = sqlite3.connect(db_file)
+        try:
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+        finally:
+            conn.close()
+        if busy or os.path.exists(db_file + "-wal"):
+            raise RuntimeError(f"{db_file} is in use, close the application before restoring.")
+        if os.path.exists(db_file + "-shm"):
+            os.remove(db_file + "-shm")
+
+    os.replace(new_file, db_file)
+    if hasattr(os, "O_DIRECTORY"):    # make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(db_file)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from async_transactions import AsyncTransactions
+from benchmarks.generator import create_ledger
+from query import TransactionQuery
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+def summarize_latencies(latencies, duration):
+    return {
+        "operations": len(latencies),
+        "ops_per_second": len(latencies) / duration,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+
+# a reader issuing random date-range, type and summary queries until the deadline
+async def reader(db, rng, deadline, latencies):
+    while time.perf_counter() < deadline:
+        year = rng.randint(2015, 2024)
+        month = rng.randint(1, 12)
+        start, end = f"{year}-{month:02d}-01", f"{year}-{month:02d}-28"
+        started = time.perf_counter()
+        choice = rng.random()
+        if choice < 0.4:
+            await db.filter_by_date_range(start, end)
+        elif choice < 0.7:
+            await db.summarize(f"{year}-01-01", f"{year}-12-31")
+        else:
+            await db.query(TransactionQuery().where_type("income").between(start, end).limit(100))
+        latencies.append(time.perf_counter() - started)
+
+# the single writer, adding one transaction per call until the deadline
+async def writer(db, rng, deadline, latencies):
+    while time.perf_counter() < deadline:
+        transaction = ("expense", "load test", rng.randint(100, 10000), f"2024-{rng.randint(1, 12):02d}-15", None)
+        started = time.perf_counter()
+        await db.add_transaction(transaction)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(db_file, readers, duration, seed):
+    read_latencies = []
+    write_latencies = []
+    async with AsyncTransactions(db_file, max_readers=min(readers, 8)) as db:
+        deadline = time.perf_counter() + duration
+        tasks = [reader(db, random.Random(seed + i), deadline, read_latencies) for i in range(readers)]
+        tasks.append(writer(db, random.Random(seed - 1), deadline, write_latencies))
+        await asyncio.gather(*tasks)
+
+    return {
+        "readers": readers,
+        "duration_seconds": duration,
+        "reads": summarize_latencies(read_latencies, duration),
+        "writes": summarize_latencies(write_latencies, duration),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test AsyncTransactions with concurrent readers and one writer")
+    parser.add_argument("--rows", type=int, default=100_000, help="size of the generated ledger")
+    parser.add_argument("--readers", default="1,4,16", help="comma separated numbers of concurrent readers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        db_file = os.path.join(scratch_dir, "ledger.db")
+        create_ledger(db_file, args.rows, seed=args.seed)
+
+        results = []
+        for readers in (int(count) for count in args.readers.split(",")):
+            result = asyncio.run(run(db_file, readers, args.duration, args.seed))
+            results.append(result)
+            print(f"{readers:3} readers: {result['reads']['ops_per_second']:9.1f} reads/s "
+                  f"(p95 {result['reads']['p95_ms']:.2f} ms), "
+                  f"{result['writes']['ops_per_second']:8.1f} writes/s "
+                  f"(p95 {result['writes']['p95_ms']:.2f} ms)", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from backup import restore_database, snapshot_database
+from benchmarks.generator import create_ledger
+from database import create_connection
+from transactions import add_transaction, update_transactions
+
+
+def summarize_writes(latencies):
+    latencies = sorted(latencies)
+    return {
+        "writes": len(latencies),
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None,
+    }
+
+
+# adds a transaction every few milliseconds on its own connection until stop is set,
+# to see whether a snapshot running at the same time holds up the application's writes
+def writer(db_file, stop, latencies):
+    conn = create_connection(db_file)
+    rng = random.Random(7)
+    while not stop.is_set():
+        transaction = ("expense", "backup test", rng.randint(100, 10000), "2024-06-15", None)
+        started = time.perf_counter()
+        add_transaction(conn, transaction)
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+    conn.close()
+
+
+# snapshot_database() while a writer is running; returns (manifest entry, write latencies)
+def snapshot_during_writes(db_file, backup_dir, full=False):
+    stop, latencies = threading.Event(), []
+    thread = threading.Thread(target=writer, args=(db_file, stop, latencies))
+    thread.start()
+    conn = create_connection(db_file, read_only=True)
+    try:
+        entry = snapshot_database(conn, backup_dir, full=full)
+    finally:
+        stop.set()
+        thread.join()
+        conn.close()
+    return entry, latencies
+
+
+def snapshot_result(entry, latencies, db_bytes):
+    return {
+        "seconds": entry["seconds"],
+        "mb_per_second": db_bytes / 1e6 / entry["seconds"],
+        "stored_pages": entry["stored_pages"],
+        "page_count": entry["page_count"],
+        "bytes": entry["bytes"],
+        "writes_during_snapshot": summarize_writes(latencies),
+    }
+
+
+def restore_result(db_file, backup_dir, thorough):
+    started = time.perf_counter()
+    restore_database(db_file, backup_dir, thorough=thorough)
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "mb_per_second": os.path.getsize(db_file) / 1e6 / seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure snapshot and restore throughput")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="size of the generated ledger")
+    parser.add_argument("--changed", type=float, default=0.01, help="share of rows updated before the delta snapshot")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        ledger = os.path.join(scratch_dir, "ledger.db")
+        backup_dir = os.path.join(scratch_dir, "backups")
+        create_ledger(ledger, args.rows, seed=args.seed)
+        db_bytes = os.path.getsize(ledger)
+
+        full, full_writes = snapshot_during_writes(ledger, backup_dir, full=True)
+
+        conn = create_connection(ledger)
+        count = conn.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+        ids = random.Random(args.seed).sample(range(1, count + 1), int(count * args.changed))
+        update_transactions(conn, {"notes": "changed"}, ids=ids)
+        conn.close()
+        delta, delta_writes = snapshot_during_writes(ledger, backup_dir)
+
+        results = {
+            "rows": args.rows,
+            "database_bytes": db_bytes,
+            "full_snapshot": snapshot_result(full, full_writes, db_bytes),
+            "delta_snapshot": snapshot_result(delta, delta_writes, db_bytes),
+            "restore": restore_result(os.path.join(scratch_dir, "restored.db"), backup_dir, thorough=False),
+            "restore_thorough": restore_result(os.path.join(scratch_dir, "restored.db"), backup_dir, thorough=True),
+        }
+
+    print(f"database {results['database_bytes'] / 1e6:.1f} MB, {args.rows} rows")
+    for name in ("full_snapshot", "delta_snapshot"):
+        result = results[name]
+        writes = result["writes_during_snapshot"]
+        print(f"{name:17} {result['seconds']:7.2f} s  {result['mb_per_second']:7.1f} MB/s  "
+              f"{result['stored_pages']:>8} pages  {result['bytes'] / 1e6:8.1f} MB   "
+              f"concurrent writes p50 {writes['p50_ms']:.2f} ms, max {writes['max_ms']:.2f} ms")
+    for name in ("restore", "restore_thorough"):
+        print(f"{name:17} {results[name]['seconds']:7.2f} s  {results[name]['mb_per_second']:7.1f} MB/s")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
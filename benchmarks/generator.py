@@ -0,0 +1,35 @@
+import random
+from datetime import date, timedelta
+from database import create_connection, create_table
+from transactions import add_transactions_bulk
+
+WORDS = ("coffee", "groceries", "rent", "uber", "ride", "airport", "dinner", "lunch", "salary", "bonus",
+         "gym", "netflix", "electric", "water", "bill", "gift", "birthday", "refund", "book", "pharmacy",
+         "gas", "parking", "hotel", "flight", "market", "whole", "foods", "amazon", "order", "monthly")
+
+
+# yields a reproducible stream of (type, category, amount, date, notes) rows
+# notes_length is the (min, max) number of words in each note
+# the same arguments always produce the same rows, so results are comparable between runs
+def generate_transactions(rows, categories=20, start_date="2015-01-01", days=3650, notes_length=(0, 8), seed=42):
+    rng = random.Random(seed)
+    first_day = date.fromisoformat(start_date)
+    category_names = [f"category{i:03d}" for i in range(categories)]
+    dates = [(first_day + timedelta(days=offset)).isoformat() for offset in range(days)]
+    min_words, max_words = notes_length
+
+    for _ in range(rows):
+        transaction_type = "income" if rng.random() < 0.2 else "expense"
+        amount = round(rng.lognormvariate(3.5, 1.2), 2)
+        words = rng.randint(min_words, max_words)
+        notes = " ".join(rng.choice(WORDS) for _ in range(words)) or None
+        yield (transaction_type, rng.choice(category_names), amount, rng.choice(dates), notes)
+
+
+# creates a database file filled with generated transactions
+def create_ledger(db_file, rows, **options):
+    conn = create_connection(db_file)
+    create_table(conn)
+    add_transactions_bulk(conn, generate_transactions(rows, **options), batch_size=50000)
+    conn.execute("ANALYZE")
+    conn.close()
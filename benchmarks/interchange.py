@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from benchmarks.generator import create_ledger
+from database import create_connection, create_table
+from importers import import_transactions
+from transactions import export_to_csv, export_to_arrow
+
+# file formats compared, by file name
+FORMATS = ("export.csv", "export.csv.gz", "export.arrow", "export.parquet")
+
+
+# exports the ledger to every format and imports each file into a new database
+# returns {file name: {"export_seconds", "bytes", "import_seconds", "rows"}}
+def round_trip(ledger, scratch_dir):
+    results = {}
+    for name in FORMATS:
+        export_file = os.path.join(scratch_dir, name)
+        export = export_to_arrow if name.endswith((".arrow", ".parquet")) else export_to_csv
+
+        conn = create_connection(ledger, read_only=True)
+        started = time.perf_counter()
+        rows = export(conn, export_file)
+        export_seconds = time.perf_counter() - started
+        conn.close()
+
+        target = os.path.join(scratch_dir, f"import_{name}.db")
+        conn = create_connection(target)
+        create_table(conn)
+        started = time.perf_counter()
+        imported, rejected = import_transactions(conn, export_file, batch_size=50000)
+        import_seconds = time.perf_counter() - started
+        conn.close()
+        if imported != rows or rejected:
+            raise RuntimeError(f"{name}: exported {rows} rows but imported {imported} ({len(rejected)} rejected)")
+
+        results[name] = {
+            "rows": rows,
+            "export_seconds": export_seconds,
+            "bytes": os.path.getsize(export_file),
+            "import_seconds": import_seconds,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CSV, Arrow and Parquet export and import")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="size of the generated ledger")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        ledger = os.path.join(scratch_dir, "ledger.db")
+        create_ledger(ledger, args.rows, seed=args.seed)
+        results = round_trip(ledger, scratch_dir)
+
+    for name, result in results.items():
+        print(f"{name:16} export {result['export_seconds']:8.2f} s   {result['bytes'] / 1e6:9.1f} MB   "
+              f"import {result['import_seconds']:8.2f} s")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
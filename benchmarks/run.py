@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks.generator import create_ledger
+from database import create_connection
+from reports import category_month_report
+from transactions import (
+    add_transaction,
+    get_transactions,
+    filter_transactions_by_type,
+    filter_transactions_by_date_range,
+    summarize_transactions,
+    search_transactions_by_notes,
+    export_to_csv,
+    query_cache
+)
+
+DEFAULT_SIZES = (10_000, 1_000_000, 10_000_000)
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+# resets the peak resident set size (VmHWM) to the current size, so the next reading covers one operation
+# returns False where that isn't possible (only Linux allows it), peak_rss_mb() is then the process's peak so far
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# peak resident set size in MB since the last reset_peak_rss(), or since the process started
+# (ru_maxrss is KiB on Linux, bytes on macOS)
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# the operations that are timed, each returns the number of rows it handled
+def benchmark_operations(conn, db_file, scratch_dir):
+    export_file = os.path.join(scratch_dir, "export.csv")
+
+    def add_one():
+        add_transaction(conn, ("expense", "benchmark", 1234, "2020-06-15", "benchmark insert"))
+        return 1
+
+    return {
+        "add_transaction": add_one,
+        "get_transactions": lambda: len(get_transactions(conn)),
+        "filter_transactions_by_type": lambda: len(filter_transactions_by_type(conn, "income")),
+        "filter_transactions_by_date_range": lambda: len(filter_transactions_by_date_range(conn, "2020-01-01", "2020-01-31")),
+        "summarize_transactions": lambda: summarize_transactions(conn, "2016-01-01", "2023-12-31") and 1,
+        "search_transactions_by_notes": lambda: len(search_transactions_by_notes(conn, "uber")),
+        "export_to_csv": lambda: export_to_csv(conn, export_file, buffer_size=5000),
+        "category_month_report": lambda: len(category_month_report(db_file, "2016-01-01", "2023-12-31")["months"]),
+    }
+
+
+# memory one run of operation needs: the peak of Python allocations made during it (tracemalloc, which also
+# sees the rows sqlite3 returns but not SQLite's own page cache) and the growth of the peak RSS over the
+# RSS before it, which includes SQLite. Run separately from the timed runs, tracemalloc slows everything down
+def measure_memory(operation):
+    query_cache.clear()
+    rss_reset = reset_peak_rss()
+    rss_before = peak_rss_mb()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_python_mb": peak / (1024 * 1024),
+        "peak_rss_growth_mb": peak_rss_mb() - rss_before if rss_reset else None,
+    }
+
+
+# runs one operation repeat times, returns latency percentiles (ms), throughput and the memory of one run
+def time_operation(operation, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        query_cache.clear()    # time the queries themselves, not cache hits
+        started = time.perf_counter()
+        rows = operation()
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    median = statistics.median(timings)
+    return {
+        "runs": repeat,
+        "rows": rows,
+        "p50_ms": median * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+        "rows_per_second": rows / median if median > 0 else None,
+        **measure_memory(operation),
+    }
+
+
+def run_size(rows, args):
+    ledger = os.path.join(args.data_dir, f"ledger_{rows}.db")
+    if not os.path.exists(ledger):
+        print(f"generating {rows} rows into {ledger}...", flush=True)
+        create_ledger(ledger, rows, seed=args.seed)
+
+    # benchmark a copy so inserts don't change the cached ledger
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        db_file = os.path.join(scratch_dir, "ledger.db")
+        source = create_connection(ledger)
+        conn = create_connection(db_file)
+        source.backup(conn)
+        source.close()
+
+        results = {}
+        for name, operation in benchmark_operations(conn, db_file, scratch_dir).items():
+            if args.only and name not in args.only:
+                continue
+            repeat = args.insert_repeat if name == "add_transaction" else args.repeat
+            results[name] = time_operation(operation, repeat)
+            print(f"  {name:35} p50 {results[name]['p50_ms']:10.2f} ms  "
+                  f"peak {results[name]['peak_python_mb']:8.1f} MB", flush=True)
+
+        conn.close()
+    return results
+
+
+# differences below these aren't reported, sub-millisecond timings and small allocations vary from run to run
+LATENCY_SLACK_MS = 1.0
+MEMORY_SLACK_MB = 1.0
+
+
+# returns a message for every operation whose median latency or peak memory got worse than tolerance allows
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for size, operations in results.items():
+        for name, result in operations.items():
+            previous = baseline.get(size, {}).get(name)
+            if not previous:
+                continue
+            if result["p50_ms"] > previous["p50_ms"] * (1 + tolerance) + LATENCY_SLACK_MS:
+                regressions.append(f"{name} at {size} rows: {result['p50_ms']:.2f} ms "
+                                   f"(baseline {previous['p50_ms']:.2f} ms)")
+            memory, previous_memory = result.get("peak_python_mb"), previous.get("peak_python_mb")
+            if previous_memory is not None and memory > previous_memory * (1 + tolerance) + MEMORY_SLACK_MB:
+                regressions.append(f"{name} at {size} rows: peak {memory:.1f} MB "
+                                   f"(baseline {previous_memory:.1f} MB)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transactions API on synthetic ledgers")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated ledger sizes in rows")
+    parser.add_argument("--only", nargs="*", help="only run these operations")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per query operation")
+    parser.add_argument("--insert-repeat", type=int, default=200, help="runs of add_transaction")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "budget_benchmarks"),
+                        help="where generated ledgers are cached between runs")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+
+    results = {}
+    for size in (int(size) for size in args.sizes.split(",")):
+        print(f"{size} rows", flush=True)
+        results[str(size)] = run_size(size, args)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline to compare against, run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    # timings only compare on the machine and Python the baseline was recorded with
+    if (baseline["python"], baseline["platform"]) != (report["python"], report["platform"]):
+        print(f"note: the baseline was recorded with Python {baseline['python']} on {baseline['platform']}, "
+              "record one on this machine with --save-baseline for a meaningful comparison")
+    regressions = find_regressions(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+    if not regressions:
+        print(f"no regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
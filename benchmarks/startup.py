@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.generator import create_ledger
+
+# dialogs opened by the main window buttons, by BudgetTrackerApp method
+DIALOGS = (
+    "add_transaction_ui",
+    "view_transactions_ui",
+    "filter_transactions_ui",
+    "show_date_range_input",
+    "delete_transaction_ui",
+    "edit_transaction_ui",
+    "search_transactions_ui",
+    "summarize_transactions_ui",
+    "charts_ui",
+    "diagnostics_ui",
+)
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        "runs": len(timings),
+        "p50_ms": statistics.median(timings) * 1000,
+        "max_ms": timings[-1] * 1000,
+    }
+
+
+# runs in a child process: starts the app like app.main() and reports the wall clock time
+# at which the main window was shown, once the event loop is running
+def child(db_file):
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication([sys.argv[0]])
+
+    from gui import BudgetTrackerApp
+    window = BudgetTrackerApp(db_file)
+    window.show()
+
+    shown = []
+    QTimer.singleShot(0, lambda: (shown.append(time.time()), app.quit()))
+    app.exec_()
+    window.close()
+    print(json.dumps({"shown": shown[0]}))
+
+
+# seconds from launching a new interpreter until the main window is shown
+def cold_start(db_file):
+    started = time.time()
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child", db_file],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])["shown"] - started
+
+
+# seconds from clicking a button until its dialog is on screen, for the first and later opens
+def dialog_latencies(db_file, runs):
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication([sys.argv[0]])
+
+    from gui import BudgetTrackerApp
+    window = BudgetTrackerApp(db_file)
+    window.show()
+
+    results = {}
+    for name in DIALOGS:
+        timings = []
+        for _ in range(runs):
+            opened = []
+
+            def close_dialog():
+                opened.append(time.perf_counter())
+                app.activeModalWidget().reject()
+
+            QTimer.singleShot(0, close_dialog)    # fires once the dialog's event loop is running
+            started = time.perf_counter()
+            getattr(window, name)()
+            timings.append(opened[0] - started)
+
+        results[name] = {"first_ms": timings[0] * 1000, "reopen": summarize(timings[1:])}
+
+    window.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure GUI startup time and dialog open latency")
+    parser.add_argument("--rows", type=int, default=100_000, help="size of the generated ledger")
+    parser.add_argument("--runs", type=int, default=10, help="starts and dialog opens to time")
+    parser.add_argument("--offscreen", action="store_true", help="run without a display (QT_QPA_PLATFORM=offscreen)")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+    if args.offscreen:
+        os.environ["QT_QPA_PLATFORM"] = "offscreen"    # inherited by the child processes
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        ledger = os.path.join(scratch_dir, "ledger.db")
+        create_ledger(ledger, args.rows)
+
+        # a new database also runs the schema migrations, an existing one should skip them
+        new_database = [cold_start(os.path.join(scratch_dir, f"new_{run}.db")) for run in range(args.runs)]
+        existing_database = [cold_start(ledger) for _ in range(args.runs)]
+        results = {
+            "rows": args.rows,
+            "cold_start_new_database": summarize(new_database),
+            "cold_start": summarize(existing_database),
+            "dialogs": dialog_latencies(ledger, args.runs),
+        }
+
+    print(f"cold start (new database)   p50 {results['cold_start_new_database']['p50_ms']:8.1f} ms")
+    print(f"cold start ({args.rows} rows)  p50 {results['cold_start']['p50_ms']:8.1f} ms")
+    for name, timing in results["dialogs"].items():
+        print(f"  {name:28} first {timing['first_ms']:8.2f} ms   reopen p50 {timing['reopen']['p50_ms']:8.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
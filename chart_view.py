@@ -0,0 +1,103 @@
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
+from matplotlib.figure import Figure
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout
+from charts import chart_data
+from dates import EPOCH
+
+# matplotlib date number of day number 0, chart x values are day number + DATE_OFFSET
+DATE_OFFSET = mdates.date2num(EPOCH)
+
+# quiet time after the last pan or zoom step before the visible range is queried
+RELOAD_DELAY_MS = 200
+
+# share of the visible width also loaded on each side, so a short pan shows data before the reload
+MARGIN = 0.5
+
+
+# balance over time and stacked per-category spending, sharing a date axis
+# every draw is at most charts.POINT_BUDGET line points and charts.SPENDING_BUCKETS bars, so redraws
+# take the same time for any ledger size; after a pan or zoom only the visible range is queried again
+class ChartWidget(QWidget):
+    def __init__(self, workers, parent=None):
+        super().__init__(parent)
+        self.workers = workers
+        self.loaded = None    # (first day, last day) of the data on screen
+        self.pending = None    # task loading chart data
+
+        self.figure = Figure(figsize=(8, 6), tight_layout=True)
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.balance_axes, self.spending_axes = self.figure.subplots(2, 1, sharex=True)
+        self.balance_axes.set_title("Balance")
+        self.spending_axes.set_title("Spending by Category")
+        self.balance_line, = self.balance_axes.plot([], [])
+        self.spending_bars = []
+        self.spending_axes.xaxis.set_major_formatter(mdates.ConciseDateFormatter(self.spending_axes.xaxis.get_major_locator()))
+
+        self.reload_timer = QTimer(self)
+        self.reload_timer.setSingleShot(True)
+        self.reload_timer.setInterval(RELOAD_DELAY_MS)
+        self.reload_timer.timeout.connect(self.load_visible)
+        self.balance_axes.callbacks.connect("xlim_changed", lambda axes: self.reload_timer.start())
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(NavigationToolbar2QT(self.canvas, self))
+        layout.addWidget(self.canvas)
+
+    # loads the whole ledger and fits it to the window
+    def load(self):
+        self.loaded = None
+        self.request(None, None, fit=True)
+
+    # queries the visible date range plus a margin, unless the data on screen already covers it
+    # at about the same level of detail (after zooming in, the finer buckets are loaded)
+    def load_visible(self):
+        start, end = self.balance_axes.get_xlim()
+        first_day, last_day = int(start - DATE_OFFSET), int(end - DATE_OFFSET)
+        if self.loaded is not None:
+            loaded_first, loaded_last = self.loaded
+            covered = loaded_first <= first_day and last_day <= loaded_last
+            if covered and loaded_last - loaded_first <= (1 + 2 * MARGIN) * (last_day - first_day + 1):
+                return
+        margin = int((last_day - first_day) * MARGIN)
+        self.request(first_day - margin, last_day + margin)
+
+    def request(self, first_day, last_day, fit=False):
+        if self.pending is not None:
+            self.pending.cancel()    # an older range, the user has moved on
+        task = self.pending = self.workers.read(
+            chart_data, first_day, last_day,
+            on_result=lambda data: self.loaded_data(task, data, fit),
+            on_error=lambda error: self.loaded_data(task, None, fit))
+
+    def loaded_data(self, task, data, fit):
+        if task is not self.pending:
+            return
+        self.pending = None
+        if data is None:
+            return
+        self.loaded = (data["first_day"], data["last_day"])
+
+        days, balances = data["balance"]
+        self.balance_line.set_data([day + DATE_OFFSET for day in days], [cents / 100 for cents in balances])
+
+        for bars in self.spending_bars:
+            bars.remove()
+        bucket_starts, width, spending = data["spending"]
+        x = [day + DATE_OFFSET for day in bucket_starts]
+        bottom = [0] * len(x)
+        self.spending_bars = []
+        for category, values in spending.items():
+            heights = [cents / 100 for cents in values]
+            self.spending_bars.append(self.spending_axes.bar(x, heights, width, bottom=bottom, align="edge", label=category))
+            bottom = [b + h for b, h in zip(bottom, heights)]
+        if spending:
+            self.spending_axes.legend(loc="upper left", fontsize="small")
+
+        for axes in (self.balance_axes, self.spending_axes):
+            axes.relim()
+            axes.autoscale_view(scalex=False)
+        if fit:
+            self.balance_axes.set_xlim(data["first_day"] + DATE_OFFSET, data["last_day"] + 1 + DATE_OFFSET)
+        self.canvas.draw_idle()
@@ -0,0 +1,119 @@
+# points drawn per line, what a chart draws stays this size however large the ledger is
+POINT_BUDGET = 500
+
+# SQL buckets read per drawn point, LTTB then keeps the most significant point of each group
+BUCKETS_PER_POINT = 4
+
+# bars in the spending chart, each stacked by category
+SPENDING_BUCKETS = 60
+
+# categories shown on their own in the spending chart, the rest are added up as "Other"
+TOP_CATEGORIES = 8
+
+# charts read the daily_totals rollup, which also covers archived years,
+# so a query costs one row per day and category in the window rather than one per transaction
+NET_BY_BUCKET_QUERY = '''SELECT MAX(date), SUM(CASE WHEN type = 'income' THEN total ELSE -total END) FROM daily_totals
+                         WHERE date BETWEEN ? AND ? AND type IN ('income', 'expense')
+                         GROUP BY (date - ?) / ? ORDER BY 1'''
+
+OPENING_BALANCE_QUERY = '''SELECT COALESCE(SUM(CASE WHEN type = 'income' THEN total ELSE -total END), 0) FROM daily_totals
+                           WHERE date < ? AND type IN ('income', 'expense')'''
+
+SPENDING_BY_BUCKET_QUERY = '''SELECT (date - ?) / ?, category, SUM(total) FROM daily_totals
+                              WHERE date BETWEEN ? AND ? AND type = 'expense'
+                              GROUP BY 1, 2'''
+
+
+# days per bucket so that the inclusive range [first_day, last_day] fits in at most `buckets` buckets
+def bucket_days(first_day, last_day, buckets):
+    return max(1, -(-(last_day - first_day + 1) // max(1, buckets)))    # ceiling division
+
+
+# first and last day number with transactions, (None, None) for an empty ledger
+def ledger_span(conn):
+    return conn.execute("SELECT MIN(date), MAX(date) FROM daily_totals").fetchone()
+
+
+# Largest-Triangle-Three-Buckets: picks `threshold` of the points (xs sorted) that keep the shape of the line
+# the first and last points are always kept; returns (xs, ys) lists
+def lttb(xs, ys, threshold):
+    count = len(xs)
+    if threshold >= count or threshold < 3:
+        return list(xs), list(ys)
+
+    sampled_x, sampled_y = [xs[0]], [ys[0]]
+    every = (count - 2) / (threshold - 2)
+    selected = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+
+        # average of the next bucket, the third corner of the triangle
+        next_start, next_end = end, min(int((bucket + 2) * every) + 1, count)
+        span = next_end - next_start
+        average_x = sum(xs[next_start:next_end]) / span
+        average_y = sum(ys[next_start:next_end]) / span
+
+        point_x, point_y = xs[selected], ys[selected]
+        largest, chosen = -1, start
+        for index in range(start, end):
+            area = abs((point_x - average_x) * (ys[index] - point_y) - (point_x - xs[index]) * (average_y - point_y))
+            if area > largest:
+                largest, chosen = area, index
+        sampled_x.append(xs[chosen])
+        sampled_y.append(ys[chosen])
+        selected = chosen
+
+    sampled_x.append(xs[-1])
+    sampled_y.append(ys[-1])
+    return sampled_x, sampled_y
+
+
+# running balance in cents over an inclusive day number range, at most `points` points
+# returns (day numbers, balances), each point is the balance at the end of its day
+def balance_series(conn, first_day, last_day, points=POINT_BUDGET):
+    width = bucket_days(first_day, last_day, points * BUCKETS_PER_POINT)
+    balance = conn.execute(OPENING_BALANCE_QUERY, (first_day,)).fetchone()[0]
+
+    days, balances = [], []
+    for day, net in conn.execute(NET_BY_BUCKET_QUERY, (first_day, last_day, first_day, width)):
+        balance += net
+        days.append(day)
+        balances.append(balance)
+    return lttb(days, balances, points)
+
+
+# expenses in cents per bucket of days and category over an inclusive day number range
+# returns (first day number of every bucket, bucket width in days, {category: [cents per bucket]}),
+# with the biggest categories first and the others added up as "Other"
+def category_spending(conn, first_day, last_day, buckets=SPENDING_BUCKETS, top=TOP_CATEGORIES):
+    width = bucket_days(first_day, last_day, buckets)
+    count = (last_day - first_day) // width + 1
+    by_category = {}
+    for bucket, category, total in conn.execute(SPENDING_BY_BUCKET_QUERY, (first_day, width, first_day, last_day)):
+        by_category.setdefault(category, [0] * count)[bucket] += total
+
+    ranked = sorted(by_category, key=lambda category: -sum(by_category[category]))
+    spending = {category: by_category[category] for category in ranked[:top]}
+    if len(ranked) > top:
+        spending["Other"] = [sum(values) for values in zip(*(by_category[category] for category in ranked[top:]))]
+    return [first_day + bucket * width for bucket in range(count)], width, spending
+
+
+# everything the charts draw for an inclusive day number range, by default the whole ledger
+# (see dates.day_number); returns None for an empty ledger, else a dict with the range and both series
+def chart_data(conn, first_day=None, last_day=None, points=POINT_BUDGET, buckets=SPENDING_BUCKETS):
+    ledger_first, ledger_last = ledger_span(conn)
+    if ledger_first is None:
+        return None
+    first_day = ledger_first if first_day is None else first_day
+    last_day = ledger_last if last_day is None else max(first_day, last_day)
+
+    days, balances = balance_series(conn, first_day, last_day, points)
+    bucket_starts, width, spending = category_spending(conn, first_day, last_day, buckets)
+    return {
+        "first_day": first_day,
+        "last_day": last_day,
+        "balance": (days, balances),
+        "spending": (bucket_starts, width, spending),
+    }
@@ -1,22 +1,493 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from profiling import profiler
+from dates import legacy_day_number, year_range
+from dedupe import transaction_hash
 
-def create_connection(db_file):
-    conn = sqlite3.connect(db_file)
+# connection settings, any of them can be overridden by passing a config dict
+DEFAULT_CONFIG = {
+    "journal_mode": "wal",          # readers don't block the writer and vice versa
+    "synchronous": "normal",        # safe with WAL, fsyncs at checkpoints instead of every commit
+    "cache_size": -64000,           # page cache per connection, negative means KiB (64 MB)
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "memory",         # sorts and temporary indexes stay off disk
+    "busy_timeout": 5.0,            # seconds to wait for a lock before failing
+    "cached_statements": 256,       # prepared statements kept per connection
+    "read_pool_size": 4,
+    "profile": False,               # record the statements run inside profiled calls, see profiling.py
+}
+
+# full-text index over notes and category, kept in sync with the transactions table by triggers
+# skipped when this SQLite build has no FTS5, searches then fall back to LIKE
+# there are no prefix indexes: prefix='2 3' made bulk inserts about twice as slow (every token is stored
+# once more per prefix length), while groc* style queries take a few milliseconds without them
+def create_fts_index(conn):
+    if not fts5_available(conn):
+        return ""
+
+    return '''CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+                 notes, category,
+                 content='transactions', content_rowid='id',
+                 tokenize='unicode61 remove_diacritics 2'
+             );
+
+             CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+                 INSERT INTO transactions_fts(rowid, notes, category) VALUES (NEW.id, NEW.notes, NEW.category);
+             END;
+
+             CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+                 INSERT INTO transactions_fts(transactions_fts, rowid, notes, category)
+                 VALUES ('delete', OLD.id, OLD.notes, OLD.category);
+             END;
+
+             CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF notes, category ON transactions BEGIN
+                 INSERT INTO transactions_fts(transactions_fts, rowid, notes, category)
+                 VALUES ('delete', OLD.id, OLD.notes, OLD.category);
+                 INSERT INTO transactions_fts(rowid, notes, category) VALUES (NEW.id, NEW.notes, NEW.category);
+             END;
+
+             INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild');'''
+
+# the daily rollup of totals per type and category, kept up to date by triggers so every
+# write path (single, bulk, update, delete) maintains it in the same transaction
+DAILY_TOTALS = '''CREATE TABLE IF NOT EXISTS daily_totals (
+                     date INTEGER NOT NULL,
+                     type TEXT NOT NULL,
+                     category TEXT NOT NULL,
+                     total INTEGER NOT NULL,
+                     count INTEGER NOT NULL,
+                     PRIMARY KEY (date, type, category)
+                 ) WITHOUT ROWID;
+
+                 INSERT INTO daily_totals(date, type, category, total, count)
+                 SELECT date, type, category, SUM(amount), COUNT(*) FROM transactions GROUP BY date, type, category;
+
+                 CREATE TRIGGER IF NOT EXISTS daily_totals_insert AFTER INSERT ON transactions BEGIN
+                     INSERT INTO daily_totals(date, type, category, total, count)
+                     VALUES (NEW.date, NEW.type, NEW.category, NEW.amount, 1)
+                     ON CONFLICT(date, type, category) DO UPDATE SET total = total + excluded.total, count = count + 1;
+                 END;
+
+                 CREATE TRIGGER IF NOT EXISTS daily_totals_delete AFTER DELETE ON transactions BEGIN
+                     UPDATE daily_totals SET total = total - OLD.amount, count = count - 1
+                     WHERE date = OLD.date AND type = OLD.type AND category = OLD.category;
+                     DELETE FROM daily_totals
+                     WHERE date = OLD.date AND type = OLD.type AND category = OLD.category AND count <= 0;
+                 END;
+
+                 CREATE TRIGGER IF NOT EXISTS daily_totals_update AFTER UPDATE OF type, category, amount, date ON transactions BEGIN
+                     UPDATE daily_totals SET total = total - OLD.amount, count = count - 1
+                     WHERE date = OLD.date AND type = OLD.type AND category = OLD.category;
+                     DELETE FROM daily_totals
+                     WHERE date = OLD.date AND type = OLD.type AND category = OLD.category AND count <= 0;
+                     INSERT INTO daily_totals(date, type, category, total, count)
+                     VALUES (NEW.date, NEW.type, NEW.category, NEW.amount, 1)
+                     ON CONFLICT(date, type, category) DO UPDATE SET total = total + excluded.total, count = count + 1;
+                 END;'''
+
+# a count of the rows ever written to the transactions table, for QueryCache in transactions.py to notice
+# writes made by other processes; statements can't have triggers in SQLite, it goes up once per row
+WRITE_COUNTER = '''CREATE TABLE IF NOT EXISTS write_counter (
+                      id INTEGER PRIMARY KEY CHECK (id = 0),
+                      rows INTEGER NOT NULL
+                  );
+                  INSERT OR IGNORE INTO write_counter(id, rows) VALUES (0, 0);
+
+                  CREATE TRIGGER IF NOT EXISTS write_counter_insert AFTER INSERT ON transactions BEGIN
+                      UPDATE write_counter SET rows = rows + 1;
+                  END;
+                  CREATE TRIGGER IF NOT EXISTS write_counter_update AFTER UPDATE ON transactions BEGIN
+                      UPDATE write_counter SET rows = rows + 1;
+                  END;
+                  CREATE TRIGGER IF NOT EXISTS write_counter_delete AFTER DELETE ON transactions BEGIN
+                      UPDATE write_counter SET rows = rows + 1;
+                  END;'''
+
+# every index ends with the id, so keyset pages in any column's order come straight from an index:
+# (column) for every sortable column, (type, date) for a type in date order and (category, column) for the
+# ones a single category is often sorted by; summaries read daily_totals, amounts don't need to be covered.
+# notes sort as COALESCE(notes, '') (see TransactionQuery.sort_expression), the index has to match it.
+# content_hash finds duplicates with one lookup (see dedupe.py); it isn't unique, the same purchase twice
+# on one day is legitimate
+TRANSACTION_INDEXES = '''CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_type_date ON transactions(type, date);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions(amount);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions(category);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_notes ON transactions(COALESCE(notes, ''));
+                        CREATE INDEX IF NOT EXISTS idx_transactions_category_date ON transactions(category, date);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_category_amount ON transactions(category, amount);
+                        CREATE INDEX IF NOT EXISTS idx_transactions_category_notes
+                            ON transactions(category, COALESCE(notes, ''));
+                        CREATE INDEX IF NOT EXISTS idx_transactions_content_hash ON transactions(content_hash);'''
+
+# upgrades the table the first release created to the current schema, copying it once:
+# amounts become INTEGER cents so sums are exact, dates INTEGER day numbers since 1970-01-01 (see dates.py),
+# and every row gets its content hash (see dedupe.py). Dates are read the way the old forms accepted them,
+# so 2024-2-3 is kept (see dates.legacy_day_number); rows with a date that can't be read are kept aside in
+# transactions_invalid_dates instead of being lost, and reported in the migration's notice.
+# Indexes, the rollup and the full-text index are built after the copy, each in one pass;
+# ANALYZE records index sizes: without them SQLite can't tell (category) from (category, date)
+# for a date-ordered category filter
+def upgrade_legacy_schema(conn):
+    # dates repeat a lot, each distinct one is only parsed once
+    conn.create_function("legacy_day_number", 1, lru_cache(maxsize=None)(legacy_day_number), deterministic=True)
+    conn.create_function("transaction_hash", 5, transaction_hash, deterministic=True)
+    script, notice = "", None
+    unreadable = conn.execute("SELECT COUNT(*) FROM transactions WHERE legacy_day_number(date) IS NULL").fetchone()[0]
+    if unreadable:
+        script += '''CREATE TABLE IF NOT EXISTS transactions_invalid_dates AS SELECT * FROM transactions WHERE 0;
+                     INSERT INTO transactions_invalid_dates SELECT * FROM transactions WHERE legacy_day_number(date) IS NULL;\n'''
+        notice = (f"{unreadable} transaction(s) with a date that can't be read were moved "
+                  "to the transactions_invalid_dates table.")
+
+    script += f'''CREATE TABLE transactions_new (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      type TEXT NOT NULL,
+                      category TEXT NOT NULL,
+                      amount INTEGER NOT NULL,
+                      date INTEGER NOT NULL,
+                      notes TEXT,
+                      content_hash INTEGER
+                  );
+                  INSERT INTO transactions_new
+                  SELECT id, type, category, amount, date, notes, transaction_hash(type, category, amount, date, notes)
+                  FROM (SELECT id, type, category, CAST(ROUND(amount * 100) AS INTEGER) AS amount,
+                               legacy_day_number(date) AS date, notes FROM transactions)
+                  WHERE date IS NOT NULL;
+                  DROP TABLE transactions;
+                  ALTER TABLE transactions_new RENAME TO transactions;
+
+                  {TRANSACTION_INDEXES}
+
+                  {DAILY_TOTALS}
+
+                  {WRITE_COUNTER}
+
+                  CREATE TABLE IF NOT EXISTS archives (
+                      year INTEGER PRIMARY KEY,
+                      file TEXT NOT NULL
+                  );
+
+                  {create_fts_index(conn)}
+
+                  ANALYZE;'''
+    return script, notice
+
+# schema migrations, applied in order; the number of applied migrations is stored in PRAGMA user_version
+# a migration is an SQL script, or a function of the connection that returns one or (script, notice);
+# a notice tells the user about something the migration did to their data, None if there's nothing to say
+# never edit a migration that has shipped, append a new one instead
+MIGRATIONS = [
+    # 1: transactions table, as the first release created it
+    '''CREATE TABLE IF NOT EXISTS transactions (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           type TEXT NOT NULL,
+           category TEXT NOT NULL,
+           amount REAL NOT NULL,
+           date TEXT NOT NULL,
+           notes TEXT
+       );''',
+
+    # 2: integer cents and day numbers, content hash, indexes, daily rollup, write counter, archive registry,
+    # full-text search
+    upgrade_legacy_schema,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# opens a connection with the pragmas from config applied
+# read_only connections refuse writes; check_same_thread=False is for connections handed out by a pool
+def create_connection(db_file, config=None, read_only=False, check_same_thread=True):
+    config = {**DEFAULT_CONFIG, **(config or {})}
+
+    conn = sqlite3.connect(db_file, timeout=config["busy_timeout"],
+                           cached_statements=config["cached_statements"],
+                           check_same_thread=check_same_thread)
+
+    conn.execute(f"PRAGMA journal_mode = {config['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous = {config['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {int(config['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size = {int(config['mmap_size'])}")
+    conn.execute(f"PRAGMA temp_store = {config['temp_store']}")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    conn.create_function("transaction_hash", 5, transaction_hash, deterministic=True)    # for set-based updates
+    if config["profile"]:
+        profiler.attach(conn)
     return conn
 
+# hands out database connections: one writer shared under a lock, and a small pool of readers
+# with WAL, readers keep reading while the writer commits
+class ConnectionManager:
+    def __init__(self, db_file, config=None):
+        self.db_file = db_file
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+
+        self.writer = create_connection(db_file, self.config, check_same_thread=False)
+        self.writer_lock = threading.Lock()
+
+        self.readers = queue.LifoQueue()    # idle readers, most recently used first so its cache is warm
+        self.reader_count = 0
+        self.readers_lock = threading.Lock()
+        self.connections = [self.writer]    # every connection opened, idle or in use
+
+    # with manager.write() as conn: ... gives exclusive use of the writer connection
+    @contextmanager
+    def write(self):
+        with self.writer_lock:
+            yield self.writer
+
+    # with manager.read() as conn: ... borrows a read-only connection, waiting if all are in use
+    @contextmanager
+    def read(self):
+        conn = self.acquire_reader()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.readers.put(conn)
+
+    def acquire_reader(self):
+        try:
+            return self.readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.readers_lock:
+            can_open = self.reader_count < self.config["read_pool_size"]
+            if can_open:
+                self.reader_count += 1
+
+        if not can_open:
+            return self.readers.get()    # pool is full, wait for a reader to come back
+
+        try:
+            conn = create_connection(self.db_file, self.config, read_only=True, check_same_thread=False)
+        except sqlite3.Error:
+            with self.readers_lock:
+                self.reader_count -= 1
+            raise
+        with self.readers_lock:
+            self.connections.append(conn)
+        return conn
+
+    # turns statement capture of profiled calls on or off for every connection, like the "profile" config
+    # the trace callback costs a Python call per statement, so it stays off unless diagnostics are wanted
+    def set_profiling(self, enabled):
+        with self.readers_lock:
+            self.config["profile"] = enabled
+            for conn in self.connections:
+                if enabled:
+                    profiler.attach(conn)
+                else:
+                    profiler.detach(conn)
+
+    # closes the writer and every idle reader
+    def close(self):
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self.writer_lock:
+            self.writer.close()
+
+def fts5_available(conn):
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+# True once the full-text index has been created by the migrations
+def has_fts_index(conn):
+    cur = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions_fts'")
+    return cur.fetchone() is not None
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# upgrades the database in place to the latest schema version
+# each migration runs in its own transaction together with the version bump
+# returns the notices of the migrations that ran, see MIGRATIONS
+def migrate(conn):
+    version = get_schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return []    # the usual case on startup, no schema work to do
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this application ({SCHEMA_VERSION}).")
+
+    notices = []
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        notice = None
+        if callable(script):
+            script = script(conn)
+        if isinstance(script, tuple):
+            script, notice = script
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        if notice:
+            notices.append(notice)
+    return notices
+
+# migrates the database, returns the migration notices to show the user
 def create_table(conn):
     try:
-        sql = '''CREATE TABLE IF NOT EXISTS transactions (
-                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     type TEXT NOT NULL,
-                     category TEXT NOT NULL,
-                     amount REAL NOT NULL,
-                     date TEXT NOT NULL,
-                     notes TEXT 
-                 );'''
-        conn.execute(sql)
-        conn.commit()
+        return migrate(conn)
     except sqlite3.Error as e:
         print(e)
+        return []
+
+# recomputes the daily_totals rollup from the transactions table and its archives, e.g. after editing the database by hand
+def rebuild_daily_totals(conn):
+    years = attach_archives(conn)
+    with conn:
+        conn.execute("DELETE FROM daily_totals")
+        for schema in ["main"] + [f"archive_{year}" for year in years]:
+            conn.execute(f'''INSERT INTO daily_totals(date, type, category, total, count)
+                             SELECT date, type, category, SUM(amount), COUNT(*)
+                             FROM {schema}.transactions WHERE true GROUP BY date, type, category
+                             ON CONFLICT(date, type, category) DO UPDATE
+                             SET total = total + excluded.total, count = count + excluded.count''')
+
+# columns archives keep, the main table also has content_hash
+ARCHIVE_COLUMNS = "id, type, category, amount, date, notes"
+
+# archive files live next to the main database, e.g. budget_tracker.2019.db
+def archive_path(conn, file):
+    return os.path.join(os.path.dirname(conn.execute("PRAGMA database_list").fetchone()[2]), file)
+
+# moves every transaction dated in year out of the main database into its own archive file,
+# so the main table and its indexes only hold recent years
+# the rollup keeps the archived totals, summaries over old years don't need the archive
+# archived rows are read-only: query them through attach_archives() and the all_transactions view
+# returns the number of rows moved; archiving a year again moves rows added to it since
+def archive_year(conn, year):
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if not db_file:
+        raise ValueError("In-memory databases can't be archived.")
+    first, last = year_range(year)
+    file = f"{os.path.splitext(os.path.basename(db_file))[0]}.{year}.db"
+    schema = f"archive_{year}"
+
+    if schema not in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (archive_path(conn, file),))
+
+    # the archive is committed before anything is deleted, copying is safe to repeat if this is interrupted
+    conn.executescript(f'''BEGIN;
+        CREATE TABLE IF NOT EXISTS {schema}.transactions (
+            id INTEGER PRIMARY KEY,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            date INTEGER NOT NULL,
+            notes TEXT
+        );
+        CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_date ON transactions(date);
+        INSERT OR REPLACE INTO {schema}.transactions
+        SELECT {ARCHIVE_COLUMNS} FROM main.transactions WHERE date BETWEEN {first} AND {last};
+        COMMIT;''')
+
+    with conn:
+        moved = conn.execute("DELETE FROM main.transactions WHERE date BETWEEN ? AND ?", (first, last)).rowcount
+        # the delete triggers took the year out of the rollup, put back the totals of everything archived
+        conn.execute("DELETE FROM daily_totals WHERE date BETWEEN ? AND ?", (first, last))
+        conn.execute(f'''INSERT INTO daily_totals(date, type, category, total, count)
+                         SELECT date, type, category, SUM(amount), COUNT(*)
+                         FROM {schema}.transactions GROUP BY date, type, category''')
+        conn.execute("INSERT OR REPLACE INTO archives(year, file) VALUES (?, ?)", (year, file))
+
+    attach_archives(conn)    # include the new archive in all_transactions
+    return moved
+
+# attaches every archive database as archive_<year> and creates the TEMP view all_transactions,
+# the main table and all archives combined; filters on date are pushed down into each part
+# returns the archived years. SQLite attaches at most 10 databases by default
+def attach_archives(conn):
+    archives = conn.execute("SELECT year, file FROM main.archives ORDER BY year").fetchall()
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    parts = [f"SELECT {ARCHIVE_COLUMNS} FROM {schema}.transactions"
+             for schema in ["main"] + [f"archive_{year}" for year, _ in archives]]
+    view = "CREATE VIEW all_transactions AS " + " UNION ALL ".join(parts)
+
+    missing = [(year, file) for year, file in archives if f"archive_{year}" not in attached]
+    current = conn.execute("SELECT sql FROM temp.sqlite_master WHERE name = 'all_transactions'").fetchone()
+    if not missing and current and current[0] == view:
+        return [year for year, _ in archives]
+
+    for year, file in missing:
+        conn.execute(f"ATTACH DATABASE ? AS archive_{year}", (archive_path(conn, file),))
+
+    # the view is recreated when a year was archived since, possibly through this very connection
+    query_only = conn.execute("PRAGMA query_only").fetchone()[0]
+    conn.execute("PRAGMA query_only = OFF")    # read-only connections still need their own temp view
+    try:
+        conn.execute("DROP VIEW IF EXISTS temp.all_transactions")
+        conn.execute(view.replace("CREATE VIEW", "CREATE TEMP VIEW", 1))
+    finally:
+        conn.execute(f"PRAGMA query_only = {query_only}")
+    return [year for year, _ in archives]
+
+# returns the detail column of EXPLAIN QUERY PLAN for a query, e.g. to check that an index is used
+def explain_query_plan(conn, sql, params=()):
+    cur = conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[3] for row in cur.fetchall()]
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Budget tracker database maintenance")
+    parser.add_argument("command", choices=["migrate", "rebuild-rollup", "archive", "backup", "restore", "snapshots"])
+    parser.add_argument("years", nargs="*", type=int, help="years to move into archive databases (archive command)")
+    parser.add_argument("--db", default="budget_tracker.db", help="database file (default: budget_tracker.db)")
+    parser.add_argument("--backup-dir", default="backups", help="snapshot directory (default: backups)")
+    parser.add_argument("--full", action="store_true", help="store every page, not only the changed ones (backup command)")
+    parser.add_argument("--every", type=float, help="keep taking a snapshot every this many minutes (backup command)")
+    parser.add_argument("--snapshot", help="snapshot file to restore, the newest by default (restore command)")
+    parser.add_argument("--thorough", action="store_true", help="run PRAGMA integrity_check on the restored database")
+    args = parser.parse_args()
+
+    from backup import list_snapshots, restore_database, snapshot_database
+
+    if args.command == "snapshots":
+        for entry in list_snapshots(args.backup_dir):
+            kind = "full " if entry["full"] else "delta"
+            print(f"{entry['file']}  {entry['created']}  {kind}  {entry['stored_pages']:>9} of {entry['page_count']} pages"
+                  f"  {entry['bytes'] / 1e6:9.1f} MB")
+        raise SystemExit(0)
+    if args.command == "restore":
+        # the database is replaced as a file, it must not be open here
+        entry = restore_database(args.db, args.backup_dir, args.snapshot, thorough=args.thorough)
+        print(f"{args.db} restored from {entry['file']} ({entry['created']})")
+        raise SystemExit(0)
 
-    
\ No newline at end of file
+    conn = create_connection(args.db)
+    for notice in migrate(conn):
+        print(notice)
+    if args.command == "rebuild-rollup":
+        rebuild_daily_totals(conn)
+    elif args.command == "archive":
+        from transactions import archive_transactions
+        for year in args.years:
+            print(f"{year}: {archive_transactions(conn, year)} transactions archived")
+    elif args.command == "backup":
+        while True:
+            entry = snapshot_database(conn, args.backup_dir, full=args.full)
+            print(f"{entry['file']}: {entry['stored_pages']} of {entry['page_count']} pages, "
+                  f"{entry['bytes'] / 1e6:.1f} MB in {entry['seconds']:.1f} s")
+            if not args.every:
+                break
+            time.sleep(args.every * 60)
+    conn.close()
@@ -0,0 +1,46 @@
+import re
+from datetime import date, datetime, timedelta
+
+# dates are stored as day numbers: days since 1970-01-01, so they compare and sort as integers
+EPOCH = date(1970, 1, 1)
+
+# Julian day of the epoch, SQLite date functions read a day number d as the Julian day d + JULIAN_EPOCH
+JULIAN_EPOCH = 2440587.5
+
+# SQL expression turning the day number in column into YYYY-MM-DD text
+def date_sql(column):
+    return f"date({column} + {JULIAN_EPOCH})"
+
+ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+
+# day number of a YYYY-MM-DD date, raises ValueError for anything else (e.g. 2024-1-5 or 2024-02-30)
+def day_number(value):
+    match = ISO_DATE.fullmatch(value) if isinstance(value, str) else None
+    if not match:
+        raise ValueError(f"Invalid date: {value!r}")
+    try:
+        return (date(*map(int, match.groups())) - EPOCH).days
+    except ValueError:
+        raise ValueError(f"Invalid date: {value!r}")
+
+# day number of a date as the forms accepted it before dates were stored as day numbers:
+# datetime.strptime with %Y-%m-%d, which also takes 2024-2-3, or an ISO timestamp such as 2024-02-03 10:30;
+# None if the value can't be read either way (impossible dates like 2024-02-30 included)
+def legacy_day_number(value):
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    for parse in (lambda text: datetime.strptime(text, "%Y-%m-%d"), datetime.fromisoformat):
+        try:
+            return (parse(value).date() - EPOCH).days
+        except ValueError:
+            pass
+    return None
+
+def day_to_date(day):
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+# first and last day number of a calendar year
+def year_range(year):
+    return (date(year, 1, 1) - EPOCH).days, (date(year, 12, 31) - EPOCH).days
@@ -0,0 +1,56 @@
+import hashlib
+import re
+
+WHITESPACE = re.compile(r"\s+")
+
+# ids of rows fetched at once to compare a run of equal hashes in full
+COMPARE_BATCH_SIZE = 500
+
+
+# notes as they count for duplicates: case and spacing differences between bank feeds are ignored
+def normalize_notes(notes):
+    return WHITESPACE.sub(" ", notes or "").strip().lower()
+
+
+# 64-bit hash over (type, category, amount in cents, day number, normalized notes), stored in content_hash
+# signed so it fits an SQLite INTEGER; also registered as the SQL function transaction_hash by the migration
+def transaction_hash(transaction_type, category, amount, day, notes):
+    content = "\x1f".join((transaction_type, category, str(amount), str(day), normalize_notes(notes)))
+    return int.from_bytes(hashlib.blake2b(content.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+# content of a stored row that duplicates have in common
+def duplicate_key(row):
+    transaction_type, category, amount, day, notes = row
+    return (transaction_type, category, amount, day, normalize_notes(notes))
+
+
+# finds groups of identical transactions in a single pass over the content hash index, in hash order
+# rows sharing a hash are compared in full, so a hash collision is never reported as a duplicate
+# yields lists of ids, lowest (oldest) first
+def duplicate_groups(conn):
+    cur = conn.execute("SELECT content_hash, id FROM transactions ORDER BY content_hash, id")
+    run_hash, run = None, []
+    for content_hash, transaction_id in cur:
+        if content_hash == run_hash:
+            run.append(transaction_id)
+            continue
+        if len(run) > 1:
+            yield from split_run(conn, run)
+        run_hash, run = content_hash, [transaction_id]
+    if len(run) > 1:
+        yield from split_run(conn, run)
+
+
+# splits ids with equal hashes into groups of rows with equal content
+def split_run(conn, ids):
+    groups = {}
+    for offset in range(0, len(ids), COMPARE_BATCH_SIZE):
+        chunk = ids[offset:offset + COMPARE_BATCH_SIZE]
+        cur = conn.execute(f'''SELECT id, type, category, amount, date, notes FROM transactions
+                               WHERE id IN ({", ".join("?" * len(chunk))})''', chunk)
+        for transaction_id, *row in cur:
+            groups.setdefault(duplicate_key(row), []).append(transaction_id)
+    for group in groups.values():
+        if len(group) > 1:
+            yield sorted(group)
@@ -1,28 +1,71 @@
+import os
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QMessageBox, QDialog, QFormLayout, QLineEdit, QTableWidget, QTableWidgetItem, QLabel, QFileDialog
-from database import create_connection, create_table
-from datetime import datetime
+from PyQt5.QtWidgets import QMainWindow, QPushButton, QVBoxLayout, QWidget, QMessageBox, QDialog, QFormLayout, QLineEdit, QTableView, QLabel, QFileDialog, QProgressDialog, QComboBox, QTableWidget, QTableWidgetItem, QHBoxLayout, QAbstractItemView, QCheckBox
+from PyQt5.QtCore import Qt, QTimer
+from database import ConnectionManager, create_table
+from workers import DatabaseWorkers
+from transaction_model import SearchResultsModel, TransactionTableModel, change_relay
+from query import TransactionQuery, TRANSACTION_COLUMNS
+from aggregates import aggregate_transactions
+from profiling import profiler
+from dates import day_number
 from transactions import (
     add_transaction,
-    get_transactions,
-    filter_transactions_by_type,
-    filter_transactions_by_date_range,
     delete_transaction_by_id,
-    update_transaction,
-    get_transaction_by_id,
+    update_transactions,
+    delete_transactions,
     export_to_csv,
-    search_transactions_by_notes,
-    summarize_transactions
+    export_to_arrow,
+    summarize_transactions,
+    validate_transaction,
+    is_valid_date,
+    to_cents,
+    format_cents,
+    query_cache
 )
 
+DB_FILE = "budget_tracker.db"
+
+# the edit form as a patch for update_transactions, blank fields keep their current value
+# raises ValueError for an invalid amount or date, or when every field is blank
+def edit_patch(transaction_type, category, amount_str, date, notes):
+    patch = {}
+    if transaction_type:
+        patch["type"] = transaction_type
+    if category:
+        patch["category"] = category
+    if amount_str:
+        try:
+            patch["amount"] = to_cents(amount_str)
+        except ValueError:
+            raise ValueError("Please enter a valid numerical amount.")
+    if date:
+        if not is_valid_date(date):
+            raise ValueError("Please enter a valid date in YYYY-MM-DD format.")
+        patch["date"] = date
+    if notes:
+        patch["notes"] = notes
+    if not patch:
+        raise ValueError("Please fill in at least one field to change.")
+    return patch
+
 class BudgetTrackerApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, db_file=None):
         super().__init__()
         self.setWindowTitle("Budget Tracker")
 
-         # Initialize the database connection
-        self.conn = create_connection("budget_tracker.db")
-        create_table(self.conn)  # Make sure the table is created
+         # Initialize the database connections, one writer and a pool of readers
+        self.db = ConnectionManager(db_file or DB_FILE)
+        with self.db.write() as conn:
+            notices = create_table(conn)  # Make sure the table is created, returns at once when the schema is current
+        if notices:
+            # shown once the window is up, e.g. transactions an upgrade had to set aside
+            QTimer.singleShot(0, lambda: QMessageBox.warning(self, "Database Upgraded", "\n\n".join(notices)))
+
+        # every other query runs on background threads so the window never freezes
+        self.workers = DatabaseWorkers(self.db)
+
+        self.dialogs = {}    # dialogs built so far, reused on later clicks
 
         # create buttons for menu display
         self.add_transaction_button = QPushButton("Add Transaction")
@@ -31,9 +74,11 @@ class BudgetTrackerApp(QMainWindow):
         self.filter_by_date_button = QPushButton("Filter by Date Range")
         self.delete_transaction_button = QPushButton("Delete Transaction")
         self.edit_transaction_button = QPushButton("Edit Transaction")
-        self.export_button = QPushButton("Export to CSV")
+        self.export_button = QPushButton("Export Transactions")
         self.search_transactions_button = QPushButton("Search By Notes")
         self.summarize_transactions_button = QPushButton("Summarize Transactions")
+        self.charts_button = QPushButton("Charts")
+        self.diagnostics_button = QPushButton("Diagnostics")
         self.exit_button = QPushButton("Exit")
 
         # connects button to respective functions
@@ -46,6 +91,8 @@ class BudgetTrackerApp(QMainWindow):
         self.export_button.clicked.connect(self.export_transactions_ui)
         self.search_transactions_button.clicked.connect(self.search_transactions_ui)
         self.summarize_transactions_button.clicked.connect(self.summarize_transactions_ui)
+        self.charts_button.clicked.connect(self.charts_ui)
+        self.diagnostics_button.clicked.connect(self.diagnostics_ui)
         self.exit_button.clicked.connect(self.close)
 
         # layout of buttons
@@ -59,18 +106,57 @@ class BudgetTrackerApp(QMainWindow):
         layout.addWidget(self.export_button)
         layout.addWidget(self.search_transactions_button)
         layout.addWidget(self.summarize_transactions_button)
+        layout.addWidget(self.charts_button)
+        layout.addWidget(self.diagnostics_button)
         layout.addWidget(self.exit_button)
 
         container = QWidget()
         container.setLayout(layout)
         self.setCentralWidget(container)
 
+    def closeEvent(self, event):
+        self.workers.shutdown()    # cancels running queries and waits for pending writes
+        self.db.close()
+        super().closeEvent(event)
+
+    # shows a busy indicator with a Cancel button until the task finishes, then starts the task
+    # task comes from workers.read/write with start=False, so its signals are connected before it can finish
+    # progress_label(value) turns the task's progress reports into the indicator's text
+    # quick tasks finish before the dialog appears
+    def show_busy(self, title, label, task, progress_label=None):
+        progress = QProgressDialog(label, "Cancel", 0, 0, self)
+        progress.setWindowTitle(title)
+        progress.setMinimumDuration(300)
+        progress.canceled.connect(task.cancel)
+        if progress_label:
+            task.signals.progress.connect(lambda value: progress.setLabelText(progress_label(value)))
+        task.signals.finished.connect(progress.hide)
+        task.signals.finished.connect(progress.deleteLater)
+        self.workers.start(task)
+        return progress
+
+    # returns the dialog called name, building it with build(dialog) the first time
+    # later calls return the same dialog with its line edits cleared, instead of building it again
+    def reusable_dialog(self, name, title, build):
+        dialog = self.dialogs.get(name)
+        if dialog is None:
+            dialog = self.dialogs[name] = QDialog(self)
+            dialog.setWindowTitle(title)
+            build(dialog)
+        else:
+            for line_edit in dialog.findChildren(QLineEdit):
+                line_edit.clear()
+        return dialog
+
+    def show_database_error(self, error):
+        QMessageBox.warning(self, "Database Error", f"An error occurred while accessing the database: {error}")
+
 #--------------------------------------------- ADD AND SUBMIT TRANSACTIONS ----------------------------------
 
     def add_transaction_ui(self):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Add Transaction")
+        self.reusable_dialog("add", "Add Transaction", self.build_add_transaction_dialog).exec_()
 
+    def build_add_transaction_dialog(self, dialog):
         layout = QFormLayout(dialog)
 
         type_input = QLineEdit(dialog)
@@ -92,71 +178,81 @@ class BudgetTrackerApp(QMainWindow):
         type_input.text(), category_input.text(),
         amount_input.text(), date_input.text(), notes_input.text(), dialog))
 
-        dialog.exec_()
-
     def submit_add_transaction(self, transaction_type, category, amount_str, date, notes, dialog):
-        # validate the required fields (everything but notes)
-        if not transaction_type or not category or not amount_str or not date:
-            QMessageBox.warning(self, "Input Error", "Please fill in all required fields (Type, Category, Amount, Date).")
-            return
-
-        # validates and convert amount to float
+        # validates the required fields, amount and date format (shared with bulk imports)
         try:
-            amount = float(amount_str)
-        except ValueError:
-            QMessageBox.warning(self, "Invalid Amount", "Please enter a valid numerical amount.")
+            transaction = validate_transaction((transaction_type, category, amount_str, date, notes))
+        except ValueError as e:
+            QMessageBox.warning(self, "Input Error", str(e))
             return
 
-        # validates date format
-        try:
-            datetime.strptime(date, "%Y-%m-%d")
-        except ValueError:
-            QMessageBox.warning(self, "Invalid Date", "Please enter a valid date in YYYY-MM-DD format.")
-            return
-
-        transaction = (transaction_type, category, amount, date, notes)
-        transaction_id = add_transaction(self.conn, transaction)
+        self.workers.write(add_transaction, transaction,
+                           on_result=lambda transaction_id: self.transaction_added(transaction_id, dialog),
+                           on_error=self.show_database_error)
 
+    def transaction_added(self, transaction_id, dialog):
         QMessageBox.information(self, "Transaction Added!", f"Transaction Added. Transaction ID: {transaction_id}")
         dialog.accept()
 
 # ---------------------------------------- VIEW TRANSACTIONS -------------------------------------------
 
     def view_transactions_ui(self):
-        transactions = get_transactions(self.conn)  
+        self.show_transactions("all", "All Transactions", None, (1000, 500))
+
+    # shows the transactions matching query in a table dialog, first sorted by the column named sort_column
+    # each kind of result (name) keeps its dialog and table, reopening only reloads the rows
+    def show_transactions(self, name, title, query, size=(800, 400), sort_column="id"):
+        dialog = self.dialogs.get(name)
+        if dialog is None:
+            dialog = self.dialogs[name] = QDialog(self)
+            dialog.resize(*size)
+
+            # creates table that loads the transactions from the database
+            dialog.table = self.create_transactions_table(dialog, query, sort_column)
+
+            # act on every selected row at once
+            edit_button = QPushButton("Edit Selected...", dialog)
+            delete_button = QPushButton("Delete Selected", dialog)
+            edit_button.clicked.connect(lambda: self.edit_selected_transactions(dialog.table))
+            delete_button.clicked.connect(lambda: self.delete_selected_transactions(dialog.table))
+            buttons = QHBoxLayout()
+            buttons.addStretch()
+            buttons.addWidget(edit_button)
+            buttons.addWidget(delete_button)
+
+            layout = QVBoxLayout()
+            layout.addWidget(dialog.table)
+            layout.addLayout(buttons)
+            dialog.setLayout(layout)
+        else:
+            dialog.table.model().set_query(query)    # also picks up changes made since it was last shown
 
-        dialog = QDialog(self)
-        dialog.setWindowTitle("All Transactions")
+        dialog.setWindowTitle(title)
+        dialog.exec_()
 
-        dialog.setGeometry(100, 100, 1000, 500) # sets initial size of transactions table
-        
-        # creates table to display transactions
-        table = QTableWidget(dialog)
-        table.setColumnCount(6)  #  designates number of columns
-        table.setHorizontalHeaderLabels(["ID", "Type", "Category", "Amount", "Date", "Notes"]) # column names
-        table.setColumnWidth(5, 400) # sets the 6th column - Notes to be 400 pixels
-        
-        # set the number of rows in the table to number of transactions
-        table.setRowCount(len(transactions))
-        table.setSortingEnabled(True)
+    # creates a table view backed by a model that loads rows from the database as the user scrolls
+    # query restricts which transactions are shown, e.g. TransactionQuery().where_type("income")
+    def create_transactions_table(self, parent, query=None, sort_column="id"):
+        table = QTableView(parent)
+        table.setModel(TransactionTableModel(None, query, parent=table, workers=self.workers))
 
-        # populate table with data
-        for row, transaction in enumerate(transactions):
-            for column, value in enumerate(transaction):
-                table.setItem(row, column, QTableWidgetItem(str(value)))  # values needs to be converted to strings to be displayed
+        # whole rows are selected, shift and ctrl select several for the batch edit and delete buttons
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setSelectionMode(QAbstractItemView.ExtendedSelection)
 
-        layout = QVBoxLayout()
-        layout.addWidget(table)
-        dialog.setLayout(layout)
-        
-        dialog.exec_()
+        # sorting is handed to the model, which re-queries the database in the new order
+        table.setSortingEnabled(True)
+        table.sortByColumn(TRANSACTION_COLUMNS.index(sort_column), Qt.AscendingOrder)
+
+        table.setColumnWidth(5, 400) # sets the 6th column - Notes to be 400 pixels
+        return table
 
 # -------------------------------FILTER TRANSACTIONS BY TYPE ----------------------------------------------------
 
     def filter_transactions_ui(self):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Filter Transactions by Type")
+        self.reusable_dialog("filter_type", "Filter Transactions by Type", self.build_filter_transactions_dialog).exec_()
 
+    def build_filter_transactions_dialog(self, dialog):
         layout = QVBoxLayout()
 
         # Label and Input field for transaction type
@@ -173,7 +269,6 @@ class BudgetTrackerApp(QMainWindow):
         submit_button.clicked.connect(lambda: self.show_filtered_transactions(type_input.text().lower(), dialog))
 
         dialog.setLayout(layout)
-        dialog.exec_()
 
     def show_filtered_transactions(self, transaction_type, parent_dialog):
         # validates input
@@ -181,46 +276,18 @@ class BudgetTrackerApp(QMainWindow):
             QMessageBox.warning(self, "Invalid Input", "Please enter 'income' or 'expense'.")
             return
 
-        # retrieves filtered transactions from the database
-        filtered_transactions = filter_transactions_by_type(self.conn, transaction_type)
-
         parent_dialog.close()
 
-        # creates a new dialog to display filtered transactions
-        dialog = QDialog(self)
-        dialog.setWindowTitle(f"Filtered Transactions - {transaction_type.capitalize()}")
-
-        dialog.resize(800, 400)
-
-        # creates table to display transactions
-        table = QTableWidget(dialog)
-        table.setColumnCount(6) 
-        table.setHorizontalHeaderLabels(["ID", "Type", "Category", "Amount", "Date", "Notes"])
-        table.setRowCount(len(filtered_transactions))
-
-        table.setSortingEnabled(True)
-
-        # populates table with filtered results
-        for row, transaction in enumerate(filtered_transactions):
-            for column, value in enumerate(transaction):
-                table.setItem(row, column, QTableWidgetItem(str(value)))
-
-        # sets notes column width
-        table.setColumnWidth(5, 400)
-
-        layout = QVBoxLayout()
-        layout.addWidget(table)
-        dialog.setLayout(layout)
-
-        dialog.exec_()
+        # displays the filtered transactions in table
+        self.show_transactions("filtered", f"Filtered Transactions - {transaction_type.capitalize()}",
+                               TransactionQuery().where_type(transaction_type))
 
 # --------------------------FILTER TRANSACTIONS BY DATE RANGE -------------------------------------
 
     def show_date_range_input(self):
+        self.reusable_dialog("filter_date", "Filter Transactions by Date Range", self.build_date_range_dialog).exec_()
 
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Filter Transactions by Date Range")
-
+    def build_date_range_dialog(self, dialog):
         # user adds start date and end date fields 
         start_date_label = QLabel("Start Date (YYYY-MM-DD):")
         self.start_date_input = QLineEdit()
@@ -241,8 +308,6 @@ class BudgetTrackerApp(QMainWindow):
 
         # connects the submit button to function that fetches filtered transactions, passes start and end date and dialog
         submit_button.clicked.connect(lambda: self.show_filtered_transactions_by_date(self.start_date_input.text(), self.end_date_input.text(), dialog))
-
-        dialog.exec_()
     
     def show_filtered_transactions_by_date(self, start_date, end_date, parent_dialog):
 
@@ -251,10 +316,10 @@ class BudgetTrackerApp(QMainWindow):
 
         # validate date formats
         try:
-            start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-            end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
+            start_day = day_number(start_date)
+            end_day = day_number(end_date)
             
-            if start_date_obj > end_date_obj:
+            if start_day > end_day:
                 QMessageBox.warning(self, "Invalid Date Range", "Start date cannot be later than end date.")
                 return
 
@@ -263,40 +328,15 @@ class BudgetTrackerApp(QMainWindow):
             QMessageBox.warning(self, "Invalid Date Format", "Please enter dates in YYYY-MM-DD format.")
             return
 
-        # fetches the filtered transactions from the database
-        transactions = filter_transactions_by_date_range(self.conn, start_date, end_date)
-
         # displays the filtered transactions in table
-
-        dialog = QDialog(self)
-        dialog.setWindowTitle(f"Filtered Transactions from {start_date} to {end_date}")
-
-        dialog.resize(800, 400)
-
-        # creates table to display filtered results
-        table = QTableWidget(dialog)
-        table.setColumnCount(6)
-        table.setHorizontalHeaderLabels(["ID", "Type", "Category", "Amount", "Date", "Notes"])
-        table.setRowCount(len(transactions))
-        table.setSortingEnabled(True)
-
-        for row, transaction in enumerate(transactions):
-            for column, value in enumerate(transaction):
-                table.setItem(row, column, QTableWidgetItem(str(value)))
-
-        table.setColumnWidth(5, 400)
-
-        layout = QVBoxLayout()
-        layout.addWidget(table)
-        dialog.setLayout(layout)
-
-        dialog.exec_()
+        self.show_transactions("filtered", f"Filtered Transactions from {start_date} to {end_date}",
+                               TransactionQuery().between(start_date, end_date), sort_column="date")    # date index order
             
 # --------------------------------------- DELETE TRANSACTION BY ID --------------------------------------------
     def delete_transaction_ui(self):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Delete Transaction")
+        self.reusable_dialog("delete", "Delete Transaction", self.build_delete_transaction_dialog).exec_()
 
+    def build_delete_transaction_dialog(self, dialog):
         # creates label and input field for transaction ID
         transaction_id_label = QLabel("Enter Transaction ID to Delete:")
         transaction_id_input = QLineEdit()
@@ -313,8 +353,6 @@ class BudgetTrackerApp(QMainWindow):
         # connects submit button to delete function
         submit_button.clicked.connect(lambda: self.delete_transaction(transaction_id_input.text(), dialog))
 
-        dialog.exec_()
-
     def delete_transaction(self, id, parent_dialog):
         # validates id input
         try:
@@ -323,11 +361,14 @@ class BudgetTrackerApp(QMainWindow):
             QMessageBox.warning(self, "Invalid Input", "Please enter a valid transaction ID.")
             return
 
-        # calls function to delete transaction by id, returns bool
-        success = delete_transaction_by_id(self.conn, transaction_id)
-
         parent_dialog.close()
 
+        # calls function to delete transaction by id, returns bool
+        self.workers.write(delete_transaction_by_id, transaction_id,
+                           on_result=lambda success: self.transaction_deleted(transaction_id, success),
+                           on_error=self.show_database_error)
+
+    def transaction_deleted(self, transaction_id, success):
         # shows success or failure message
         if success:
             QMessageBox.information(self, "Success", f"Transaction with ID {transaction_id} has been deleted.")
@@ -336,9 +377,9 @@ class BudgetTrackerApp(QMainWindow):
 
 # --------------------------------------- EDIT TRANSACTION BY ID ------------------------------------------------
     def edit_transaction_ui(self):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Edit Transaction")
+        self.reusable_dialog("edit", "Edit Transaction", self.build_edit_transaction_dialog).exec_()
 
+    def build_edit_transaction_dialog(self, dialog):
         instruction_label = QLabel("Blank = Remain Same")
         instruction_label.setStyleSheet("font-weight: bold; font-size: 12px;")
 
@@ -380,8 +421,6 @@ class BudgetTrackerApp(QMainWindow):
         # connects submit button to update function
         submit_button.clicked.connect(lambda: self.update_transaction_by_id(transaction_id_input.text(), type_input.text(), category_input.text(), amount_input.text(), date_input.text(), notes_input.text(), dialog))
 
-        dialog.exec_()
-
     def update_transaction_by_id(self, transaction_id_str, transaction_type, category, amount_str, date, notes, parent_dialog):
     
         # validates user id
@@ -390,64 +429,136 @@ class BudgetTrackerApp(QMainWindow):
         except ValueError:
             QMessageBox.warning(self, "Invalid Input", "Please enter a valid transaction ID.")
             return
+
+        # blank fields keep their value, the rest is checked before anything is written
+        try:
+            patch = edit_patch(transaction_type, category, amount_str, date, notes)
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Input", str(e))
+            return
         
-        # gets the transaction with associated id
-        current_transaction = get_transaction_by_id(self.conn, transaction_id)    
-        if not current_transaction:
+        parent_dialog.close()
+
+        # a single UPDATE, no need to read the transaction first
+        self.workers.write(update_transactions, patch, ids=[transaction_id],
+                           on_result=lambda count: self.transaction_updated(transaction_id, count),
+                           on_error=self.show_database_error)
+
+    def transaction_updated(self, transaction_id, count):
+        # shows success or failure message
+        if count:
+            QMessageBox.information(self, "Success", f"Transaction with ID {transaction_id} has been updated.")
+        else:
             QMessageBox.warning(self, "Transaction Not Found", f"No transaction found with ID {transaction_id}.")
-            return    
 
-        # validates amount 
-        amount = float(amount_str) if amount_str else current_transaction[3]
+# --------------------------------------- EDIT AND DELETE SELECTED TRANSACTIONS ---------------------------------
 
-        # creates a tuple with updated values (using previous/existing values if input is empty)
-        updated_transaction = (
-            transaction_type or current_transaction[1], 
-            category or current_transaction[2],            
-            amount,                                        
-            date or current_transaction[4],                
-            notes or current_transaction[5]                
-        )    
+    # ids of the rows selected in a transactions table
+    def selected_ids(self, table):
+        return sorted(int(index.data()) for index in table.selectionModel().selectedRows(0))
 
-        # calls function in transactions.py to update transaction
-        success = update_transaction(self.conn, transaction_id, updated_transaction)
+    # deletes every selected transaction with one statement, after asking
+    def delete_selected_transactions(self, table):
+        ids = self.selected_ids(table)
+        if not ids:
+            QMessageBox.information(self, "Delete Selected", "Select the transactions to delete first.")
+            return
+        answer = QMessageBox.question(self, "Delete Selected", f"Delete {len(ids)} selected transactions?")
+        if answer != QMessageBox.Yes:
+            return
 
-        parent_dialog.close()
+        self.workers.write(delete_transactions, ids=ids,
+                           on_result=lambda count: QMessageBox.information(self, "Success", f"{count} transactions deleted."),
+                           on_error=self.show_database_error)
 
-        # shows success or failure message
-        if success:
-            QMessageBox.information(self, "Success", f"Transaction with ID {transaction_id} has been updated.")
-        else:
-            QMessageBox.warning(self, "Failure", f"Failed to update transaction with ID {transaction_id}.")
+    # applies one edit to every selected transaction, blank fields keep their values
+    def edit_selected_transactions(self, table):
+        ids = self.selected_ids(table)
+        if not ids:
+            QMessageBox.information(self, "Edit Selected", "Select the transactions to edit first.")
+            return
+
+        dialog = self.reusable_dialog("batch_edit", "Edit Selected Transactions", self.build_batch_edit_dialog)
+        dialog.ids = ids
+        dialog.count_label.setText(f"{len(ids)} transactions selected. Blank = Remain Same")
+        dialog.exec_()
+
+    def build_batch_edit_dialog(self, dialog):
+        layout = QFormLayout(dialog)
+        dialog.count_label = QLabel(dialog)
+        dialog.count_label.setStyleSheet("font-weight: bold; font-size: 12px;")
+
+        type_input = QLineEdit(dialog)
+        category_input = QLineEdit(dialog)
+        amount_input = QLineEdit(dialog)
+        date_input = QLineEdit(dialog)
+        notes_input = QLineEdit(dialog)
+
+        layout.addRow(dialog.count_label)
+        layout.addRow("Type (income/expense):", type_input)
+        layout.addRow("Category:", category_input)
+        layout.addRow("Amount:", amount_input)
+        layout.addRow("Date (YYYY-MM-DD):", date_input)
+        layout.addRow("Notes:", notes_input)
+
+        button = QPushButton("Update Selected", dialog)
+        layout.addWidget(button)
+
+        def submit():
+            try:
+                patch = edit_patch(type_input.text(), category_input.text(), amount_input.text(),
+                                   date_input.text(), notes_input.text())
+            except ValueError as e:
+                QMessageBox.warning(self, "Invalid Input", str(e))
+                return
+            dialog.accept()
+            self.workers.write(update_transactions, patch, ids=dialog.ids,
+                               on_result=lambda count: QMessageBox.information(self, "Success", f"{count} transactions updated."),
+                               on_error=self.show_database_error)
+
+        button.clicked.connect(submit)
 
 # --------------------------------------- EXPORT TRANSACTIONS TO CSV ---------------------------------------------
     def export_transactions_ui(self):
         options = QFileDialog.Options()
-        file_name, _ = QFileDialog.getSaveFileName(self, "Save CSV File", "", "CSV Files (*.csv);;All Files (*)", options=options)
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save CSV File", "", "CSV Files (*.csv);;Compressed CSV Files (*.csv.gz);;Parquet Files (*.parquet);;Arrow Files (*.arrow);;All Files (*)", options=options)
 
         if not file_name:
             return  # user cancelled save
 
-        try:
-            export_to_csv(self.conn, file_name)
-            
-            QMessageBox.information(self, "Success", f"Transactions exported to {file_name} successfully.")
+        self.export_button.setEnabled(False)    # one export at a time
+
+        # typed columnar files for analytics tools, CSV otherwise
+        export = export_to_arrow if file_name.lower().endswith((".parquet", ".arrow", ".feather")) else export_to_csv
+        task = self.workers.read(
+            export, file_name, with_progress=True, start=False,
+            on_result=lambda rows: QMessageBox.information(self, "Success", f"{rows} transactions exported to {file_name} successfully."),
+            on_error=lambda error: QMessageBox.warning(self, "Export Failed", f"An error occurred while exporting transactions: {error}"),
+            on_cancelled=lambda: self.export_cancelled(file_name),
+            on_finished=lambda: self.export_button.setEnabled(True))
 
-        except Exception as e:
-            QMessageBox.warning(self, "Export Failed", f"An error occurred while exporting transactions: {str(e)}")
+        # shows a running row count while the worker exports
+        self.show_busy("Export Transactions", "Exporting transactions...", task,
+                       progress_label=lambda rows: f"Exported {rows} transactions...")
+
+    def export_cancelled(self, file_name):
+        if os.path.exists(file_name):
+            os.remove(file_name)    # don't leave a partial export behind
+        QMessageBox.information(self, "Export Cancelled", "The export was cancelled.")
 
 
 # --------------------------------------- FILTER TRANSACTION BY NOTES --------------------------------------
 
     def search_transactions_ui(self):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Search Transactions by Notes")
+        self.reusable_dialog("search", "Search Transactions by Notes", self.build_search_dialog).exec_()
 
+    def build_search_dialog(self, dialog):
         layout = QFormLayout(dialog)
 
         # Input field for search query
         search_input = QLineEdit(dialog)
         layout.addRow("Enter keywords in Notes:", search_input)
+        layout.addRow(QLabel('Use "quotes" for phrases and * for prefixes, e.g. groc*'))
 
         search_button = QPushButton("Search", dialog)
         layout.addWidget(search_button)
@@ -456,86 +567,252 @@ class BudgetTrackerApp(QMainWindow):
         search_button.clicked.connect(lambda: self.search_transactions(search_input.text(), dialog))
 
         dialog.setLayout(layout)
-        dialog.exec_()
 
     def search_transactions(self, keyword, parent_dialog):
     
         parent_dialog.close()
 
-        # fetch transactions that contain the keyword in the notes
-        transactions = search_transactions_by_notes(self.conn, keyword)
-
-        # display the results in a table by calling display_transactions
-        self.display_transactions(transactions)
-    
-    def display_transactions(self, transactions):
-        table = QTableWidget()
-        table.setColumnCount(6)
-        table.setHorizontalHeaderLabels(["ID", "Type", "Category", "Amount", "Date", "Notes"])
-        table.setRowCount(len(transactions))
-
-        for row, transaction in enumerate(transactions):
-            for column, value in enumerate(transaction):
-                table.setItem(row, column, QTableWidgetItem(str(value)))
+        # the best matching transactions come first, with the matched words highlighted in the notes
+        # the results table loads them a page at a time as it is scrolled
+        dialog = self.dialogs.get("search_results")
+        if dialog is None:
+            dialog = self.reusable_dialog("search_results", "Search Results", self.build_search_results_dialog)
+        dialog.table.model().set_text(keyword)
+        dialog.setWindowTitle(f"Search Results - {keyword}")
+        dialog.exec_()
 
-        table.resizeColumnsToContents()
+    def build_search_results_dialog(self, dialog):
+        dialog.table = QTableView(dialog)
+        dialog.table.setModel(SearchResultsModel(None, parent=dialog.table, workers=self.workers))
+        dialog.table.setColumnWidth(5, 400)
 
-        table_dialog = QDialog(self)
-        table_dialog.setWindowTitle("Search Results")
         layout = QVBoxLayout()
-        layout.addWidget(table)
-        table_dialog.setLayout(layout)
-        table_dialog.setFixedSize(800, 600)
-        table_dialog.exec_()
+        layout.addWidget(dialog.table)
+        dialog.setLayout(layout)
+        dialog.setFixedSize(800, 600)
 # --------------------------------------- SUMMARIZE TRANSACTIONS -------------------------------------------
 
     def summarize_transactions_ui(self):
-        dialog = QDialog(self)
-        dialog.setWindowTitle("Summarize Transactions")
+        self.reusable_dialog("summarize", "Summarize Transactions", self.build_summarize_dialog).exec_()
 
+    def build_summarize_dialog(self, dialog):
         start_date_label = QLabel("Start Date (YYYY-MM-DD):")
         start_date_input = QLineEdit()
 
         end_date_label = QLabel("End Date (YYYY-MM-DD):")
         end_date_input = QLineEdit()
 
+        # optional breakdown of the totals
+        breakdown_label = QLabel("Breakdown:")
+        breakdown_input = QComboBox()
+        breakdown_input.addItems(["None", "Category", "Day", "Week", "Month", "Year"])
+
         submit_button = QPushButton("Summarize")
 
         layout = QFormLayout()
         layout.addRow(start_date_label, start_date_input)
         layout.addRow(end_date_label, end_date_input)
+        layout.addRow(breakdown_label, breakdown_input)
         layout.addWidget(submit_button)
 
         dialog.setLayout(layout)
 
-        submit_button.clicked.connect(lambda: self.show_summary(start_date_input.text(), end_date_input.text(), dialog))
-
-        dialog.exec_()
+        submit_button.clicked.connect(lambda: self.show_summary(start_date_input.text(), end_date_input.text(), dialog, breakdown_input.currentText().lower()))
     
 
-    def show_summary(self, start_date, end_date, parent_dialog):
+    def show_summary(self, start_date, end_date, parent_dialog, breakdown="none"):
         parent_dialog.close()
 
         # date validation
         try:
-            start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-            end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
+            day_number(start_date)
+            day_number(end_date)
         except ValueError:
             QMessageBox.warning(self, "Invalid Date Format", "Please enter the date in YYYY-MM-DD format.")
             return
 
-        total_income, total_expenses, net_balance = summarize_transactions(self.conn, start_date, end_date)
+        if breakdown != "none":
+            task = self.workers.read(aggregate_transactions, start_date, end_date, breakdown, start=False,
+                                     on_result=lambda result: self.show_summary_breakdown(start_date, end_date, breakdown, result),
+                                     on_error=self.show_database_error)
+        else:
+            task = self.workers.read(summarize_transactions, start_date, end_date, start=False,
+                                     on_result=lambda totals: self.show_summary_totals(start_date, end_date, *totals),
+                                     on_error=self.show_database_error)
+        self.show_busy("Summarize Transactions", "Calculating summary...", task)
+
+    def show_summary_totals(self, start_date, end_date, total_income, total_expenses, net_balance):
 
         # summary in message box
         summary_message = f"{start_date} to {end_date}:\n\n" \
-                        f"Total Income: ${total_income}\n" \
-                        f"Total Expenses: ${total_expenses}\n" \
-                        f"Net Balance: ${net_balance}"
+                        f"Total Income: ${format_cents(total_income)}\n" \
+                        f"Total Expenses: ${format_cents(total_expenses)}\n" \
+                        f"Net Balance: ${format_cents(net_balance)}"
 
         QMessageBox.information(self, "Transaction Summary", summary_message)
 
+    # shows income, expenses and net balance per category or period, with the totals as the last row
+    # the figures follow writes made while the dialog is open
+    def show_summary_breakdown(self, start_date, end_date, breakdown, result):
+        dialog = self.reusable_dialog("summary_breakdown", "Transaction Summary", self.build_summary_breakdown_dialog)
+        dialog.setWindowTitle(f"Transaction Summary by {breakdown.capitalize()} - {start_date} to {end_date}")
+        dialog.summary = (start_date, end_date, breakdown, result)
+        dialog.render()
+        dialog.exec_()
+
+    def build_summary_breakdown_dialog(self, dialog):
+        dialog.resize(600, 400)
+        dialog.table = QTableWidget(0, 4, dialog)
+        dialog.summary = None
+
+        # one row per group, so this stays small no matter how many transactions there are
+        def render():
+            start_date, end_date, breakdown, result = dialog.summary
+            table = dialog.table
+            table.clearContents()
+            table.setRowCount(len(result) + 1)
+            table.setHorizontalHeaderLabels([breakdown.capitalize(), "Income", "Expenses", "Net Balance"])
+
+            rows = [(key[0], income, expense, net) for key, income, expense, net in result]
+            rows.append(("Total", *result.totals()))
+            for row, (group, income, expense, net) in enumerate(rows):
+                table.setItem(row, 0, QTableWidgetItem(str(group)))
+                for column, value in enumerate((income, expense, net), start=1):
+                    table.setItem(row, column, QTableWidgetItem(format_cents(value)))
+
+        # a write only changes the groups of the old and new row, so the result is updated in memory
+        def apply_change(change):
+            if dialog.summary is None or not dialog.isVisible() or change.database != os.path.abspath(self.db.db_file):
+                return
+            start_date, end_date, breakdown, result = dialog.summary
+            if change.kind == "reset":
+                def reloaded(result):
+                    dialog.summary = (start_date, end_date, breakdown, result)
+                    render()
+                self.workers.read(aggregate_transactions, start_date, end_date, breakdown,
+                                  on_result=reloaded, on_error=self.show_database_error)
+                return
+            for row, sign in ((change.previous, -1), (change.row, 1)):
+                if row is not None and start_date <= row[4] <= end_date:
+                    result.apply(row, sign)
+            render()
+
+        dialog.render = render
+        change_relay().changed.connect(apply_change)
+
+        layout = QVBoxLayout()
+        layout.addWidget(dialog.table)
+        dialog.setLayout(layout)
+
+# --------------------------------------------- CHARTS ------------------------------------------------
+
+    # balance over time and spending per category, downsampled so any ledger size draws quickly
+    def charts_ui(self):
+        try:
+            from chart_view import ChartWidget    # matplotlib is optional and slow to import, so only on first use
+        except ImportError:
+            QMessageBox.warning(self, "Charts Unavailable", "Charts need matplotlib, install it with: pip install matplotlib")
+            return
+        dialog = self.reusable_dialog("charts", "Charts", lambda dialog: self.build_charts_dialog(dialog, ChartWidget))
+        dialog.chart.load()
+        dialog.exec_()
+
+    def build_charts_dialog(self, dialog, chart_class):
+        dialog.resize(900, 700)
+        dialog.chart = chart_class(self.workers, dialog)
+
+        # the visible range is loaded again after writes, at most once per reload delay
+        def apply_change(change):
+            if dialog.isVisible() and change.database == os.path.abspath(self.db.db_file):
+                dialog.chart.loaded = None
+                dialog.chart.reload_timer.start()
+        change_relay().changed.connect(apply_change)
+
+        layout = QVBoxLayout()
+        layout.addWidget(dialog.chart)
+        dialog.setLayout(layout)
+
+# --------------------------------------------- DIAGNOSTICS ------------------------------------------------
+
+    # timings of database calls and background tasks, and the statements that scan a whole table
+    def diagnostics_ui(self):
+        dialog = self.reusable_dialog("diagnostics", "Diagnostics", self.build_diagnostics_dialog)
+        dialog.refresh()
+        dialog.exec_()
+
+    def build_diagnostics_dialog(self, dialog):
+        dialog.resize(900, 600)
+
+        operations_table = QTableWidget(0, 7, dialog)
+        operations_table.setHorizontalHeaderLabels(["Operation", "Calls", "Mean (ms)", "p95 (ms)", "Max (ms)", "Rows", "Errors"])
+        scans_table = QTableWidget(0, 3, dialog)
+        scans_table.setHorizontalHeaderLabels(["Full Scan Statement", "Calls", "Query Plan"])
+        cache_label = QLabel(dialog)
+
+        # statement capture is off by default, operation timings are always recorded
+        profile_box = QCheckBox("Record the SQL of each operation and flag full table scans", dialog)
+        profile_box.setChecked(self.db.config["profile"])
+        profile_box.toggled.connect(self.db.set_profiling)
+
+        refresh_button = QPushButton("Refresh", dialog)
+        save_button = QPushButton("Save JSON...", dialog)
+        reset_button = QPushButton("Reset", dialog)
+
+        def refresh():
+            snapshot = profiler.snapshot()
+
+            operations_table.setRowCount(len(snapshot["operations"]))
+            for row, (name, stats) in enumerate(snapshot["operations"].items()):
+                values = [name, stats["count"], f"{stats['mean_ms']:.2f}", f"{stats['p95_ms']:g}",
+                          f"{stats['max_ms']:.2f}", stats["rows"], stats["errors"]]
+                for column, value in enumerate(values):
+                    operations_table.setItem(row, column, QTableWidgetItem(str(value)))
+            operations_table.resizeColumnsToContents()
+
+            scans = [statement for statement in snapshot["statements"] if statement["full_scan"]]
+            scans_table.setRowCount(len(scans))
+            for row, statement in enumerate(scans):
+                values = [statement["sql"], statement["calls"], "; ".join(statement["plan"])]
+                for column, value in enumerate(values):
+                    scans_table.setItem(row, column, QTableWidgetItem(str(value)))
+            scans_table.resizeColumnsToContents()
+
+            cache = query_cache.stats()
+            cache_label.setText(f"Query cache: {cache['hits']} hits, {cache['misses']} misses "
+                                f"({cache['hit_rate']:.0%}), {cache['entries']} entries")
+
+        def save():
+            file_name, _ = QFileDialog.getSaveFileName(dialog, "Save Diagnostics", "diagnostics.json", "JSON Files (*.json)")
+            if file_name:
+                try:
+                    profiler.dump(file_name)
+                except OSError as e:
+                    QMessageBox.warning(dialog, "Save Failed", str(e))
+
+        def reset():
+            profiler.reset()
+            refresh()
+
+        refresh_button.clicked.connect(refresh)
+        save_button.clicked.connect(save)
+        reset_button.clicked.connect(reset)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(refresh_button)
+        buttons.addWidget(save_button)
+        buttons.addWidget(reset_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(profile_box)
+        layout.addWidget(QLabel("Operations (slowest p95 first):"))
+        layout.addWidget(operations_table)
+        layout.addWidget(QLabel("Statements with full table scans:"))
+        layout.addWidget(scans_table)
+        layout.addWidget(cache_label)
+        layout.addLayout(buttons)
+        dialog.setLayout(layout)
+        dialog.refresh = refresh
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = BudgetTrackerApp()
-    window.show()
-    sys.exit(app.exec_())
+    from app import main    # app.py is the entry point, this keeps `python gui.py` working
+    sys.exit(main())
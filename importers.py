@@ -0,0 +1,147 @@
+import csv
+import re
+from dates import day_to_date
+from transactions import add_transactions_bulk, import_pyarrow
+
+# one OFX tag and the value after it, e.g. "<TRNAMT>-12.50" or "</STMTTRN>"
+# works for both SGML (elements without closing tags) and XML files
+OFX_TAG = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+
+# yields (type, category, amount, date, notes) rows from a CSV file one line at a time, gunzipping .gz files
+# the header names the columns (Type, Category, Amount, Date, Notes), extra columns such as ID are ignored
+# empty notes are read as None, which export_to_csv writes as an empty field
+def read_csv_transactions(filename):
+    import gzip
+    opener = gzip.open if filename.lower().endswith(".gz") else open
+    with opener(filename, mode='rt', newline='') as file:
+        reader = csv.DictReader(file)
+        if reader.fieldnames is None:
+            return    # empty file
+
+        columns = {name.strip().lower(): name for name in reader.fieldnames}
+        missing = [name for name in ("type", "category", "amount", "date") if name not in columns]
+        if missing:
+            raise ValueError(f"CSV file is missing columns: {', '.join(missing)}")
+
+        for record in reader:
+            yield (
+                (record[columns["type"]] or "").strip().lower(),
+                (record[columns["category"]] or "").strip(),
+                (record[columns["amount"]] or "").strip(),
+                (record[columns["date"]] or "").strip(),
+                (record[columns["notes"]] or None) if "notes" in columns else None,
+            )
+
+
+# yields (type, category, amount, date, notes) rows from the <STMTTRN> entries of an OFX bank statement
+# OFX has no categories, so every row gets the given category; the sign of TRNAMT decides income/expense
+def read_ofx_transactions(filename, category="uncategorized"):
+    entry = None
+
+    with open(filename, errors='replace') as file:
+        for line in file:
+            for closing, tag, value in OFX_TAG.findall(line):
+                tag = tag.upper()
+                if tag == "STMTTRN":
+                    # an entry ends at its closing tag, or at the next entry if the file leaves it out
+                    if entry:
+                        yield ofx_entry_to_transaction(entry, category)
+                    entry = None if closing else {}
+                elif entry is not None and not closing:
+                    entry[tag] = value.strip()
+
+    if entry:
+        yield ofx_entry_to_transaction(entry, category)
+
+
+def ofx_entry_to_transaction(entry, category):
+    amount = entry.get("TRNAMT", "")
+    transaction_type = "income"
+    if amount.startswith("-"):
+        transaction_type = "expense"
+        amount = amount[1:]
+
+    posted = entry.get("DTPOSTED", "")    # YYYYMMDD followed by an optional time
+    date = f"{posted[0:4]}-{posted[4:6]}-{posted[6:8]}" if len(posted) >= 8 else posted
+
+    notes = entry.get("MEMO") or entry.get("NAME")
+    return (transaction_type, category, amount, date, notes)
+
+
+# yields record batches of at most batch_size rows from a Parquet file or an Arrow IPC file
+# Arrow files are memory-mapped, so batches are read in place instead of being copied into memory
+def read_arrow_batches(filename, batch_size=65536):
+    pa = import_pyarrow()
+    if filename.lower().endswith(".parquet"):
+        import pyarrow.parquet
+        yield from pyarrow.parquet.ParquetFile(filename, memory_map=True).iter_batches(batch_size=batch_size)
+        return
+
+    with pa.memory_map(filename) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            for offset in range(0, batch.num_rows, batch_size):
+                yield batch.slice(offset, batch_size)
+
+
+# the values of an Arrow column as a list, dictionary columns are decoded once per distinct value
+def arrow_values(pa, column):
+    if not pa.types.is_dictionary(column.type):
+        return column.to_pylist()
+    dictionary = column.dictionary.to_pylist()
+    return [None if index is None else dictionary[index] for index in column.indices.to_pylist()]
+
+
+# yields (type, category, amount in cents, date, notes) rows from a file written by export_to_arrow,
+# or any Arrow/Parquet file with those columns; amounts may also be floating point or decimal dollars
+def read_arrow_transactions(filename, batch_size=65536):
+    pa = import_pyarrow()
+    import pyarrow.compute as pc
+
+    dates = {}    # day number -> YYYY-MM-DD, dates repeat a lot
+    for batch in read_arrow_batches(filename, batch_size):
+        columns = {name.lower(): batch.column(index) for index, name in enumerate(batch.schema.names)}
+        missing = [name for name in ("type", "category", "amount", "date") if name not in columns]
+        if missing:
+            raise ValueError(f"Arrow file is missing columns: {', '.join(missing)}")
+
+        amounts = columns["amount"]
+        if pa.types.is_floating(amounts.type) or pa.types.is_decimal(amounts.type):
+            cents = pc.round(pc.multiply(amounts.cast(pa.float64()), 100), round_mode="half_towards_infinity")
+            # NaN, infinite and out of int64 range amounts become missing, add_transactions_bulk rejects those rows
+            in_range = pc.and_(pc.is_finite(cents), pc.less(pc.abs(cents), 2.0 ** 63))
+            amounts = pc.if_else(in_range, cents, None).cast(pa.int64())    # like to_cents
+        elif not pa.types.is_integer(amounts.type):
+            raise ValueError(f"Unsupported amount column type: {amounts.type}")
+
+        days = columns["date"]
+        if pa.types.is_timestamp(days.type):
+            days = days.cast(pa.date32())
+        if pa.types.is_date32(days.type):
+            days = [None if day is None else dates.get(day) or dates.setdefault(day, day_to_date(day))
+                    for day in days.cast(pa.int32()).to_pylist()]
+        else:
+            days = arrow_values(pa, days)    # YYYY-MM-DD text, checked by add_transactions_bulk
+
+        notes = arrow_values(pa, columns["notes"]) if "notes" in columns else [None] * batch.num_rows
+        yield from zip(arrow_values(pa, columns["type"]), arrow_values(pa, columns["category"]),
+                       amounts.to_pylist(), days, notes)
+
+
+# streams a .csv/.csv.gz, .ofx/.qfx, .parquet or Arrow (.arrow, .feather) file into the database through add_transactions_bulk
+# duplicates="skip" or "merge" handles rows that are already stored, e.g. when a statement is imported again
+def import_transactions(conn, filename, batch_size=10000, progress=None, duplicates="insert"):
+    extension = filename.lower().rsplit(".", 1)[-1]
+    if extension == "csv" or filename.lower().endswith(".csv.gz"):
+        rows = read_csv_transactions(filename)
+    elif extension in ("ofx", "qfx"):
+        rows = read_ofx_transactions(filename)
+    elif extension in ("parquet", "arrow", "feather"):
+        rows = read_arrow_transactions(filename, batch_size)
+        return add_transactions_bulk(conn, rows, batch_size, progress, amounts_in_cents=True, duplicates=duplicates)
+    else:
+        raise ValueError(f"Unsupported import file type: .{extension}")
+
+    return add_transactions_bulk(conn, rows, batch_size, progress, duplicates=duplicates)
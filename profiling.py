@@ -0,0 +1,233 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+
+# upper bounds of the latency histogram buckets in milliseconds, the last bucket is unbounded
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# distinct statements remembered per call, executemany can run millions of them
+MAX_STATEMENTS_PER_CALL = 20
+
+# string and number literals, replaced by ? so statements that only differ in values are grouped
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+# statements that EXPLAIN QUERY PLAN is run on
+# FTS5 runs its own statements on quoted 'schema'.'table' names, those are left out
+EXPLAINABLE = re.compile(r"\s*(SELECT|WITH|UPDATE|DELETE)\b(?!.*'\.')", re.IGNORECASE | re.DOTALL)
+
+
+def normalize_sql(sql):
+    return " ".join(LITERAL.sub("?", sql).split())
+
+
+# EXPLAIN QUERY PLAN lines that read a whole table or index, e.g. "SCAN transactions"
+def full_scans(plan):
+    return [detail for detail in plan
+            if detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail and not detail.startswith("SCAN sqlite_")]
+
+
+# latency counts in fixed buckets, percentiles are reported as the upper bound of their bucket
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = max(1, round(fraction * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS_MS[bucket] if bucket < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "buckets": {f"<={bound}" if index < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}": count
+                        for index, (bound, count) in enumerate(zip(BUCKETS_MS + (None,), self.counts)) if count},
+        }
+
+
+# collects timings of profiled calls and the SQL they ran
+# statements are captured with the sqlite3 trace callback of every connection passed to attach()
+# and each distinct statement shape is checked once with EXPLAIN QUERY PLAN for full scans
+class Profiler:
+    def __init__(self, recent_calls=200):
+        self.lock = threading.Lock()
+        self.local = threading.local()    # per thread: stack of statement collectors of the running calls
+        self.recent_calls = recent_calls
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}    # name -> {"histogram", "rows", "errors", "statements"}
+            self.statements = {}    # normalized sql -> {"calls", "operations", "plan", "full_scan"}
+            self.recent = deque(maxlen=self.recent_calls)
+
+    # installs the trace callback on a connection, the callback only does work inside profiled calls
+    def attach(self, conn):
+        conn.set_trace_callback(self.trace)
+
+    def detach(self, conn):
+        conn.set_trace_callback(None)
+
+    def trace(self, sql):
+        collectors = getattr(self.local, "collectors", None)
+        if not collectors or sql.startswith("--"):    # "-- ..." are statements run by triggers and FTS5 internally
+            return
+        collector = collectors[-1]
+        collector["statements"][sql] = None
+        if len(collector["statements"]) >= MAX_STATEMENTS_PER_CALL and collector["conn"] is not None:
+            # e.g. executemany: stop tracing the call's connection until it returns, so it runs at full speed
+            collector["conn"].set_trace_callback(None)
+            collector["paused"] = True
+
+    # runs fn(*args, **kwargs) as operation name, recording wall time, rows and statements
+    # rows(result) gives the number of rows handled, None to skip; the explain connection is args[0] if it is one
+    def call(self, name, fn, args, kwargs, rows=None):
+        collectors = getattr(self.local, "collectors", None)
+        if collectors is None:
+            collectors = self.local.collectors = []
+        conn = args[0] if args and isinstance(args[0], sqlite3.Connection) else None
+        collector = {"statements": {}, "conn": conn, "paused": False}    # statements as an insertion ordered set
+        collectors.append(collector)
+
+        failed = True
+        result = None
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            collectors.pop()
+            if collector["paused"]:
+                self.attach(conn)
+            if collectors:
+                collectors[-1]["statements"].update(collector["statements"])    # nested calls count towards the outer one
+            row_count = None if failed or rows is None else rows(result)
+            self.record(name, elapsed_ms, row_count, collector["statements"], conn, failed)
+
+    def record(self, name, elapsed_ms, row_count, statements, conn=None, failed=False):
+        shapes = {}
+        for sql in statements:
+            shapes.setdefault(normalize_sql(sql), sql)
+
+        with self.lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = {"histogram": Histogram(), "rows": 0, "errors": 0, "statements": set()}
+            operation["histogram"].add(elapsed_ms)
+            operation["rows"] += row_count or 0
+            operation["errors"] += failed
+
+            unexplained = []
+            for shape, example in shapes.items():
+                statement = self.statements.get(shape)
+                if statement is None:
+                    statement = self.statements[shape] = {"calls": 0, "operations": set(), "plan": None, "full_scan": False}
+                    unexplained.append((shape, example))
+                statement["calls"] += 1
+                statement["operations"].add(name)
+                operation["statements"].add(shape)
+
+            self.recent.append({
+                "operation": name,
+                "time": time.time(),
+                "ms": elapsed_ms,
+                "rows": row_count,
+                "error": failed,
+                "sql": list(shapes),
+            })
+
+        if conn is not None:
+            for shape, example in unexplained:
+                self.explain(conn, shape, example)
+
+    # runs outside the trace callback: a connection can't be used from inside its own callback
+    def explain(self, conn, shape, sql):
+        if not EXPLAINABLE.match(sql):
+            return
+        collectors = self.local.collectors
+        self.local.collectors = []    # don't record the EXPLAIN itself
+        try:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        except sqlite3.Error:
+            return    # e.g. the connection was interrupted or closed
+        finally:
+            self.local.collectors = collectors
+        with self.lock:
+            statement = self.statements[shape]
+            statement["plan"] = plan
+            statement["full_scan"] = bool(full_scans(plan))
+
+    # everything recorded so far as plain data, slowest operations first
+    def snapshot(self):
+        with self.lock:
+            operations = {
+                name: {**operation["histogram"].as_dict(),
+                       "rows": operation["rows"],
+                       "errors": operation["errors"],
+                       "statements": sorted(operation["statements"])}
+                for name, operation in self.operations.items()
+            }
+            statements = [
+                {"sql": shape, "calls": statement["calls"],
+                 "operations": sorted(statement["operations"]),
+                 "plan": statement["plan"], "full_scan": statement["full_scan"]}
+                for shape, statement in self.statements.items()
+            ]
+            recent = list(self.recent)
+
+        return {
+            "operations": dict(sorted(operations.items(), key=lambda item: -item[1]["p95_ms"])),
+            "statements": sorted(statements, key=lambda statement: (not statement["full_scan"], -statement["calls"])),
+            "recent_calls": recent,
+        }
+
+    def full_scan_statements(self):
+        return [statement for statement in self.snapshot()["statements"] if statement["full_scan"]]
+
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+profiler = Profiler()
+
+
+# profiles every call of the decorated function as operation name (default: the function name)
+# rows(result) returns the number of rows handled, by default the length of a list result
+def profiled(name=None, rows=None):
+    def decorator(fn):
+        operation = name or fn.__name__
+        count_rows = rows or (lambda result: len(result) if isinstance(result, list) else None)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            return profiler.call(operation, fn, args, kwargs, count_rows)
+
+        return wrapper
+    return decorator
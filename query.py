@@ -0,0 +1,270 @@
+import copy
+import re
+from database import has_fts_index, attach_archives
+from dates import date_sql, day_number, year_range
+
+# column order of the transactions table, also used to whitelist sort columns
+TRANSACTION_COLUMNS = ("id", "type", "category", "amount", "date", "notes")
+
+# the stored columns, as each part of a query over the main table and the archives returns them
+STORED_SELECT = "t.id, t.type, t.category, t.amount, t.date, t.notes"
+
+# the columns of a transaction row as returned to callers, with the stored day number as YYYY-MM-DD
+TRANSACTION_SELECT = f"t.id, t.type, t.category, t.amount, {date_sql('t.date')}, t.notes"
+
+# a "quoted phrase" or a single search term, e.g. groc* or uber
+SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+# the words of what the user typed, e.g. ["groc", "uber eats"] for groc* "uber eats", the same terms
+# build_fts_query() makes; without a full-text index each one has to appear as a substring
+def search_words(text):
+    words = []
+    for phrase, term in SEARCH_TERM.findall(text):
+        words.extend(re.findall(r"\w+", phrase or term))
+    return words
+
+
+# turns what the user typed into an FTS5 query, every term has to match
+# supports "exact phrases" and prefix* terms, anything else that FTS5 treats as syntax is dropped
+def build_fts_query(text):
+    terms = []
+    for phrase, term in SEARCH_TERM.findall(text):
+        words = re.findall(r"\w+", phrase or term)
+        if not words:
+            continue
+        prefix = "*" if term.endswith("*") else ""
+        terms.append('"' + " ".join(words) + '"' + prefix)
+    return " ".join(terms)
+
+
+# a query over the transactions table built from optional filters, e.g.
+#   TransactionQuery().where_type("expense").in_categories(["travel"]).between("2024-03-01", "2024-03-31").matching("uber")
+# every method returns a new query, so a base query can be shared and extended
+# compiles to a single parameterized statement; results are read lazily with iterate()
+class TransactionQuery:
+    def __init__(self):
+        self.transaction_type = None
+        self.categories = None
+        self.start_date = None
+        self.end_date = None
+        self.min_amount = None    # cents
+        self.max_amount = None
+        self.text = None
+        self.text_column = None    # None searches notes and category
+        self.sort_column = "id"
+        self.descending = False
+        self.cursor = None    # keyset position (sort value, id) to continue after
+        self.row_limit = None
+        self.archives = False    # also read the per-year archive databases
+
+    def replace(self, **changes):
+        query = copy.copy(self)
+        query.__dict__.update(changes)
+        return query
+
+    def where_type(self, transaction_type):
+        return self.replace(transaction_type=transaction_type)
+
+    def in_categories(self, categories):
+        return self.replace(categories=tuple(categories))
+
+    # inclusive YYYY-MM-DD bounds, either can be None; raises ValueError for malformed dates
+    def between(self, start_date=None, end_date=None):
+        for value in (start_date, end_date):
+            if value is not None:
+                day_number(value)
+        return self.replace(start_date=start_date, end_date=end_date)
+
+    # inclusive bounds in cents, either can be None
+    def amount_between(self, min_amount=None, max_amount=None):
+        return self.replace(min_amount=min_amount, max_amount=max_amount)
+
+    # full-text match on notes and category, or only on column ("notes" or "category")
+    def matching(self, text, column=None):
+        return self.replace(text=text, text_column=column)
+
+    # column is one of TRANSACTION_COLUMNS, or "relevance" to rank text matches best first
+    def order_by(self, column, descending=False):
+        if column not in TRANSACTION_COLUMNS and column != "relevance":
+            raise ValueError(f"Unknown sort column: {column}")
+        return self.replace(sort_column=column, descending=descending)
+
+    # continue after the row with this (sort value, id), as returned by sort_key()
+    def after(self, key):
+        return self.replace(cursor=key)
+
+    def limit(self, row_limit):
+        return self.replace(row_limit=row_limit)
+
+    # reads archived years as well as the main table, see database.archive_year()
+    # text matching on archived rows uses LIKE, they aren't in the full-text index
+    def including_archives(self):
+        return self.replace(archives=True)
+
+    # the archived years the date filter reaches, of the ones attach_archives() returned
+    def archived_years(self, years):
+        first = day_number(self.start_date) if self.start_date is not None else None
+        last = day_number(self.end_date) if self.end_date is not None else None
+        return [year for year in years if (first is None or year_range(year)[1] >= first)
+                and (last is None or year_range(year)[0] <= last)]
+
+    def sort_expression(self):
+        return "COALESCE(t.notes, '')" if self.sort_column == "notes" else "t." + self.sort_column    # notes can be NULL
+
+    # keyset position of a row returned by this query, to pass to after()
+    def sort_key(self, row):
+        value = row[TRANSACTION_COLUMNS.index(self.sort_column)]
+        if self.sort_column == "date":
+            value = day_number(value)    # rows hold YYYY-MM-DD, the table is ordered by day number
+        return ("" if value is None else value, row[0])
+
+    # whether a row as returned by fetch_all() passes the filters, e.g. to apply a write to results already loaded
+    # text matching is approximated: every word searched for has to appear in the searched columns
+    def matches(self, row):
+        _, transaction_type, category, amount, date, notes = row
+        if self.transaction_type is not None and transaction_type != self.transaction_type:
+            return False
+        if self.categories is not None and category not in self.categories:
+            return False
+        if (self.start_date is not None and date < self.start_date) or (self.end_date is not None and date > self.end_date):
+            return False
+        if (self.min_amount is not None and amount < self.min_amount) or (self.max_amount is not None and amount > self.max_amount):
+            return False
+        if self.text is not None:
+            values = [row[TRANSACTION_COLUMNS.index(self.text_column)]] if self.text_column else [notes, category]
+            searched = " ".join(value or "" for value in values).lower()
+            if not all(word in searched for word in re.findall(r"\w+", self.text.lower())):
+                return False
+        return True
+
+    # returns (sql, params); conn is needed to know whether the full-text index exists
+    # with archives, each archived year the date filter reaches is queried on its own, sorted and limited
+    # like the whole query, and the parts are sorted together: at most row_limit rows per part, where
+    # the all_transactions view would sort every matching row for each page
+    def compile(self, conn, select=TRANSACTION_SELECT):
+        conditions = []
+        params = []
+        years = self.archived_years(attach_archives(conn)) if self.archives else []
+
+        # type has two values: unless an index leads with it and then the sort column ((type), (type, date)),
+        # walking the sort column's index and skipping the other type's rows beats sorting half the table for
+        # each page; the unary + keeps SQLite off the type indexes. One category comes in date, amount or notes
+        # order from (category, column); for several SQLite sorts their matches or walks the sort column's index
+        if self.transaction_type is not None:
+            plus = "+" if self.sort_column not in ("id", "date", "type", "relevance") else ""
+            conditions.append(f"{plus}t.type = ?")
+            params.append(self.transaction_type)
+        if self.categories is not None:
+            if len(self.categories) == 1:    # a one-value IN hides the (category, date) order from the planner
+                conditions.append("t.category = ?")
+            else:
+                conditions.append(f"t.category IN ({', '.join('?' * len(self.categories))})")
+            params.extend(self.categories)
+        if self.start_date is not None:
+            conditions.append("t.date >= ?")
+            params.append(day_number(self.start_date))
+        if self.end_date is not None:
+            conditions.append("t.date <= ?")
+            params.append(day_number(self.end_date))
+        if self.min_amount is not None:
+            conditions.append("t.amount >= ?")
+            params.append(self.min_amount)
+        if self.max_amount is not None:
+            conditions.append("t.amount <= ?")
+            params.append(self.max_amount)
+
+        # the main table is searched through the full-text index when there is one, archives never are
+        main_conditions, main_params = list(conditions), list(params)
+        main_source = "transactions t"
+        ranked = False
+        if self.text is not None:
+            columns = [self.text_column] if self.text_column else ["notes", "category"]
+            like = "(" + " OR ".join(f"t.{column} LIKE ? ESCAPE '\\'" for column in columns) + ")"
+            for word in search_words(self.text):    # archives, or no full-text index: every word as a substring
+                conditions.append(like)
+                params.extend(["%" + word.replace("\\", "\\\\").replace("_", "\\_") + "%"] * len(columns))
+
+            fts_query = build_fts_query(self.text)
+            if fts_query and has_fts_index(conn):
+                if self.text_column:
+                    fts_query = f"{self.text_column} : ({fts_query})"
+                main_source = "transactions_fts JOIN transactions t ON t.id = transactions_fts.rowid"
+                main_conditions.insert(0, "transactions_fts MATCH ?")
+                main_params.insert(0, fts_query)
+                ranked = not years    # rank only compares rows of one full-text search
+            else:
+                main_conditions, main_params = conditions, params
+
+        # a sort column the filter pins to one value leaves the id order, which every index ends with
+        sort_column = self.sort_column
+        if (sort_column == "type" and self.transaction_type is not None
+                or sort_column == "category" and self.categories is not None and len(self.categories) == 1):
+            sort_column = "id"
+
+        direction = "DESC" if self.descending else "ASC"
+        keyset, keyset_params = [], []
+        if sort_column == "relevance":
+            if self.cursor is not None:
+                raise ValueError("Keyset cursors can't be used when ordering by relevance")
+            order = f"{'rank' if ranked else 't.id'} {direction}"
+        else:
+            sort_expression = self.sort_expression()
+            comparison = "<" if self.descending else ">"
+            if sort_column == "id":
+                if self.cursor is not None:
+                    keyset.append(f"t.id {comparison} ?")
+                    keyset_params.append(self.cursor[1])
+                order = f"t.id {direction}"
+            else:
+                if self.cursor is not None:
+                    # the row-value comparison alone can't seek an expression index (notes), the range term can
+                    keyset.append(f"{sort_expression} {comparison}= ?")
+                    keyset.append(f"({sort_expression}, t.id) {comparison} (?, ?)")
+                    keyset_params.append(self.cursor[0])
+                    keyset_params.extend(self.cursor)
+                order = f"{sort_expression} {direction}, t.id {direction}"
+
+        def part(part_select, source, part_conditions, part_params):
+            sql = f"SELECT {part_select} FROM {source}"
+            if part_conditions or keyset:
+                sql += " WHERE " + " AND ".join(part_conditions + keyset)
+            part_params = part_params + keyset_params
+            if self.row_limit is not None or not years:
+                sql += " ORDER BY " + order
+            if self.row_limit is not None:
+                sql += " LIMIT ?"
+                part_params = part_params + [self.row_limit]
+            return sql, part_params
+
+        if not years:
+            return part(select, main_source, main_conditions, main_params)
+
+        parts = [part(STORED_SELECT, main_source, main_conditions, main_params)]
+        parts += [part(STORED_SELECT, f"archive_{year}.transactions t", conditions, params) for year in years]
+        sql = (f"SELECT {select} FROM ("
+               + " UNION ALL ".join(f"SELECT * FROM ({part_sql})" for part_sql, _ in parts)
+               + f") t ORDER BY {order}")
+        params = [param for _, part_params in parts for param in part_params]
+        if self.row_limit is not None:
+            sql += " LIMIT ?"
+            params.append(self.row_limit)
+        return sql, params
+
+    # yields matching rows, reading batch_size rows from the database at a time
+    def iterate(self, conn, batch_size=1000):
+        sql, params = self.compile(conn)
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def fetch_all(self, conn):
+        sql, params = self.compile(conn)
+        return conn.execute(sql, params).fetchall()
+
+    def count(self, conn):
+        sql, params = self.replace(sort_column="id", cursor=None, row_limit=None).compile(conn, "COUNT(*)")
+        return conn.execute(sql, params).fetchone()[0]
@@ -0,0 +1,136 @@
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from heapq import merge
+from database import create_connection, attach_archives
+from dates import JULIAN_EPOCH, day_number
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# rows a worker process gets at least: a row takes a few microseconds to aggregate, smaller shares spend
+# more time starting processes and sending results back than aggregating, and run faster inline
+ROWS_PER_WORKER = 250_000
+
+# inclusive date range like summarize_transactions and filter_transactions_by_date_range
+# archived years are included through the all_transactions view
+PARTITION_QUERY = f'''SELECT category, strftime('%Y-%m', date + {JULIAN_EPOCH}), type, amount FROM all_transactions
+                      WHERE date BETWEEN ? AND ? AND type IN ('income', 'expense')'''
+
+
+# splits an inclusive YYYY-MM-DD range into about `count` partitions of whole months
+# month boundaries keep every (category, month) group inside a single partition
+def month_partitions(start_date, end_date, count):
+    first, last = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    months = []
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    size = max(1, -(-len(months) // max(1, count)))    # ceiling division
+    partitions = []
+    for index in range(0, len(months), size):
+        chunk = months[index:index + size]
+        chunk_start = max(first, date(*chunk[0], 1)).isoformat()
+        end_year, end_month = chunk[-1]
+        next_month = date(end_year + 1, 1, 1) if end_month == 12 else date(end_year, end_month + 1, 1)
+        chunk_end = min(last, date.fromordinal(next_month.toordinal() - 1)).isoformat()
+        partitions.append((chunk_start, chunk_end))
+    return partitions
+
+
+# nearest-rank percentile of an already sorted sequence
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(1, -(-round(fraction * 1000) * len(sorted_values) // 1000))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+# runs in a worker process: partial aggregates for one partition, read through its own read-only connection
+# returns {(category, month): [income cents, expense cents, count, sorted expense amounts]}
+def partial_report(db_file, start_date, end_date):
+    conn = create_connection(db_file, read_only=True)
+    try:
+        attach_archives(conn)
+        groups = {}
+        params = (day_number(start_date), day_number(end_date))
+        for category, month, transaction_type, amount in conn.execute(PARTITION_QUERY, params):
+            group = groups.get((category, month))
+            if group is None:
+                group = groups[(category, month)] = [0, 0, 0, array('q')]
+            if transaction_type == "income":
+                group[0] += amount
+            else:
+                group[1] += amount
+                group[3].append(amount)
+            group[2] += 1
+    finally:
+        conn.close()
+
+    for group in groups.values():
+        group[3] = array('q', sorted(group[3]))
+    return groups
+
+
+# rows in an inclusive date range, archived years included, counted from the daily_totals rollup
+def count_rows(db_file, start_date, end_date):
+    conn = create_connection(db_file, read_only=True)
+    try:
+        return conn.execute("SELECT COALESCE(SUM(count), 0) FROM daily_totals WHERE date BETWEEN ? AND ?",
+                            (day_number(start_date), day_number(end_date))).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def group_summary(income, expense, count, expenses):
+    summary = {"income": income, "expense": expense, "net": income - expense, "count": count}
+    for fraction in PERCENTILES:
+        summary[f"expense_p{round(fraction * 100)}"] = percentile(expenses, fraction)
+    return summary
+
+
+# per-category and per-month totals with expense percentiles over an inclusive date range
+# partitions are aggregated in parallel worker processes and merged exactly (all amounts are integer cents)
+# workers defaults to one per ROWS_PER_WORKER rows in the range, at most one per CPU; with a single worker
+# the whole range is aggregated in this process
+# returns {"months": {(category, "YYYY-MM"): summary}, "categories": {category: summary}, "totals": (income, expense, net)}
+def category_month_report(db_file, start_date, end_date, workers=None, partitions_per_worker=4):
+    if workers is None:
+        workers = min(os.cpu_count() or 1, -(-count_rows(db_file, start_date, end_date) // ROWS_PER_WORKER))
+    workers = max(1, workers)
+    partitions = month_partitions(start_date, end_date, workers * partitions_per_worker if workers > 1 else 1)
+    if not partitions:
+        return {"months": {}, "categories": {}, "totals": (0, 0, 0)}
+
+    workers = min(workers, len(partitions))    # a short range may have fewer months than workers
+    if workers == 1:
+        partials = [partial_report(db_file, start, end) for start, end in partitions]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partials = list(executor.map(partial_report, [db_file] * len(partitions),
+                                         *zip(*partitions)))
+
+    months = {}
+    by_category = {}    # category -> [income, expense, count, [sorted expense arrays]]
+    for partial in partials:
+        for (category, month), (income, expense, count, expenses) in partial.items():
+            months[(category, month)] = group_summary(income, expense, count, expenses)
+            totals = by_category.setdefault(category, [0, 0, 0, []])
+            totals[0] += income
+            totals[1] += expense
+            totals[2] += count
+            totals[3].append(expenses)
+
+    categories = {}
+    for category, (income, expense, count, expense_arrays) in sorted(by_category.items()):
+        categories[category] = group_summary(income, expense, count, array('q', merge(*expense_arrays)))
+
+    total_income = sum(summary["income"] for summary in categories.values())
+    total_expense = sum(summary["expense"] for summary in categories.values())
+    return {
+        "months": dict(sorted(months.items())),
+        "categories": categories,
+        "totals": (total_income, total_expense, total_income - total_expense),
+    }
@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+
+# the application modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.generator import create_ledger
+from database import create_connection, create_table
+
+
+# an empty database file at the current schema version
+@pytest.fixture
+def conn(tmp_path):
+    conn = create_connection(str(tmp_path / "budget.db"))
+    create_table(conn)
+    yield conn
+    conn.close()
+
+
+# a database file with a few thousand generated transactions and index statistics, like a real ledger
+@pytest.fixture(scope="session")
+def ledger_file(tmp_path_factory):
+    db_file = str(tmp_path_factory.mktemp("ledger") / "ledger.db")
+    create_ledger(db_file, 5000, categories=10)
+    return db_file
+
+
+@pytest.fixture
+def ledger(ledger_file):
+    conn = create_connection(ledger_file, read_only=True)
+    yield conn
+    conn.close()
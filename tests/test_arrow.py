@@ -0,0 +1,73 @@
+import pytest
+from database import create_connection, create_table
+from importers import import_transactions
+from transactions import add_transactions_bulk, export_to_arrow, get_transactions
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def rows(conn):
+    add_transactions_bulk(conn, [("expense" if i % 4 else "income", f"category{i % 9}", f"{i}.{i % 100:02d}",
+                                  f"{2020 + i % 4}-{i % 12 + 1:02d}-{i % 28 + 1:02d}", None if i % 5 == 0 else f"note {i}")
+                                 for i in range(250)])
+    return conn
+
+
+def imported(tmp_path, filename):
+    conn = create_connection(str(tmp_path / "imported.db"))
+    try:
+        create_table(conn)
+        assert import_transactions(conn, filename, batch_size=64)[1] == []
+        return get_transactions(conn)
+    finally:
+        conn.close()
+
+
+# small batches make later batches add new type and category values to the dictionaries
+@pytest.mark.parametrize("extension", ["parquet", "arrow"])
+def test_round_trip(rows, tmp_path, extension):
+    filename = str(tmp_path / f"export.{extension}")
+    assert export_to_arrow(rows, filename, batch_size=7) == 250
+    assert imported(tmp_path, filename) == get_transactions(rows)
+
+
+def test_export_filters(rows, tmp_path):
+    filename = str(tmp_path / "export.parquet")
+    export_to_arrow(rows, filename, transaction_type="income", start_date="2021-01-01", end_date="2021-12-31")
+    expected = [row for row in get_transactions(rows) if row[1] == "income" and row[4].startswith("2021")]
+    assert [row[1:] for row in imported(tmp_path, filename)] == [row[1:] for row in expected]
+
+
+def test_export_types(rows, tmp_path):
+    import pyarrow.parquet
+    filename = str(tmp_path / "export.parquet")
+    export_to_arrow(rows, filename)
+    table = pyarrow.parquet.read_table(filename)
+    assert table.schema.field("amount").type == pa.int64()
+    assert table.schema.field("date").type == pa.date32()
+    assert pa.types.is_dictionary(table.schema.field("category").type)
+
+
+# dollar amounts as floats and dates as text, e.g. a file from another tool
+def test_imports_floating_point_dollars(conn, tmp_path):
+    import pyarrow.parquet
+    filename = str(tmp_path / "other.parquet")
+    pyarrow.parquet.write_table(pa.table({
+        "Type": ["expense", "income", "expense"],
+        "Category": ["food", "salary", "food"],
+        "Amount": [12.345, 2500.0, float("nan")],
+        "Date": ["2024-01-05", "2024-01-31", "2024-02-01"],
+    }), filename)
+    inserted, rejected = import_transactions(conn, filename)
+    assert inserted == 2 and [number for number, _ in rejected] == [2]
+    assert get_transactions(conn) == [(1, "expense", "food", 1235, "2024-01-05", None),
+                                      (2, "income", "salary", 250000, "2024-01-31", None)]
+
+
+def test_missing_columns_are_refused(conn, tmp_path):
+    import pyarrow.parquet
+    filename = str(tmp_path / "other.parquet")
+    pyarrow.parquet.write_table(pa.table({"type": ["expense"], "amount": [1]}), filename)
+    with pytest.raises(ValueError, match="category, date"):
+        import_transactions(conn, filename)
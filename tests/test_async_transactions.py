@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import pytest
+from async_transactions import AsyncTransactions
+from query import TransactionQuery
+
+
+@pytest.fixture
+def db_file(conn, tmp_path):
+    return str(tmp_path / "budget.db")    # created at the current schema version by the conn fixture
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_writes_and_reads(db_file):
+    async def scenario():
+        async with AsyncTransactions(db_file, max_readers=2) as db:
+            first = await db.add_transaction(("expense", "food", 1250, "2024-01-05", "lunch"))
+            await db.add_transaction(("income", "salary", 250000, "2024-01-31", None))
+            await db.update_transaction(first, ("expense", "food", 1300, "2024-01-05", "lunch"))
+            return (await db.get_transaction(first), await db.filter_by_type("income"),
+                    await db.summarize("2024-01-01", "2024-01-31"))
+
+    transaction, income, summary = run(scenario())
+    assert transaction == (1, "expense", "food", 1300, "2024-01-05", "lunch")
+    assert income == [(2, "income", "salary", 250000, "2024-01-31", None)]
+    assert summary == (250000, 1300, 248700)
+
+
+# sync rows are read off the event loop, async ones batch by batch
+def test_bulk_insert_from_sync_and_async_iterables(db_file):
+    loop_threads = set()
+
+    def rows():
+        for i in range(25):
+            loop_threads.add(threading.current_thread())
+            yield ("expense", "food", f"{i}.00", "2024-02-01", None)
+
+    async def async_rows():
+        for i in range(5):
+            yield ("income", "gift", "abc" if i == 2 else f"{i}.00", "2024-02-02", None)
+
+    async def scenario():
+        async with AsyncTransactions(db_file) as db:
+            sync_result = await db.add_transactions_bulk(rows(), batch_size=10)
+            async_result = await db.add_transactions_bulk(async_rows(), batch_size=2)
+            return sync_result, async_result, threading.current_thread()
+
+    sync_result, async_result, loop_thread = run(scenario())
+    assert sync_result == (25, [])
+    assert async_result[0] == 4 and [number for number, _ in async_result[1]] == [2]
+    assert loop_thread not in loop_threads
+
+
+# a row repeated in a later batch of the same import is kept, like one add_transactions_bulk call keeps it
+def test_bulk_insert_skips_duplicates_across_batches(db_file):
+    row = ("expense", "food", "4.00", "2024-03-01", "coffee")
+
+    async def scenario():
+        async with AsyncTransactions(db_file) as db:
+            await db.add_transaction(("expense", "food", 400, "2024-03-01", "coffee"))
+            result = await db.add_transactions_bulk([row, ("expense", "food", "1.00", "2024-03-01", None), row],
+                                                    batch_size=1, duplicates="skip")
+            return result, await db.query(TransactionQuery())
+
+    (inserted, rejected), rows = run(scenario())
+    assert inserted == 2
+    assert rejected == [(0, "Duplicate of transaction 1, skipped.")]
+    assert len(rows) == 3
+
+
+def test_iterate_pages_through_a_query(db_file):
+    async def scenario():
+        async with AsyncTransactions(db_file) as db:
+            await db.add_transactions_bulk(("expense", "food", f"{i}.00", f"2024-04-{i % 28 + 1:02d}", None)
+                                           for i in range(50))
+            query = TransactionQuery().order_by("date").limit(45)
+            return [row async for row in db.iterate(query, batch_size=10)], await db.query(query)
+
+    paged, expected = run(scenario())
+    assert paged == expected and len(paged) == 45
+
+
+def test_timeout_interrupts_a_slow_call(db_file):
+    def slow(conn):
+        return conn.execute("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+                            "SELECT COUNT(*) FROM n").fetchone()
+
+    async def scenario():
+        async with AsyncTransactions(db_file) as db:
+            with pytest.raises(asyncio.TimeoutError):
+                await db.call(slow, timeout=0.2)
+            return await db.filter_by_type("expense")
+
+    assert run(scenario()) == []
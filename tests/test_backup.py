@@ -0,0 +1,127 @@
+import gzip
+import json
+import os
+import pytest
+from backup import list_snapshots, restore_database, snapshot_database
+from database import archive_year, create_connection, create_table
+from query import TransactionQuery
+from transactions import add_transactions_bulk, delete_transactions, get_transactions, update_transactions
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / "budget.db")
+    conn = create_connection(db_file)
+    create_table(conn)
+    add_transactions_bulk(conn, [("expense", f"category{i % 7}", f"{i}.25", f"2024-01-{i % 28 + 1:02d}", f"note {i}")
+                                 for i in range(2000)])
+    conn.close()
+    return db_file
+
+
+def read_transactions(db_file):
+    conn = create_connection(db_file)
+    try:
+        return get_transactions(conn)
+    finally:
+        conn.close()
+
+
+# changes the database and takes a snapshot of it, returns the rows the snapshot holds
+def change_and_snapshot(db_file, backup_dir, change):
+    conn = create_connection(db_file)
+    try:
+        change(conn)
+        snapshot_database(conn, backup_dir)
+        return get_transactions(conn)
+    finally:
+        conn.close()
+
+
+def test_restores_every_snapshot_of_a_chain(db_file, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    states = [
+        change_and_snapshot(db_file, backup_dir, lambda conn: None),
+        change_and_snapshot(db_file, backup_dir, lambda conn: update_transactions(conn, {"notes": "edited"}, ids=range(1, 50))),
+        change_and_snapshot(db_file, backup_dir, lambda conn: delete_transactions(conn, ids=range(100, 110))),
+    ]
+    snapshots = list_snapshots(backup_dir)
+    assert [entry["full"] for entry in snapshots] == [True, False, False]
+    assert snapshots[1]["stored_pages"] < snapshots[1]["page_count"]
+
+    for entry, rows in zip(snapshots, states):
+        restore_database(db_file, backup_dir, snapshot=entry["file"])
+        assert read_transactions(db_file) == rows
+
+    restore_database(db_file, backup_dir, thorough=True)    # the newest one by default
+    assert read_transactions(db_file) == states[-1]
+
+
+def test_damaged_snapshot_leaves_the_database_alone(db_file, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    rows = change_and_snapshot(db_file, backup_dir, lambda conn: None)
+    change_and_snapshot(db_file, backup_dir, lambda conn: delete_transactions(conn, ids=[1]))
+
+    path = os.path.join(backup_dir, list_snapshots(backup_dir)[-1]["file"])
+    with gzip.open(path, "rb") as file:
+        content = bytearray(file.read())
+    content[-100] ^= 0xFF
+    with gzip.open(path, "wb") as file:
+        file.write(bytes(content))
+
+    with pytest.raises(ValueError, match="checksum"):
+        restore_database(db_file, backup_dir)
+    assert read_transactions(db_file) == rows[1:]
+
+
+def test_restore_refuses_a_database_in_use(db_file, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    change_and_snapshot(db_file, backup_dir, lambda conn: None)
+
+    conn = create_connection(db_file)    # the write-ahead log stays while a connection is open
+    try:
+        with pytest.raises(RuntimeError):
+            restore_database(db_file, backup_dir)
+        assert len(get_transactions(conn)) == 2000
+    finally:
+        conn.close()
+
+
+def test_restores_archive_databases(tmp_path):
+    db_file = str(tmp_path / "budget.db")
+    conn = create_connection(db_file)
+    create_table(conn)
+    add_transactions_bulk(conn, [("expense", "food", f"{i}.50", f"{2019 + i % 3}-03-{i % 28 + 1:02d}", None)
+                                 for i in range(300)])
+    archive_year(conn, 2019)
+    expected = TransactionQuery().including_archives().fetch_all(conn)
+    backup_dir = str(tmp_path / "backups")
+    snapshot_database(conn, backup_dir)
+    snapshot_database(conn, backup_dir)
+    conn.close()
+    assert len([name for name in os.listdir(backup_dir) if name.startswith("archive-")]) == 1
+
+    os.remove(str(tmp_path / "budget.2019.db"))
+    restore_database(db_file, backup_dir)
+
+    conn = create_connection(db_file)
+    try:
+        assert TransactionQuery().including_archives().fetch_all(conn) == expected
+        assert len(expected) == 300
+    finally:
+        conn.close()
+
+
+def test_restore_refuses_a_missing_archive_the_snapshot_lacks(db_file, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    change_and_snapshot(db_file, backup_dir, lambda conn: archive_year(conn, 2024))
+    with open(os.path.join(backup_dir, "manifest.json")) as file:
+        manifest = json.load(file)
+    del manifest["snapshots"][-1]["archives"]    # as written before archives were stored
+    with open(os.path.join(backup_dir, "manifest.json"), "w") as file:
+        json.dump(manifest, file)
+    os.remove(str(tmp_path / "budget.2024.db"))
+
+    with pytest.raises(ValueError, match="budget.2024.db"):
+        restore_database(db_file, backup_dir)
+    assert not os.path.exists(str(tmp_path / "budget.2024.db.restore"))
@@ -0,0 +1,54 @@
+import pytest
+from charts import balance_series, bucket_days, category_spending, chart_data, lttb
+from dates import day_number
+from transactions import add_transactions_bulk
+
+
+def test_lttb_keeps_short_series_whole():
+    assert lttb([1, 2, 3], [5, 6, 7], 10) == ([1, 2, 3], [5, 6, 7])
+    assert lttb([1, 2, 3, 4], [5, 6, 7, 8], 2) == ([1, 2, 3, 4], [5, 6, 7, 8])
+
+
+def test_lttb_keeps_the_ends_and_the_spikes():
+    xs = list(range(1000))
+    ys = [0] * 1000
+    ys[250], ys[700] = 500, -400
+    sampled_x, sampled_y = lttb(xs, ys, 20)
+    assert len(sampled_x) == len(sampled_y) == 20
+    assert sampled_x[0] == 0 and sampled_x[-1] == 999
+    assert sampled_x == sorted(sampled_x)
+    assert 500 in sampled_y and -400 in sampled_y
+
+
+@pytest.mark.parametrize("first, last, buckets, expected", [(0, 9, 10, 1), (0, 10, 10, 2), (5, 5, 60, 1), (0, 599, 0, 600)])
+def test_bucket_days_fits_the_range(first, last, buckets, expected):
+    assert bucket_days(first, last, buckets) == expected
+
+
+@pytest.fixture
+def history(conn):
+    add_transactions_bulk(conn, [("income", "salary", "1000.00", f"2023-{month:02d}-01", None) for month in range(1, 13)]
+                          + [("expense", f"category{i % 12}", f"{i % 12 + 1}.00", f"2023-{i % 12 + 1:02d}-{i % 28 + 1:02d}", None)
+                             for i in range(1200)])
+    return conn
+
+
+def test_balance_series_ends_at_the_balance(history):
+    first, last = day_number("2023-01-01"), day_number("2023-12-31")
+    days, balances = balance_series(history, first, last, points=50)
+    assert len(days) == 50
+    expenses = sum(i % 12 + 1 for i in range(1200)) * 100
+    assert balances[-1] == 12 * 100000 - expenses
+    assert days[-1] == day_number("2023-12-28")
+
+
+def test_category_spending_adds_up_the_rest_as_other(history):
+    first, last = day_number("2023-01-01"), day_number("2023-12-31")
+    starts, width, spending = category_spending(history, first, last, buckets=12, top=3)
+    assert width == 31 and starts[0] == first and len(starts) == 12
+    assert list(spending) == ["category11", "category10", "category9", "Other"]
+    assert sum(map(sum, spending.values())) == sum(i % 12 + 1 for i in range(1200)) * 100
+
+
+def test_chart_data_of_an_empty_ledger(conn):
+    assert chart_data(conn) is None
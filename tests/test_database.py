@@ -0,0 +1,124 @@
+import sqlite3
+import pytest
+from database import (SCHEMA_VERSION, create_connection, create_table, explain_query_plan, get_schema_version,
+                      migrate)
+from query import TransactionQuery
+from transactions import get_transactions
+
+
+# the schema the first release created, before there were migrations: REAL dollars and TEXT dates
+def create_legacy_database(db_file, rows):
+    conn = sqlite3.connect(db_file)
+    conn.execute('''CREATE TABLE transactions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        type TEXT NOT NULL,
+                        category TEXT NOT NULL,
+                        amount REAL NOT NULL,
+                        date TEXT NOT NULL,
+                        notes TEXT
+                    );''')
+    conn.executemany("INSERT INTO transactions(type, category, amount, date, notes) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_migrates_legacy_database(tmp_path):
+    db_file = str(tmp_path / "legacy.db")
+    create_legacy_database(db_file, [
+        ("income", "salary", 2500.1, "2024-01-31", "january"),
+        ("expense", "food", 12.345, "2024-2-3", None),
+        ("expense", "rent", 900.0, "2024-02-03 10:30:00", "with a time"),
+        ("expense", "food", 5.0, "2024-02-30", "impossible day"),
+        ("expense", "food", 7.0, "garbage", None),
+    ])
+    conn = create_connection(db_file)
+
+    notices = create_table(conn)
+
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert get_transactions(conn) == [
+        (1, "income", "salary", 250010, "2024-01-31", "january"),
+        (2, "expense", "food", 1235, "2024-02-03", None),
+        (3, "expense", "rent", 90000, "2024-02-03", "with a time"),
+    ]
+    assert len(notices) == 1 and "2 transaction(s)" in notices[0]
+    quarantined = conn.execute("SELECT date FROM transactions_invalid_dates ORDER BY id").fetchall()
+    assert quarantined == [("2024-02-30",), ("garbage",)]
+    assert conn.execute("SELECT date, category, total, count FROM daily_totals ORDER BY date, category").fetchall() == [
+        (19753, "salary", 250010, 1),
+        (19756, "food", 1235, 1),
+        (19756, "rent", 90000, 1),
+    ]
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    conn.close()
+
+
+def test_migration_is_a_no_op_at_the_current_version(conn):
+    assert migrate(conn) == []
+    assert get_schema_version(conn) == SCHEMA_VERSION
+
+
+def test_refuses_a_newer_schema(conn):
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    with pytest.raises(RuntimeError):
+        migrate(conn)
+
+
+def test_failed_migration_leaves_the_version_alone(tmp_path, monkeypatch):
+    import database
+    conn = create_connection(str(tmp_path / "budget.db"))
+    monkeypatch.setattr(database, "MIGRATIONS", database.MIGRATIONS[:1] + ["CREATE TABLE broken (;"])
+    monkeypatch.setattr(database, "SCHEMA_VERSION", 2)
+    with pytest.raises(sqlite3.Error):
+        migrate(conn)
+    assert get_schema_version(conn) == 1
+    assert not conn.in_transaction
+    conn.close()
+
+
+def plan(conn, query):
+    return explain_query_plan(conn, *query.compile(conn))
+
+
+def test_date_range_is_an_index_range_scan(ledger):
+    details = plan(ledger, TransactionQuery().between("2016-01-01", "2016-03-31").order_by("date"))
+    assert details == ["SEARCH t USING INDEX idx_transactions_date (date>? AND date<?)"]
+
+
+def test_type_and_date_range_use_the_type_date_index(ledger):
+    details = plan(ledger, TransactionQuery().where_type("income").between("2016-01-01", "2016-03-31").order_by("date"))
+    assert details == ["SEARCH t USING INDEX idx_transactions_type_date (type=? AND date>? AND date<?)"]
+
+
+FILTERS = {
+    "none": lambda query: query,
+    "type": lambda query: query.where_type("expense"),
+    "category": lambda query: query.in_categories(["category003"]),
+}
+
+
+# every page of the transaction table, first or later, comes from an index in the requested order
+@pytest.mark.parametrize("filter_name", FILTERS)
+@pytest.mark.parametrize("sort_column", ["id", "date", "amount", "type", "category", "notes"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_keyset_pages_are_not_sorted(ledger, filter_name, sort_column, descending):
+    if (filter_name, sort_column) == ("category", "type"):
+        pytest.skip("a type sort inside one category sorts that category's matches")
+    query = FILTERS[filter_name](TransactionQuery()).order_by(sort_column, descending).limit(50)
+    first_page = query.fetch_all(ledger)
+
+    for page in (query, query.after(query.sort_key(first_page[-1]))):
+        details = plan(ledger, page)
+        assert not any("TEMP B-TREE" in detail for detail in details), details
+        assert any("INDEX" in detail for detail in details) or sort_column == "id", details
+
+
+def test_keyset_pages_add_up_to_the_sorted_table(ledger):
+    query = TransactionQuery().in_categories(["category001", "category002"]).order_by("notes", True)
+    expected = query.fetch_all(ledger)
+    pages, page = [], query.limit(700).fetch_all(ledger)
+    while page:
+        pages.extend(page)
+        page = query.limit(700).after(query.sort_key(page[-1])).fetch_all(ledger)
+    assert pages == expected
+    assert expected == sorted(expected, key=lambda row: (row[5] or "", row[0]), reverse=True)
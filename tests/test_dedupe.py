@@ -0,0 +1,60 @@
+import dedupe
+from dedupe import duplicate_groups, normalize_notes, transaction_hash
+from transactions import (add_transaction, add_transactions_bulk, delete_duplicate_transactions, get_transactions,
+                          update_transactions)
+
+STATEMENT = [
+    ("expense", "food", "4.00", "2024-03-01", "Coffee  SHOP"),
+    ("expense", "food", "4.00", "2024-03-01", "coffee shop"),    # a second identical purchase
+    ("income", "salary", "2500.00", "2024-03-31", None),
+]
+
+
+def test_notes_ignore_case_and_spacing():
+    assert normalize_notes("  Coffee\tSHOP ") == "coffee shop" and normalize_notes(None) == ""
+    assert transaction_hash("expense", "food", 400, 19783, "Coffee  SHOP") == \
+        transaction_hash("expense", "food", 400, 19783, "coffee shop")
+    assert transaction_hash("expense", "food", 400, 19783, None) != transaction_hash("expense", "food", 401, 19783, None)
+
+
+def test_stored_hash_follows_updates(conn):
+    add_transaction(conn, ("expense", "food", 400, "2024-03-01", "coffee"))
+    update_transactions(conn, {"notes": "Tea", "amount": 350}, ids=[1])
+    stored = conn.execute("SELECT content_hash FROM transactions").fetchone()[0]
+    assert stored == transaction_hash("expense", "food", 350, 19783, "tea")
+
+
+def test_skip_keeps_repeats_beyond_the_stored_ones(conn):
+    add_transactions_bulk(conn, STATEMENT[:1])
+    inserted, rejected = add_transactions_bulk(conn, STATEMENT, duplicates="skip")
+    assert inserted == 2
+    assert rejected == [(0, "Duplicate of transaction 1, skipped.")]
+    assert add_transactions_bulk(conn, STATEMENT, duplicates="skip") == (0, [
+        (0, "Duplicate of transaction 1, skipped."),
+        (1, "Duplicate of transaction 2, skipped."),
+        (2, "Duplicate of transaction 3, skipped."),
+    ])
+
+
+def test_merge_takes_the_imported_notes(conn):
+    add_transactions_bulk(conn, [("expense", "food", "4.00", "2024-03-01", "coffee shop")])
+    inserted, rejected = add_transactions_bulk(conn, [("expense", "food", "4.00", "2024-03-01", "COFFEE SHOP")],
+                                               duplicates="merge")
+    assert inserted == 0 and rejected == [(0, "Duplicate of transaction 1, merged.")]
+    assert get_transactions(conn) == [(1, "expense", "food", 400, "2024-03-01", "COFFEE SHOP")]
+
+
+def test_delete_duplicates_keeps_the_oldest(conn):
+    add_transactions_bulk(conn, STATEMENT * 3)
+    assert sorted(duplicate_groups(conn)) == [[1, 2, 4, 5, 7, 8], [3, 6, 9]]
+    assert delete_duplicate_transactions(conn) == 7
+    assert [row[0] for row in get_transactions(conn)] == [1, 3]
+    assert delete_duplicate_transactions(conn) == 0
+
+
+# rows with the same hash but different content are not duplicates
+def test_hash_collisions_are_compared_in_full(conn, monkeypatch):
+    add_transactions_bulk(conn, STATEMENT)
+    conn.execute("UPDATE transactions SET content_hash = 0")
+    monkeypatch.setattr(dedupe, "COMPARE_BATCH_SIZE", 2)
+    assert list(duplicate_groups(conn)) == [[1, 2]]
@@ -0,0 +1,97 @@
+import pytest
+from database import create_connection, create_table
+from importers import import_transactions, read_csv_transactions, read_ofx_transactions
+from transactions import add_transactions_bulk, export_to_csv, get_transactions
+
+OFX = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20240105120000[-5:EST]
+<TRNAMT>-12.50
+<NAME>Corner shop
+<MEMO>groceries
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20240131
+<TRNAMT>2500.00
+<NAME>Payroll
+<STMTTRN>
+<DTPOSTED>20240201
+<TRNAMT>-3.00
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def test_reads_csv_columns_by_name(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text("ID, amount ,Type,Category,Date,Notes\n7,12.50, Expense ,food ,2024-01-05,lunch\n8,3,income,gift,2024-01-06,\n")
+    assert list(read_csv_transactions(str(path))) == [
+        ("expense", "food", "12.50", "2024-01-05", "lunch"),
+        ("income", "gift", "3", "2024-01-06", None),
+    ]
+
+
+def test_csv_without_required_columns_is_refused(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text("Type,Category,Notes\nexpense,food,lunch\n")
+    with pytest.raises(ValueError, match="amount, date"):
+        list(read_csv_transactions(str(path)))
+
+
+# the second entry has no closing tag, the next one ends it
+def test_reads_ofx_entries(tmp_path):
+    path = tmp_path / "statement.ofx"
+    path.write_text(OFX)
+    assert list(read_ofx_transactions(str(path), "bank")) == [
+        ("expense", "bank", "12.50", "2024-01-05", "groceries"),
+        ("income", "bank", "2500.00", "2024-01-31", "Payroll"),
+        ("expense", "bank", "3.00", "2024-02-01", None),
+    ]
+
+
+def test_import_reports_rejected_rows(conn, tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text("Type,Category,Amount,Date\nexpense,food,12.50,2024-01-05\nexpense,food,abc,2024-01-06\n"
+                    "expense,,1,2024-01-07\nincome,salary,100,2024-02-30\n")
+    inserted, rejected = import_transactions(conn, str(path), batch_size=2)
+    assert inserted == 1
+    assert [number for number, _ in rejected] == [1, 2, 3]
+    assert get_transactions(conn) == [(1, "expense", "food", 1250, "2024-01-05", None)]
+
+
+def test_importing_a_statement_again_skips_stored_rows(conn, tmp_path):
+    path = tmp_path / "statement.qfx"
+    path.write_text(OFX)
+    assert import_transactions(conn, str(path))[0] == 3
+    inserted, rejected = import_transactions(conn, str(path), duplicates="skip")
+    assert inserted == 0 and len(rejected) == 3
+    assert len(get_transactions(conn)) == 3
+
+
+def test_bulk_insert_reads_any_iterable_in_batches(conn):
+    batches = []
+    rows = (("expense", "food", f"{i}.00", "2024-03-01", None) for i in range(25))
+    assert add_transactions_bulk(conn, rows, batch_size=10, progress=lambda *args: batches.append(args[:2])) == (25, [])
+    assert batches == [(1, 10), (2, 10), (3, 5)]
+
+
+@pytest.mark.parametrize("name", ["export.csv", "export.csv.gz"])
+def test_csv_export_round_trip(conn, tmp_path, name):
+    add_transactions_bulk(conn, [("expense", "food", "12.50", "2024-01-05", "lunch, with \"friends\""),
+                                 ("income", "salary", "2500.00", "2024-01-31", None)])
+    path = str(tmp_path / name)
+    assert export_to_csv(conn, path) == 2
+    imported = create_connection(str(tmp_path / "imported.db"))
+    try:
+        create_table(imported)
+        assert import_transactions(imported, path) == (2, [])
+        assert get_transactions(imported) == get_transactions(conn)
+    finally:
+        imported.close()
+
+
+def test_unsupported_file_type_is_refused(conn, tmp_path):
+    with pytest.raises(ValueError, match=".xlsx"):
+        import_transactions(conn, str(tmp_path / "export.xlsx"))
@@ -0,0 +1,76 @@
+import pytest
+from database import ConnectionManager, create_connection
+from profiling import Histogram, normalize_sql, profiled, profiler
+
+
+@pytest.fixture(autouse=True)
+def recorded():
+    profiler.reset()
+    yield
+    profiler.reset()
+
+
+@profiled()
+def notes_containing(conn, text):
+    return conn.execute("SELECT id FROM transactions WHERE notes LIKE ?", ('%' + text + '%',)).fetchall()
+
+
+@profiled()
+def transaction_by_id(conn, transaction_id):
+    return conn.execute(f"SELECT id FROM transactions WHERE id = {transaction_id}").fetchall()
+
+
+def test_normalize_sql_groups_statements_by_shape():
+    assert normalize_sql("SELECT * FROM t WHERE a = 'it''s'  AND b = 12.5\n AND c2 = 3") == \
+        "SELECT * FROM t WHERE a = ? AND b = ? AND c2 = ?"
+
+
+def test_histogram_reports_bucket_bounds():
+    histogram = Histogram()
+    for ms in [0.05] * 90 + [3] * 9 + [20000]:
+        histogram.add(ms)
+    stats = histogram.as_dict()
+    assert (stats["count"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["max_ms"]) == (100, 0.1, 5, 5, 20000)
+    assert stats["buckets"] == {"<=0.1": 90, "<=5": 9, ">10000": 1}
+
+
+def test_statements_are_not_captured_by_default(conn):
+    notes_containing(conn, "rent")
+    operation = profiler.snapshot()["operations"]["notes_containing"]
+    assert operation["count"] == 1 and operation["statements"] == []
+
+
+def test_flags_full_table_scans(tmp_path, conn):
+    profiled_conn = create_connection(str(tmp_path / "budget.db"), {"profile": True})
+    try:
+        notes_containing(profiled_conn, "rent")
+        transaction_by_id(profiled_conn, 1)
+        transaction_by_id(profiled_conn, 2)
+    finally:
+        profiled_conn.close()
+
+    snapshot = profiler.snapshot()
+    assert snapshot["operations"]["transaction_by_id"]["count"] == 2
+    assert [(statement["sql"], statement["calls"]) for statement in profiler.full_scan_statements()] == [
+        ("SELECT id FROM transactions WHERE notes LIKE ?", 1)]
+    by_id = next(statement for statement in snapshot["statements"] if "id = ?" in statement["sql"])
+    assert by_id["calls"] == 2 and not by_id["full_scan"]
+
+
+def test_diagnostics_turn_capture_on_for_open_connections(conn, tmp_path):
+    manager = ConnectionManager(str(tmp_path / "budget.db"))
+    try:
+        with manager.read() as reader:
+            notes_containing(reader, "rent")
+        manager.set_profiling(True)
+        with manager.read() as reader:
+            notes_containing(reader, "rent")
+        with manager.write() as writer:
+            transaction_by_id(writer, 1)
+        manager.set_profiling(False)
+        with manager.write() as writer:
+            transaction_by_id(writer, 2)
+    finally:
+        manager.close()
+
+    assert [statement["calls"] for statement in profiler.snapshot()["statements"]] == [1, 1]
@@ -0,0 +1,74 @@
+import pytest
+from query import TransactionQuery, build_fts_query
+from transactions import add_transactions_bulk
+
+
+@pytest.fixture
+def rows(conn):
+    add_transactions_bulk(conn, [
+        ("expense", "groceries", "42.10", "2024-03-02", "weekly shop at the market"),
+        ("expense", "travel", "18.00", "2024-03-05", "uber to the airport"),
+        ("income", "salary", "2500.00", "2024-03-31", None),
+        ("expense", "travel", "230.00", "2024-04-12", "train tickets"),
+        ("expense", "groceries", "7.35", "2024-04-13", "grocery top-up"),
+    ])
+    return conn
+
+
+def ids(query, conn):
+    return [row[0] for row in query.fetch_all(conn)]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("uber", '"uber"'),
+    ("groc* market", '"groc"* "market"'),
+    ('"weekly shop" AND', '"weekly shop" "AND"'),
+    ("NEAR( -- '", '"NEAR"'),
+])
+def test_build_fts_query_quotes_every_term(text, expected):
+    assert build_fts_query(text) == expected
+
+
+def test_filters_combine(rows):
+    base = TransactionQuery().where_type("expense")
+    assert ids(base, rows) == [1, 2, 4, 5]
+    assert ids(base.in_categories(["travel"]), rows) == [2, 4]
+    assert ids(base.between("2024-03-01", "2024-03-31"), rows) == [1, 2]
+    assert ids(base.amount_between(1000, 23000), rows) == [1, 2, 4]
+    assert ids(base.between("2024-04-01", None).in_categories(["travel", "groceries"]), rows) == [4, 5]
+
+
+# every method returns a new query, the base query is unchanged
+def test_queries_are_immutable(rows):
+    base = TransactionQuery().where_type("expense")
+    base.in_categories(["travel"]).order_by("amount", descending=True).limit(1)
+    assert ids(base, rows) == [1, 2, 4, 5]
+
+
+def test_text_search_on_one_column(rows):
+    assert ids(TransactionQuery().matching("groc*"), rows) == [1, 5]
+    assert ids(TransactionQuery().matching("groc*", column="notes"), rows) == [5]
+    assert ids(TransactionQuery().matching('"to the"').order_by("date"), rows) == [2]
+
+
+def test_order_limit_and_keyset(rows):
+    query = TransactionQuery().order_by("amount", descending=True).limit(2)
+    first = query.fetch_all(rows)
+    assert [row[0] for row in first] == [3, 4]
+    assert ids(query.after(query.sort_key(first[-1])), rows) == [1, 2]
+    assert TransactionQuery().where_type("expense").count(rows) == 4
+
+
+def test_matches_agrees_with_the_database(rows):
+    query = TransactionQuery().where_type("expense").between("2024-03-01", "2024-04-12").matching("the")
+    assert [row for row in TransactionQuery().fetch_all(rows) if query.matches(row)] == query.fetch_all(rows)
+
+
+def test_unknown_sort_column_is_refused():
+    with pytest.raises(ValueError):
+        TransactionQuery().order_by("amount; DROP TABLE transactions")
+
+
+def test_relevance_order_has_no_keyset(rows):
+    with pytest.raises(ValueError):
+        TransactionQuery().matching("travel").order_by("relevance").after((0, 1)).compile(rows)
@@ -0,0 +1,17 @@
+from reports import category_month_report
+from transactions import summarize_transactions
+
+
+def test_parallel_report_matches_the_inline_one(ledger_file, ledger):
+    inline = category_month_report(ledger_file, "2016-03-15", "2018-07-20")
+    parallel = category_month_report(ledger_file, "2016-03-15", "2018-07-20", workers=2)
+
+    assert parallel == inline
+    assert inline["totals"] == summarize_transactions(ledger, "2016-03-15", "2018-07-20")
+    assert sum(summary["count"] for summary in inline["categories"].values()) == sum(
+        summary["count"] for summary in inline["months"].values())
+
+
+def test_empty_range(ledger_file):
+    assert category_month_report(ledger_file, "2030-01-01", "2030-12-31")["totals"] == (0, 0, 0)
+    assert category_month_report(ledger_file, "2018-01-01", "2017-01-01")["months"] == {}
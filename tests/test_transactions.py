@@ -0,0 +1,209 @@
+import sqlite3
+import pytest
+from database import create_connection, create_table
+from query import TransactionQuery
+import transactions
+from transactions import (add_change_listener, add_transaction, add_transactions_bulk, archive_transactions,
+                          delete_transactions, filter_transactions_by_date_range, filter_transactions_by_type,
+                          get_transaction_by_id, query_cache, remove_change_listener, search_transactions_fulltext,
+                          summarize_transactions, to_cents, update_transaction, update_transactions, validate_transaction)
+
+
+@pytest.mark.parametrize("amount", ["1e30", "1e20", "nan", "inf", "abc", ""])
+def test_to_cents_rejects_unusable_amounts(amount):
+    with pytest.raises(ValueError):
+        to_cents(amount)
+
+
+def test_to_cents_rounds_half_up():
+    assert to_cents("12.345") == 1235
+    assert to_cents("-0.005") == -1
+
+
+def test_validate_transaction_converts_dollars():
+    assert validate_transaction(("expense", "food", "12.50", "2024-01-01", None)) == (
+        "expense", "food", 1250, "2024-01-01", None)
+
+
+# single-row writes take integer cents, anything else would be stored as REAL or TEXT and break the sums
+@pytest.mark.parametrize("amount", [12.5, "1250", "abc", None, True, 2 ** 63])
+def test_single_row_writes_reject_amounts_not_in_cents(conn, amount):
+    transaction_id = add_transaction(conn, ("expense", "food", 1250, "2024-01-01", None))
+    with pytest.raises(ValueError):
+        add_transaction(conn, ("expense", "food", amount, "2024-01-01", None))
+    with pytest.raises(ValueError):
+        update_transaction(conn, transaction_id, ("expense", "food", amount, "2024-01-01", None))
+
+    assert get_transaction_by_id(conn, transaction_id) == (transaction_id, "expense", "food", 1250, "2024-01-01", None)
+    assert summarize_transactions(conn, "2024-01-01", "2024-01-31") == (0, 1250, -1250)
+
+
+def test_single_row_writes_reject_bad_dates(conn):
+    with pytest.raises(ValueError):
+        add_transaction(conn, ("expense", "food", 1250, "2024-02-30", None))
+
+
+def test_archiving_keeps_rows_in_filters(conn):
+    add_transaction(conn, ("expense", "food", 1000, "2019-05-01", None))
+    add_transaction(conn, ("expense", "food", 2000, "2024-05-01", None))
+    assert len(filter_transactions_by_type(conn, "expense")) == 2
+
+    assert archive_transactions(conn, 2019) == 1
+    assert conn.execute("SELECT COUNT(*) FROM main.transactions").fetchone()[0] == 1
+    assert filter_transactions_by_type(conn, "expense") == [
+        (1, "expense", "food", 1000, "2019-05-01", None),
+        (2, "expense", "food", 2000, "2024-05-01", None),
+    ]
+    assert [row[0] for row in filter_transactions_by_date_range(conn, "2019-01-01", "2019-12-31")] == [1]
+
+
+def cached(fn, *args, **kwargs):
+    hits = query_cache.stats()["hits"]
+    result = fn(*args, **kwargs)
+    return query_cache.stats()["hits"] > hits, result
+
+
+def test_writes_evict_only_results_of_their_type(conn):
+    add_transaction(conn, ("expense", "food", 1000, "2024-01-10", None))
+    assert cached(filter_transactions_by_type, conn, "expense") == (False, [(1, "expense", "food", 1000, "2024-01-10", None)])
+    assert cached(filter_transactions_by_type, conn, "expense")[0]
+
+    add_transaction(conn, ("income", "salary", 500000, "2024-01-31", None))
+    assert cached(filter_transactions_by_type, conn, "expense")[0]
+
+    add_transaction(conn, ("expense", "rent", 90000, "2024-02-01", None))
+    hit, rows = cached(filter_transactions_by_type, conn, "expense")
+    assert not hit and [row[0] for row in rows] == [1, 3]
+
+
+def test_moving_a_row_evicts_its_old_date(conn):
+    add_transaction(conn, ("expense", "food", 1000, "2024-01-10", None))
+    assert summarize_transactions(conn, "2024-01-01", "2024-01-31") == (0, 1000, -1000)
+    update_transaction(conn, 1, ("expense", "food", 1000, "2024-03-11", None))
+    assert cached(summarize_transactions, conn, "2024-01-01", "2024-01-31") == (False, (0, 0, 0))
+
+
+def test_writes_from_other_connections_are_noticed(conn, tmp_path):
+    add_transaction(conn, ("expense", "food", 1000, "2024-01-10", None))
+    assert summarize_transactions(conn, "2024-01-01", "2024-01-31") == (0, 1000, -1000)
+
+    other = sqlite3.connect(str(tmp_path / "budget.db"))
+    with other:
+        other.execute("UPDATE transactions SET amount = 2500")
+    other.close()
+    assert cached(summarize_transactions, conn, "2024-01-01", "2024-01-31") == (False, (0, 2500, -2500))
+    assert cached(summarize_transactions, conn, "2024-01-01", "2024-01-31")[0]
+
+
+def test_keyword_and_positional_calls_share_an_entry(conn):
+    add_transaction(conn, ("expense", "food", 1000, "2024-01-10", None))
+    assert not cached(filter_transactions_by_date_range, conn, "2024-01-01", "2024-01-31")[0]
+    assert cached(filter_transactions_by_date_range, conn, end_date="2024-01-31", start_date="2024-01-01")[0]
+    assert cached(filter_transactions_by_type, conn, transaction_type="expense")[0] is False
+    assert cached(filter_transactions_by_type, conn, "expense")[0]
+
+
+@pytest.fixture
+def changes():
+    received = []
+    add_change_listener(received.append)
+    yield received
+    remove_change_listener(received.append)
+
+
+def test_batch_writes_publish_each_row(conn, changes):
+    add_transactions_bulk(conn, [("expense", "food", "10.00", "2024-01-10", None),
+                                 ("expense", "food", "20.00", "2024-01-11", "lunch")])
+    assert [change.kind for change in changes] == ["reset"]
+    changes.clear()
+
+    assert update_transactions(conn, {"category": "groceries"}, ids=[1, 2]) == 2
+    assert [(change.kind, change.previous, change.row) for change in changes] == [
+        ("update", (1, "expense", "food", 1000, "2024-01-10", None), (1, "expense", "groceries", 1000, "2024-01-10", None)),
+        ("update", (2, "expense", "food", 2000, "2024-01-11", "lunch"), (2, "expense", "groceries", 2000, "2024-01-11", "lunch")),
+    ]
+    changes.clear()
+
+    assert delete_transactions(conn, ids=[2]) == 1
+    assert [(change.kind, change.previous, change.row) for change in changes] == [
+        ("delete", (2, "expense", "groceries", 2000, "2024-01-11", "lunch"), None)]
+
+
+def test_large_batch_writes_publish_a_reset(conn, changes, monkeypatch):
+    monkeypatch.setattr(transactions, "ROW_CHANGES_LIMIT", 2)
+    add_transactions_bulk(conn, [("expense", "food", "10.00", f"2024-01-{day:02d}", None) for day in range(1, 6)])
+    changes.clear()
+    assert update_transactions(conn, {"type": "income"}, ids=[1, 2, 3]) == 3
+    assert update_transactions(conn, {"amount": 500}, ids=[4, 5]) == 2
+    assert [change.kind for change in changes] == ["reset", "update", "update"]
+
+
+# the previous rows are read under the write lock, so another writer can't slip in between the read and the update
+def test_batch_update_reads_under_the_write_lock(conn):
+    add_transaction(conn, ("expense", "food", 1000, "2024-01-10", None))
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        update_transactions(conn, {"category": "groceries"}, ids=[1])
+    finally:
+        conn.set_trace_callback(None)
+    begin = statements.index("BEGIN IMMEDIATE")
+    assert begin < next(i for i, sql in enumerate(statements) if sql.lstrip().startswith("SELECT"))
+    assert not conn.in_transaction
+
+
+# the same rows in two databases, one with 2018 and 2019 archived
+@pytest.fixture
+def archived(tmp_path):
+    rows = [("expense" if i % 3 else "income", f"category{i % 5}", i * 7 % 1000 + 1,
+             f"{2018 + i % 5}-{i % 12 + 1:02d}-{i % 28 + 1:02d}", f"n{i % 40}" if i % 4 else None) for i in range(600)]
+    conns = []
+    for name in ("plain.db", "archived.db"):
+        conn = create_connection(str(tmp_path / name))
+        create_table(conn)
+        add_transactions_bulk(conn, rows)
+        conns.append(conn)
+    archive_transactions(conns[1], 2018)
+    archive_transactions(conns[1], 2019)
+    yield conns
+    for conn in conns:
+        conn.close()
+
+
+QUERIES = {
+    "all": TransactionQuery(),
+    "type": TransactionQuery().where_type("income"),
+    "dates": TransactionQuery().between("2019-06-01", "2020-05-31"),
+    "text": TransactionQuery().matching("n1*"),
+    "phrase": TransactionQuery().matching('"n13"', column="notes"),
+}
+
+
+@pytest.mark.parametrize("name", QUERIES)
+@pytest.mark.parametrize("sort_column", ["id", "date", "amount", "notes"])
+def test_archived_pages_match_the_unarchived_table(archived, name, sort_column):
+    plain, with_archives = archived
+    query = QUERIES[name].including_archives().order_by(sort_column, descending=True)
+    expected = query.fetch_all(plain)
+    assert expected
+    pages, page = [], query.limit(70).fetch_all(with_archives)
+    while page:
+        pages.extend(page)
+        page = query.limit(70).after(query.sort_key(page[-1])).fetch_all(with_archives)
+    assert pages == expected
+    assert query.count(with_archives) == len(expected)
+
+
+def test_archives_outside_the_date_filter_are_not_read(archived):
+    _, with_archives = archived
+    sql, _ = TransactionQuery().between("2019-03-01", "2021-12-31").including_archives().compile(with_archives)
+    assert "archive_2019" in sql and "archive_2018" not in sql
+    sql, _ = TransactionQuery().between("2023-01-01", None).including_archives().compile(with_archives)
+    assert "archive_" not in sql
+
+
+def test_search_pages_add_up_to_every_match(ledger):
+    everything = search_transactions_fulltext(ledger, "category00*", 10 ** 6)
+    pages = [row for offset in range(0, len(everything) + 300, 300)
+             for row in search_transactions_fulltext(ledger, "category00*", 300, offset)]
+    assert len(everything) > 900 and pages == everything
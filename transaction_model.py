@@ -0,0 +1,261 @@
+import os
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QObject, pyqtSignal
+from query import TRANSACTION_COLUMNS, TransactionQuery
+from dates import day_number
+from transactions import (get_transactions_page, format_cents, add_change_listener, database_file,
+                          search_transactions_fulltext)
+
+HEADERS = ["ID", "Type", "Category", "Amount", "Date", "Notes"]
+AMOUNT_COLUMN = 3
+
+
+# re-emits change notifications from transactions.py as a Qt signal
+# writes made on a worker thread are then delivered on the GUI thread, where the relay lives
+class ChangeRelay(QObject):
+    changed = pyqtSignal(object)
+
+relay = None
+
+# the relay shared by every open view, created on first use from the GUI thread
+def change_relay():
+    global relay
+    if relay is None:
+        relay = ChangeRelay()
+        add_change_listener(relay.changed.emit)
+    return relay
+
+
+# table model that pages transactions from SQLite as the view scrolls
+# only rows that have been scrolled into view are held in memory, sorting is done by the database
+# with workers, pages are loaded on a background thread and added when they arrive
+class TransactionTableModel(QAbstractTableModel):
+    def __init__(self, conn, query=None, page_size=500, parent=None, workers=None):
+        super().__init__(parent)
+        self.conn = conn
+        self.workers = workers
+        self.query = query    # TransactionQuery with the filters shared by every page, None for all transactions
+        self.page_size = page_size
+
+        self.sort_column = 0
+        self.descending = False
+        self.rows = []
+        self.exhausted = False    # True once the last page has been fetched
+        self.pending = None    # background task loading the next page
+        self.generation = 0    # bumped on refresh so pages from an earlier query are ignored
+
+        # writes to this database are applied to the loaded rows as they happen
+        self.database = os.path.abspath(workers.manager.db_file) if workers is not None else database_file(conn)
+        change_relay().changed.connect(self.apply_change)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return HEADERS[section]
+        return section + 1
+
+    # values are only formatted when the view asks for a visible cell
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        value = self.rows[index.row()][index.column()]
+
+        if role == Qt.DisplayRole:
+            if value is None:
+                return ""
+            if index.column() == AMOUNT_COLUMN:
+                return format_cents(value)    # amounts are stored in cents
+            return str(value)
+
+        if role == Qt.TextAlignmentRole and index.column() == AMOUNT_COLUMN:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        return not self.exhausted
+
+    # the function that reads the next page and its arguments after conn
+    def page_request(self):
+        args = ((self.query or TransactionQuery()).including_archives(),)    # archived years are shown too
+        kwargs = dict(
+            sort_column=TRANSACTION_COLUMNS[self.sort_column],
+            descending=self.descending,
+            after=self.last_key(),
+            limit=self.page_size)
+        return get_transactions_page, args, kwargs
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.pending is not None:
+            return
+
+        read_page, args, kwargs = self.page_request()
+        if self.workers is None:
+            self.add_page(read_page(self.conn, *args, **kwargs))
+            return
+
+        generation = self.generation
+        self.pending = self.workers.read(
+            read_page, *args, **kwargs,
+            on_result=lambda page: self.page_loaded(generation, page),
+            on_error=lambda error: self.page_loaded(generation, []))
+
+    def page_loaded(self, generation, page):
+        if generation != self.generation:
+            return    # the model was refreshed while this page was loading
+        self.pending = None
+        self.add_page(page)
+
+    def add_page(self, page):
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if not page:
+            return
+
+        first = len(self.rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    # keyset position of the last loaded row: (sort value, id)
+    def last_key(self):
+        if not self.rows:
+            return None
+        return self.row_key(self.rows[-1])
+
+    # (sort value, id) of a row, in the order the database sorts by
+    def row_key(self, row):
+        value = row[self.sort_column]
+        if value is None:
+            value = ""    # matches COALESCE(notes, '') used when sorting
+        elif TRANSACTION_COLUMNS[self.sort_column] == "date":
+            value = day_number(value)    # shown as YYYY-MM-DD, sorted by the stored day number
+        return (value, row[0])
+
+    # whether key a sorts before key b in the current order
+    def before(self, a, b):
+        return a > b if self.descending else a < b
+
+    # index at which a row with this key belongs among the loaded rows, by binary search
+    def position(self, key):
+        low, high = 0, len(self.rows)
+        while low < high:
+            middle = (low + high) // 2
+            if self.before(self.row_key(self.rows[middle]), key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # index of a loaded row, None if it hasn't been loaded
+    def find(self, row):
+        index = self.position(self.row_key(row))
+        if index < len(self.rows) and self.rows[index][0] == row[0]:
+            return index
+        return None
+
+    # whether the loaded row at index can take a new key without moving
+    # the last loaded row can't move past its old key while later pages are still to come: they continue after it
+    def fits_at(self, index, key, old_key):
+        if index > 0 and not self.before(self.row_key(self.rows[index - 1]), key):
+            return False
+        if index + 1 < len(self.rows):
+            return self.before(key, self.row_key(self.rows[index + 1]))
+        return self.exhausted or not self.before(old_key, key)
+
+    # applies a committed write (transactions.TransactionChange) to the loaded rows
+    # rows are removed, inserted or changed in place; rows that sort past the loaded pages arrive with later pages
+    def apply_change(self, change):
+        if change.database != self.database:
+            return
+        if change.kind == "reset":
+            self.refresh()
+            return
+
+        reload_page = self.pending is not None
+        if reload_page:
+            # the page in flight may or may not include this write, load it again once the write is applied
+            self.pending.cancel()
+            self.pending = None
+            self.generation += 1
+
+        index = self.find(change.previous) if change.previous is not None else None
+        row = change.row
+        if row is not None and not (self.query or TransactionQuery()).matches(row):
+            row = None
+
+        if index is not None and row is not None and self.fits_at(index, self.row_key(row), self.row_key(change.previous)):
+            self.rows[index] = row
+            self.dataChanged.emit(self.index(index, 0), self.index(index, len(HEADERS) - 1))
+        else:
+            if index is not None:
+                self.beginRemoveRows(QModelIndex(), index, index)
+                del self.rows[index]
+                self.endRemoveRows()
+            if row is not None:
+                index = self.position(self.row_key(row))
+                if index < len(self.rows) or self.exhausted:
+                    self.beginInsertRows(QModelIndex(), index, index)
+                    self.rows.insert(index, row)
+                    self.endInsertRows()
+
+        if reload_page:
+            self.fetchMore()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.descending = order == Qt.DescendingOrder
+        self.refresh()
+
+    # shows the transactions matching another query, e.g. when a results window is reused
+    def set_query(self, query):
+        self.query = query
+        self.refresh()
+
+    # drops loaded rows so the view pulls them again from the first page
+    def refresh(self):
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        self.generation += 1
+
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.endResetModel()
+
+
+# full-text search results, best matches first with the matched words of the notes in [brackets]
+# pages are read by offset: ranked rows have no key to continue after, and the view can't re-sort them
+class SearchResultsModel(TransactionTableModel):
+    def __init__(self, conn, text="", page_size=500, parent=None, workers=None):
+        super().__init__(conn, None, page_size, parent, workers)
+        self.text = text
+
+    def page_request(self):
+        return search_transactions_fulltext, (self.text, self.page_size, len(self.rows)), {}
+
+    # a write can change the rank of any result, the search is run again
+    def apply_change(self, change):
+        if change.database == self.database:
+            self.refresh()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        pass
+
+    def set_text(self, text):
+        self.text = text
+        self.refresh()
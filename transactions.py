@@ -1,95 +1,732 @@
-from database import create_connection
-import csv
+from database import create_connection, has_fts_index, archive_year
+from aggregates import aggregate_transactions
+from query import TransactionQuery, TRANSACTION_SELECT, build_fts_query
+from dates import date_sql, day_number, year_range
+from dedupe import transaction_hash, duplicate_groups
+from profiling import profiled
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from inspect import signature
+from itertools import islice
+import json
+import threading
+import time
 
+# largest amount in cents either way, SQLite stores integers as signed 64 bits
+MAX_CENTS = 2 ** 63 - 1
 
-# retrieves all added transactions from transactions table
+# amounts are stored and returned as integer cents, these convert to and from dollar amounts
+# raises ValueError for anything that isn't a finite amount within MAX_CENTS
+def to_cents(amount):
+    try:
+        value = Decimal(str(amount).strip())
+        if not value.is_finite():
+            raise ValueError(f"Invalid amount: {amount!r}")
+        cents = int(value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+    except InvalidOperation:    # e.g. 1e30, too many digits to round to cents
+        raise ValueError(f"Invalid amount: {amount!r}")
+    if abs(cents) > MAX_CENTS:
+        raise ValueError(f"Amount out of range: {amount!r}")
+    return cents
+
+def format_cents(cents):
+    sign = "-" if cents < 0 else ""
+    dollars, cents = divmod(abs(cents), 100)
+    return f"{sign}{dollars}.{cents:02d}"
+
+# in-process cache of query results with least-recently-used eviction
+# every entry records which dates (and optionally which type) its result depends on,
+# so a write only evicts the entries it could have changed.
+# Writes made elsewhere (another process, the sqlite3 shell) are caught with the write_counter table, which
+# triggers bump for every row written: the cache follows the counter through the writes made here, and
+# anything else that moved it drops every entry of the database before the next hit is served
+class QueryCache:
+    def __init__(self, max_entries=256, max_rows=1_000_000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows    # total rows held across all cached lists
+        self.entries = OrderedDict()    # key -> (result, rows, (database, first day, last day, type))
+        self.rows = 0
+        self.generation = 0    # bumped by every invalidation, so results read before a write aren't stored after it
+        self.counters = {}    # database -> write_counter value the entries are up to date with
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    # counter is the database's current write_counter value
+    def get(self, key, counter):
+        with self.lock:
+            database = key[0]
+            if self.counters.get(database) != counter:
+                self.drop(database)    # written to by something that didn't invalidate, or never seen
+                self.counters[database] = counter
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key][0], self.generation
+            self.misses += 1
+            return False, None, self.generation
+
+    def put(self, key, result, scope, generation):
+        rows = len(result) if isinstance(result, list) else 1
+        with self.lock:
+            if generation != self.generation or rows > self.max_rows:
+                return
+            if key in self.entries:
+                self.rows -= self.entries.pop(key)[1]
+            self.entries[key] = (result, rows, scope)
+            self.rows += rows
+            while len(self.entries) > self.max_entries or self.rows > self.max_rows:
+                self.rows -= self.entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    # evicts entries of database that depend on any of the changes: (type, first day, last day)
+    # rows is the number of rows the write changed, which it added to the write counter
+    def invalidate(self, database, changes, rows):
+        changes = list(changes)
+        with self.lock:
+            self.generation += 1
+            if database in self.counters:
+                self.counters[database] += rows
+            for key, (_, rows, (entry_database, first, last, entry_type)) in list(self.entries.items()):
+                if entry_database != database:
+                    continue
+                for change_type, change_first, change_last in changes:
+                    if entry_type is not None and entry_type != change_type:
+                        continue
+                    if first is not None and (change_last < first or change_first > last):
+                        continue
+                    del self.entries[key]
+                    self.rows -= rows
+                    self.invalidations += 1
+                    break
+
+    # evicts every entry of database, the lock is held
+    def drop(self, database):
+        self.generation += 1
+        for key, (_, rows, scope) in list(self.entries.items()):
+            if scope[0] == database:
+                del self.entries[key]
+                self.rows -= rows
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.counters.clear()
+            self.rows = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "rows": self.rows,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+query_cache = QueryCache()
+
+# file name of the connection's main database, empty for in-memory databases
+def database_file(conn):
+    return conn.execute("PRAGMA database_list").fetchone()[2]
+
+# (first day, last day, type) a cached result depends on, from the arguments of the cached function;
+# None means any. Dates are YYYY-MM-DD, raises ValueError for a malformed one
+def cache_scope(start_date=None, end_date=None, transaction_type=None):
+    return (None if start_date is None else day_number(start_date),
+            None if end_date is None else day_number(end_date),
+            transaction_type)
+
+# caches a read-only query in query_cache, keyed by function name and its normalized arguments
+# scope(arguments) returns the cache_scope() the result depends on; it is also the key, so it has to
+# determine the result. Before a hit is served the write counter is read, see QueryCache
+def cached_query(scope):
+    def decorator(fn):
+        fn_signature = signature(fn)
+
+        @wraps(fn)
+        def wrapper(conn, *args, **kwargs):
+            database = database_file(conn)
+            if not database:
+                return fn(conn, *args, **kwargs)
+
+            bound = fn_signature.bind(conn, *args, **kwargs)
+            bound.apply_defaults()
+            normalized = scope(*tuple(bound.arguments.values())[1:])    # everything but conn
+            key = (database, fn.__name__, normalized)
+
+            counter = conn.execute("SELECT rows FROM write_counter").fetchone()[0]
+            found, result, generation = query_cache.get(key, counter)
+            if not found:
+                result = fn(conn, *args, **kwargs)
+                query_cache.put(key, result, (database, *normalized), generation)
+            return list(result) if isinstance(result, list) else result    # callers may modify lists
+
+        return wrapper
+    return decorator
+
+# called after a write, changes are (type, date) pairs of the rows that were written
+# rows is the number of rows the write changed, by default one per change
+def invalidate_cached_queries(conn, changes, rows=None):
+    rows = len(changes) if rows is None else rows
+    changes = [(transaction_type, day_number(date), day_number(date)) for transaction_type, date in set(changes)]
+    if changes or rows:
+        query_cache.invalidate(database_file(conn), changes, rows)
+
+# like invalidate_cached_queries for a batch of written rows, evicting by each type's date span
+# so a large batch costs one pass over the cache per type instead of one per row
+def invalidate_cached_ranges(conn, rows, count=None):
+    spans = {}
+    for row in rows:
+        first, last = spans.get(row[0], (row[3], row[3]))
+        spans[row[0]] = (min(first, row[3]), max(last, row[3]))
+    count = len(rows) if count is None else count
+    if spans or count:
+        query_cache.invalidate(database_file(conn), [(t, day_number(first), day_number(last))
+                                                     for t, (first, last) in spans.items()], count)
+
+# a committed write: kind is "insert", "update", "delete", or "reset" when many rows changed at once
+# row and previous are (id, type, category, amount, date, notes) after and before the write, None if not applicable
+TransactionChange = namedtuple("TransactionChange", "database kind row previous")
+
+# in-process change notifications, so open views can apply a write to the affected rows instead of reloading
+# listeners are called as listener(change) on the thread that made the write, right after it commits
+change_listeners = []
+change_listeners_lock = threading.Lock()
+
+def add_change_listener(listener):
+    with change_listeners_lock:
+        change_listeners.append(listener)
+
+def remove_change_listener(listener):
+    with change_listeners_lock:
+        if listener in change_listeners:
+            change_listeners.remove(listener)
+
+# batch updates and deletes publish one change per row up to this many rows and a single "reset" beyond it,
+# since views apply changes one at a time and reloading is cheaper than thousands of row moves
+ROW_CHANGES_LIMIT = 100
+
+def notify_change(conn, kind, row=None, previous=None):
+    with change_listeners_lock:
+        listeners = list(change_listeners)
+    if not listeners:
+        return
+    change = TransactionChange(database_file(conn), kind, row, previous)
+    for listener in listeners:
+        try:
+            listener(change)
+        except Exception as e:
+            print(e)    # the write is already committed, a broken listener mustn't make it look failed
+
+# retrieves all added transactions, archived years included, amounts are in cents
+@profiled()
 def get_transactions(conn):
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM transactions")
-    return cur.fetchall()
+    return TransactionQuery().including_archives().fetch_all(conn)
+
+# retrieves one page of the transactions matching query using keyset pagination
+# rows are ordered by sort_column then id, after is the (sort value, id) of the last row already fetched
+@profiled()
+def get_transactions_page(conn, query=None, sort_column="id", descending=False, after=None, limit=500):
+    query = (query or TransactionQuery()).order_by(sort_column, descending).limit(limit)
+    if after is not None:
+        query = query.after(after)
+    return query.fetch_all(conn)
 
 # adds transaction as a tuple to transactions table in database
+# the amount has to be integer cents already, validate_transaction converts what the user typed
+# the date is YYYY-MM-DD and stored as a day number; raises ValueError like validate_transaction(in_cents=True)
 
+@profiled(rows=lambda transaction_id: 1)
 def add_transaction(conn, transaction):
-    sql = '''INSERT INTO transactions(type, category, amount, date, notes)
-              VALUES(?, ?, ?, ?, ?)'''
+    sql = '''INSERT INTO transactions(type, category, amount, date, notes, content_hash)
+              VALUES(?, ?, ?, ?, ?, ?)'''
+    transaction = validate_transaction(transaction, in_cents=True)
+    row = (*transaction[:3], day_number(transaction[3]), *transaction[4:])
     cur = conn.cursor()
-    cur.execute(sql, transaction)
+    cur.execute(sql, (*row, transaction_hash(*row)))
     conn.commit()
+    invalidate_cached_queries(conn, [(transaction[0], transaction[3])])
+    notify_change(conn, "insert", (cur.lastrowid, *transaction))
     return cur.lastrowid
 
+# validates a transaction the same way the add transaction form does and returns it ready for insert,
+# with the dollar amount converted to cents (with in_cents, the amount has to be integer cents already)
+# raises ValueError describing the first problem found
+# date_cache maps dates already checked to their day number (None if invalid), so repeated dates are parsed once
+def validate_transaction(transaction, date_cache=None, in_cents=False):
+    transaction_type, category, amount, date, notes = transaction
+
+    # everything but notes is required
+    if not transaction_type or not category or amount in (None, "") or not date:
+        raise ValueError("Please fill in all required fields (Type, Category, Amount, Date).")
+
+    if in_cents:
+        if not isinstance(amount, int) or isinstance(amount, bool) or abs(amount) > MAX_CENTS:
+            raise ValueError("Please enter a valid numerical amount.")
+    else:
+        try:
+            amount = to_cents(amount)
+        except ValueError:
+            raise ValueError("Please enter a valid numerical amount.")
+
+    if date_cache is not None and date in date_cache:
+        day = date_cache[date]
+    else:
+        try:
+            day = day_number(date)
+        except ValueError:
+            day = None
+        if date_cache is not None:
+            date_cache[date] = day
+    if day is None:
+        raise ValueError("Please enter a valid date in YYYY-MM-DD format.")
+
+    return (transaction_type, category, amount, date, notes)
+
+# strictly YYYY-MM-DD with a real month and day
+def is_valid_date(date):
+    try:
+        day_number(date)
+    except ValueError:
+        return False
+    return True
+
+# validates a whole batch at once, returns (valid rows, [(row number, error message), ...])
+def validate_transactions_batch(batch, first_row_number=0, date_cache=None, in_cents=False):
+    if date_cache is None:
+        date_cache = {}
+
+    valid = []
+    rejected = []
+    for row_number, row in enumerate(batch, start=first_row_number):
+        if len(row) != 5:
+            rejected.append((row_number, "Expected 5 fields (Type, Category, Amount, Date, Notes)."))
+            continue
+        try:
+            valid.append(validate_transaction(row, date_cache, in_cents))
+        except ValueError as e:
+            rejected.append((row_number, str(e)))
+
+    return valid, rejected
+
+# what add_transactions_bulk does with a row that is already in the database:
+# insert it anyway, skip it, or merge it into the stored row (which takes the imported notes)
+DUPLICATE_MODES = ("insert", "skip", "merge")
+
+# ids of the transactions up to last_id with each of the given content hashes, lowest first
+# one index lookup per hash; equal hashes are taken as equal content (a 64-bit collision is negligible)
+def find_stored_hashes(conn, hashes, last_id, chunk_size=500):
+    hashes = list(set(hashes))
+    stored = {}
+    for offset in range(0, len(hashes), chunk_size):
+        chunk = hashes[offset:offset + chunk_size]
+        cur = conn.execute(f'''SELECT content_hash, id FROM transactions
+                                WHERE content_hash IN ({", ".join("?" * len(chunk))}) AND id <= ? ORDER BY id''',
+                           (*chunk, last_id))
+        for content_hash, transaction_id in cur:
+            stored.setdefault(content_hash, []).append(transaction_id)
+    return stored
+
+# inserts transactions from any iterable, batch_size rows per transaction and commit
+# rows are (type, category, amount, date, notes) and are never all held in memory at once
+# amounts are dollars like the add transaction form takes, or integer cents with amounts_in_cents
+# duplicates is one of DUPLICATE_MODES: with "skip" or "merge", a row matching a transaction stored before
+# the import isn't inserted, e.g. when a bank feed is imported again; repeats within the import are kept,
+# so two identical purchases are only both skipped if both are already stored. An import inserted over
+# several calls (AsyncTransactions.add_transactions_bulk) passes the same import_state dict to each of them,
+# so rows an earlier call inserted aren't taken for duplicates
+# progress(batch_number, rows_inserted, rows_per_second) is called after every batch if given
+# returns (number of rows inserted, [(row number, error message), ...] for rows that weren't inserted)
+@profiled(rows=lambda result: result[0])
+def add_transactions_bulk(conn, transactions, batch_size=10000, progress=None, amounts_in_cents=False,
+                          duplicates="insert", import_state=None):
+    if duplicates not in DUPLICATE_MODES:
+        raise ValueError(f"Unknown duplicates mode: {duplicates}")
+    sql = '''INSERT INTO transactions(type, category, amount, date, notes, content_hash)
+              VALUES(?, ?, ?, ?, ?, ?)'''
+    merge_sql = "UPDATE transactions SET notes = ? WHERE id = ? AND notes IS NOT ?"    # notes, id, notes
+
+    rows = iter(transactions)
+    inserted = 0
+    rejected = []
+    row_number = 0
+    batch_number = 0
+    date_cache = {}    # dates repeat a lot in real ledgers, each distinct one is only parsed once
+    if import_state is None:
+        import_state = {}
+    last_id = import_state.get("last_id")
+    if duplicates != "insert" and last_id is None:
+        last_id = import_state["last_id"] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0]
+    matched = import_state.setdefault("matched", {})    # content hash -> stored rows already matched by an imported row
+
+    while True:
+        batch = [tuple(row) for row in islice(rows, batch_size)]
+        if not batch:
+            break
+
+        started = time.perf_counter()
+        valid, batch_rejected = validate_transactions_batch(batch, row_number, date_cache, amounts_in_cents)
+        # (validated transaction, row as stored, content hash)
+        entries = []
+        for transaction in valid:
+            row = (*transaction[:3], date_cache[transaction[3]], transaction[4])
+            entries.append((transaction, row, transaction_hash(*row)))
+
+        merges = []    # (notes, id, notes) for merge_sql
+        merged = []
+        if last_id is not None and entries:
+            not_valid = {number for number, _ in batch_rejected}
+            numbers = [number for number in range(row_number, row_number + len(batch)) if number not in not_valid]
+            stored = find_stored_hashes(conn, [content_hash for _, _, content_hash in entries], last_id)
+            kept = []
+            for number, entry in zip(numbers, entries):
+                ids = stored.get(entry[2], ())
+                count = matched.get(entry[2], 0)
+                if count >= len(ids):
+                    kept.append(entry)
+                    continue
+                matched[entry[2]] = count + 1
+                if duplicates == "merge":
+                    merges.append((entry[0][4], ids[count], entry[0][4]))
+                    merged.append(entry[0])
+                    batch_rejected.append((number, f"Duplicate of transaction {ids[count]}, merged."))
+                else:
+                    batch_rejected.append((number, f"Duplicate of transaction {ids[count]}, skipped."))
+            batch_rejected.sort()
+            entries = kept
+        valid = [transaction for transaction, _, _ in entries]
+
+        with conn:    # one transaction per batch, rolled back if the insert fails
+            conn.executemany(sql, ((*row, content_hash) for _, row, content_hash in entries))
+            merged_rows = conn.executemany(merge_sql, merges).rowcount if merges else 0
+        invalidate_cached_ranges(conn, valid + merged, len(valid) + merged_rows)
+        if valid or merged:
+            notify_change(conn, "reset")    # views reload once per batch rather than per row
+        elapsed = time.perf_counter() - started
+
+        row_number += len(batch)
+        batch_number += 1
+        inserted += len(valid)
+        rejected.extend(batch_rejected)
+
+        if progress:
+            progress(batch_number, len(valid), len(valid) / elapsed if elapsed > 0 else float("inf"))
+
+    return inserted, rejected
+
+@profiled()
+@cached_query(lambda transaction_type: cache_scope(transaction_type=transaction_type))
 def filter_transactions_by_type(conn, transaction_type):
-    cur = conn.cursor()
-    sql = '''SELECT * FROM transactions WHERE type = ?'''
-    cur.execute(sql, (transaction_type,))
-    return cur.fetchall()
+    return TransactionQuery().where_type(transaction_type).including_archives().fetch_all(conn)
 
+# in date order, which the date index returns without sorting
+@profiled()
+@cached_query(cache_scope)
 def filter_transactions_by_date_range(conn, start_date, end_date):
-    cur = conn.cursor()
-    sql = '''SELECT * FROM transactions WHERE date BETWEEN ? AND ?'''
-    cur.execute(sql, (start_date, end_date))
-    return cur.fetchall()
+    return TransactionQuery().between(start_date, end_date).order_by("date").including_archives().fetch_all(conn)
+
+# moves every transaction dated in year into its archive database, see database.archive_year()
+# lists, filters and exports read archived years too, searches only read the main table;
+# cached results for the year are dropped and open views reload
+# returns the number of transactions moved
+@profiled(rows=int)
+def archive_transactions(conn, year):
+    first, last = year_range(year)
+    types = [row[0] for row in conn.execute("SELECT DISTINCT type FROM transactions WHERE date BETWEEN ? AND ?",
+                                            (first, last))]
+    moved = archive_year(conn, year)
+    if moved:
+        query_cache.invalidate(database_file(conn), [(transaction_type, first, last) for transaction_type in types], moved)
+        notify_change(conn, "reset")
+    return moved
 
+@profiled(rows=int)
 def delete_transaction_by_id(conn, transaction_id):
-    sql = '''DELETE FROM transactions WHERE id = ?'''
+    sql = f'''DELETE FROM transactions WHERE id = ? RETURNING id, type, category, amount, {date_sql('date')}, notes'''
     cur = conn.cursor()
     cur.execute(sql, (transaction_id,))
+    deleted = cur.fetchall()    # RETURNING rows have to be read before the commit
     conn.commit()
-    if cur.rowcount == 0:
+    if not deleted:
         return False  # no transaction found with provided id
+    invalidate_cached_queries(conn, [(row[1], row[4]) for row in deleted])
+    notify_change(conn, "delete", previous=deleted[0])
     return True 
 
+# the amount is integer cents; raises ValueError for a bad amount or date, like add_transaction
+@profiled(rows=int)
 def update_transaction(conn, transaction_id, updated_transaction):
     sql = '''UPDATE transactions
-             SET type = ?, category = ?, amount = ?, date = ?, notes = ?
+             SET type = ?, category = ?, amount = ?, date = ?, notes = ?, content_hash = ?
              WHERE id = ?'''
     
+    updated_transaction = validate_transaction(updated_transaction, in_cents=True)
+    transaction_type, category, amount, date, notes = updated_transaction
+    day = day_number(date)
+    row = (transaction_type, category, amount, day, notes)
+
     cur = conn.cursor()
-    cur.execute(sql, (*updated_transaction, transaction_id))
+    previous = get_transaction_by_id(conn, transaction_id)    # its old type and date may be cached too
+    cur.execute(sql, (*row, transaction_hash(*row), transaction_id))
     conn.commit()
 
     if cur.rowcount == 0:
         return False  
+    invalidate_cached_queries(conn, [(previous[1], previous[4]), (updated_transaction[0], updated_transaction[3])], 1)
+    notify_change(conn, "update", (transaction_id, *updated_transaction), previous)
     return True  
 
+@profiled(rows=lambda transaction: int(transaction is not None))
 def get_transaction_by_id(conn, transaction_id):
-    sql = '''SELECT * FROM transactions WHERE id = ?'''
+    sql = f'''SELECT {TRANSACTION_SELECT} FROM transactions t WHERE t.id = ?'''
     cur = conn.cursor()
     cur.execute(sql, (transaction_id,))
     transaction = cur.fetchone()  # fetch one result
 
     return transaction    # Will return None if the ID doesn't exist
 
-def export_to_csv(conn, filename):
-    transactions = get_transactions(conn)    # retrieves all transactions
+# one-shot cleanup of transactions stored more than once, keeping the oldest row of each group
+# groups are found in a single sorted pass over the content hash index, see dedupe.duplicate_groups
+# the extra rows are removed with one delete_transactions call; returns the number of rows deleted
+@profiled(rows=int)
+def delete_duplicate_transactions(conn):
+    extra = [transaction_id for group in duplicate_groups(conn) for transaction_id in group[1:]]
+    return delete_transactions(conn, ids=extra) if extra else 0
+
+# columns a batch update can change, in transaction_hash argument order
+PATCH_COLUMNS = ("type", "category", "amount", "date", "notes")
+
+# WHERE condition selecting the rows of a batch operation, either a list of ids or a TransactionQuery
+# ids are passed as one JSON parameter, so any number of them fits in one statement
+# archived rows are read-only, queries including archives are refused
+def batch_condition(conn, ids=None, query=None):
+    if (ids is None) == (query is None):
+        raise ValueError("Pass either ids or query.")
+    if ids is not None:
+        return "id IN (SELECT value FROM json_each(?))", [json.dumps([int(transaction_id) for transaction_id in ids])]
+    if query.archives:
+        raise ValueError("Archived transactions can't be changed.")
+    sql, params = query.compile(conn, select="t.id")
+    return f"id IN ({sql})", list(params)
+
+# checks a batch update patch and returns its columns and stored values, raises ValueError
+# amounts are cents and dates YYYY-MM-DD, like update_transaction; a blank type or category isn't allowed
+def validate_patch(patch):
+    unknown = [column for column in patch if column not in PATCH_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    if not patch:
+        raise ValueError("Nothing to update.")
+
+    values = {}
+    for column, value in patch.items():
+        if column in ("type", "category") and not value:
+            raise ValueError("Please fill in all required fields (Type, Category, Amount, Date).")
+        if column == "amount" and (not isinstance(value, int) or isinstance(value, bool) or abs(value) > MAX_CENTS):
+            raise ValueError("Please enter a valid numerical amount.")
+        values[column] = day_number(value) if column == "date" else value
+    return values
+
+# sets the fields in patch, e.g. {"category": "groceries"}, on every transaction in ids or matching query
+# one UPDATE statement in one transaction, the content hash is recomputed in SQL; returns the number of rows updated
+@profiled(rows=int)
+def update_transactions(conn, patch, ids=None, query=None):
+    values = validate_patch(patch)
+    condition, params = batch_condition(conn, ids, query)
+
+    assignments = [f"{column} = ?" for column in values]
+    # SET expressions see the old row, so patched columns go into the hash as parameters
+    hash_arguments = ["?" if column in values else column for column in PATCH_COLUMNS]
+    assignments.append(f"content_hash = transaction_hash({', '.join(hash_arguments)})")
+    sql = f'''UPDATE transactions SET {", ".join(assignments)} WHERE {condition}
+              RETURNING id, type, category, amount, {date_sql('date')}, notes'''
+    sql_params = [*values.values(), *(values[column] for column in PATCH_COLUMNS if column in values), *params]
+
+    with conn:
+        # take the write lock before reading, so no other connection can change the rows between the two statements
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        # the rows before the update, for per-row changes; past the limit only their type and date spans are read,
+        # as cached results of the old type and date are stale as well
+        previous = conn.execute(f'''SELECT {TRANSACTION_SELECT} FROM transactions t WHERE {condition} LIMIT ?''',
+                                [*params, ROW_CHANGES_LIMIT + 1]).fetchall()
+        per_row = len(previous) <= ROW_CHANGES_LIMIT
+        old_spans = []
+        if per_row:
+            old_spans = [(row[1], day_number(row[4]), day_number(row[4])) for row in previous]
+        elif "type" in values or "date" in values:
+            old_spans = conn.execute(f'''SELECT type, MIN(date), MAX(date) FROM transactions
+                                         WHERE {condition} GROUP BY type''', params).fetchall()
+        updated = conn.execute(sql, sql_params).fetchall()
+
+    invalidate_cached_ranges(conn, [row[1:] for row in updated])
+    if old_spans:
+        query_cache.invalidate(database_file(conn), old_spans, 0)    # the rows were counted with their new values
+    if per_row:
+        previous = {row[0]: row for row in previous}
+        for row in updated:
+            notify_change(conn, "update", row, previous.get(row[0]))
+    else:
+        notify_change(conn, "reset")
+    return len(updated)
 
-    with open(filename, mode='w', newline='') as file:
+# deletes every transaction in ids or matching query, e.g. TransactionQuery().between(start, end) for a date range
+# one DELETE statement in one transaction; returns the number of rows deleted
+@profiled(rows=int)
+def delete_transactions(conn, ids=None, query=None):
+    condition, params = batch_condition(conn, ids, query)
+    with conn:
+        deleted = conn.execute(f'''DELETE FROM transactions WHERE {condition}
+                                   RETURNING id, type, category, amount, {date_sql('date')}, notes''', params).fetchall()
+    invalidate_cached_ranges(conn, [row[1:] for row in deleted])
+    if len(deleted) > ROW_CHANGES_LIMIT:
+        notify_change(conn, "reset")
+    else:
+        for row in deleted:
+            notify_change(conn, "delete", previous=row)
+    return len(deleted)
+
+# writes transactions to a CSV file, reading buffer_size rows from the database at a time
+# amounts are written in dollars, so the file can be read back by importers.read_csv_transactions
+# optional filters are applied in SQL, compress=None gzips the file when its name ends in .gz
+# progress(rows_written) is called after every chunk if given; returns the number of rows written
+@profiled(rows=lambda rows_written: rows_written)
+def export_to_csv(conn, filename, transaction_type=None, start_date=None, end_date=None, category=None,
+                  buffer_size=1000, compress=None, progress=None):
+    query = TransactionQuery().between(start_date or None, end_date or None).including_archives()
+    if transaction_type:
+        query = query.where_type(transaction_type)
+    if category:
+        query = query.in_categories([category])
+
+    import csv    # only needed for exports, kept off the startup path
+    import gzip
+
+    if compress is None:
+        compress = filename.endswith(".gz")
+    opener = gzip.open if compress else open
+
+    cur = conn.cursor()
+    cur.execute(*query.compile(conn))
+    rows_written = 0
+
+    with opener(filename, mode='wt', newline='') as file:
         writer = csv.writer(file)
     
-        writer.writerow(['ID', 'Type', 'Category', 'Amount', 'Date'])    # write the header
+        writer.writerow(['ID', 'Type', 'Category', 'Amount', 'Date', 'Notes'])    # write the header
         
-        for transaction in transactions:    # write the transaction data
-            writer.writerow(transaction)
+        while True:    # write the transaction data one chunk at a time
+            rows = cur.fetchmany(buffer_size)
+            if not rows:
+                break
+            writer.writerows((row[0], row[1], row[2], format_cents(row[3]), row[4], row[5]) for row in rows)
+            rows_written += len(rows)
+            if progress:
+                progress(rows_written)
 
     print(f"Transactions exported to {filename} successfully.")
+    return rows_written
 
 
-def summarize_transactions(conn, start_date, end_date):
+# pyarrow is optional, only Arrow and Parquet files need it
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet files need pyarrow, install it with: pip install pyarrow") from None
+    return pyarrow
+
+# columns of exported Arrow and Parquet files: amounts are int64 cents, dates are date32 (days since 1970-01-01,
+# the stored day number) and type and category are dictionary encoded
+def arrow_schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("type", pa.dictionary(pa.int8(), pa.string())),
+        ("category", pa.dictionary(pa.int32(), pa.string())),
+        ("amount", pa.int64()),
+        ("date", pa.date32()),
+        ("notes", pa.string()),
+    ])
+
+# same filters as export_to_csv; writes Parquet when the name ends in .parquet, else an Arrow IPC file
+# record batches of batch_size rows are built straight from the cursor, so memory use doesn't grow with the table
+# progress(rows_written) is called after every batch if given; returns the number of rows written
+@profiled(rows=lambda rows_written: rows_written)
+def export_to_arrow(conn, filename, transaction_type=None, start_date=None, end_date=None, category=None,
+                    batch_size=65536, progress=None):
+    query = TransactionQuery().between(start_date or None, end_date or None).including_archives()
+    if transaction_type:
+        query = query.where_type(transaction_type)
+    if category:
+        query = query.in_categories([category])
+
+    pa = import_pyarrow()
+    schema = arrow_schema(pa)
+    if filename.lower().endswith(".parquet"):
+        import pyarrow.parquet
+        writer = pyarrow.parquet.ParquetWriter(filename, schema)
+    else:
+        # the dictionaries grow as new values turn up, later batches only add the new entries
+        writer = pa.ipc.new_file(filename, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
     cur = conn.cursor()
-    
-    # calculates total income
-    cur.execute("SELECT SUM(amount) FROM transactions WHERE type = 'income' AND date BETWEEN ? AND ?", (start_date, end_date))
-    total_income = cur.fetchone()[0] or 0  # default to 0 if no income
-    
-    # calculates total expenses
-    cur.execute("SELECT SUM(amount) FROM transactions WHERE type = 'expense' AND date BETWEEN ? AND ?", (start_date, end_date))
-    total_expenses = cur.fetchone()[0] or 0
+    cur.execute(*query.compile(conn, select="t.id, t.type, t.category, t.amount, t.date, t.notes"))
+    dictionaries = ({}, {})    # type and category value -> code, in order of appearance
+    rows_written = 0
+
+    with writer:
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            ids, types, categories, amounts, days, notes = zip(*rows)
+
+            columns = [pa.array(ids, pa.int64())]
+            for values, codes, field in zip((types, categories), dictionaries, ("type", "category")):
+                indices = [codes.setdefault(value, len(codes)) for value in values]
+                columns.append(pa.DictionaryArray.from_arrays(
+                    pa.array(indices, schema.field(field).type.index_type), pa.array(list(codes), pa.string())))
+            columns += [pa.array(amounts, pa.int64()), pa.array(days, pa.date32()), pa.array(notes, pa.string())]
 
-    net_balance= total_income - total_expenses
+            writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+            rows_written += len(rows)
+            if progress:
+                progress(rows_written)
+
+    print(f"Transactions exported to {filename} successfully.")
+    return rows_written
 
-    return total_income, total_expenses, net_balance
 
+# calculates total income, total expenses and net balance in cents, in one pass over the date range
+@profiled()
+@cached_query(cache_scope)
+def summarize_transactions(conn, start_date, end_date):
+    return aggregate_transactions(conn, start_date, end_date).totals()
+
+# finds transactions whose notes match the keywords, best matches first
+# falls back to a LIKE substring search when the full-text index isn't available
+@profiled()
 def search_transactions_by_notes(conn, keyword):
+    return TransactionQuery().matching(keyword, column="notes").order_by("relevance").fetch_all(conn)
+
+# searches notes and category, returns up to limit rows ranked by relevance, skipping the first offset
+# the notes column holds a snippet with the matching words in [brackets]
+@profiled()
+def search_transactions_fulltext(conn, text, limit=500, offset=0):
+    fts_query = build_fts_query(text)
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM transactions WHERE notes LIKE ?", ('%' + keyword + '%',))
+    if fts_query and has_fts_index(conn):
+        cursor.execute(f'''SELECT t.id, t.type, t.category, t.amount, {date_sql('t.date')},
+                                 COALESCE(NULLIF(snippet(transactions_fts, 0, '[', ']', '...', 12), ''), t.notes)
+                          FROM transactions_fts JOIN transactions t ON t.id = transactions_fts.rowid
+                          WHERE transactions_fts MATCH ? ORDER BY rank, t.id LIMIT ? OFFSET ?''', (fts_query, limit, offset))
+    else:
+        cursor.execute(f"SELECT {TRANSACTION_SELECT} FROM transactions t WHERE notes LIKE ? OR category LIKE ? "
+                       "ORDER BY t.id LIMIT ? OFFSET ?", ('%' + text + '%', '%' + text + '%', limit, offset))
     return cursor.fetchall()
\ No newline at end of file
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from profiling import profiler
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+# signals have to live on a QObject, QRunnable isn't one
+# they are delivered on the GUI thread, so slots can update widgets directly
+class TaskSignals(QObject):
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()    # always emitted last, whatever the outcome
+
+
+# runs fn(conn, *args, **kwargs) on a pool thread
+# conn is the manager's writer for writes, or a pooled read-only connection for reads
+class DatabaseTask(QRunnable):
+    def __init__(self, manager, fn, args, kwargs, with_progress=False, write=False):
+        super().__init__()
+        self.setAutoDelete(False)    # the Python object is kept alive by DatabaseWorkers instead
+        self.signals = TaskSignals()
+        self.manager = manager
+        self.write = write
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.with_progress = with_progress    # pass report_progress to fn as its progress callback
+
+        self.is_cancelled = False
+        self.submitted = time.perf_counter()    # task time in the profiler includes waiting for a thread
+        self.conn = None
+        self.lock = threading.Lock()    # guards conn between run() and cancel()
+
+    # stops the task: a running query is interrupted, and the next progress report raises TaskCancelled
+    def cancel(self):
+        with self.lock:
+            self.is_cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+    def report_progress(self, value):
+        if self.is_cancelled:
+            raise TaskCancelled()
+        self.signals.progress.emit(value)
+
+    def run(self):
+        failed = True
+        try:
+            if self.is_cancelled:
+                raise TaskCancelled()
+
+            with self.manager.write() if self.write else self.manager.read() as conn:
+                with self.lock:
+                    self.conn = conn
+                try:
+                    kwargs = dict(self.kwargs)
+                    if self.with_progress:
+                        kwargs["progress"] = self.report_progress
+                    result = self.fn(conn, *self.args, **kwargs)
+                finally:
+                    with self.lock:
+                        self.conn = None    # the connection goes back to the pool, don't interrupt it anymore
+
+            if self.is_cancelled:
+                raise TaskCancelled()
+            failed = False
+            self.signals.result.emit(result)
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            if self.is_cancelled and isinstance(e, sqlite3.OperationalError):
+                self.signals.cancelled.emit()    # "interrupted" raised by conn.interrupt()
+            else:
+                self.signals.error.emit(str(e))
+        finally:
+            elapsed_ms = (time.perf_counter() - self.submitted) * 1000
+            profiler.record("task:" + getattr(self.fn, "__name__", "query"), elapsed_ms, None, {}, failed=failed)
+            self.signals.finished.emit()
+
+
+# background database access for the GUI, on top of a ConnectionManager
+# reads run concurrently on a small pool, writes go through a single thread one at a time
+class DatabaseWorkers:
+    def __init__(self, manager):
+        self.manager = manager
+
+        self.readers = QThreadPool()
+        self.readers.setMaxThreadCount(manager.config["read_pool_size"])    # one thread per pooled reader
+
+        self.writer = QThreadPool()
+        self.writer.setMaxThreadCount(1)
+
+        self.tasks = set()    # running tasks, released when they finish
+
+    def read(self, fn, *args, **kwargs):
+        return self.submit(self.readers, fn, args, kwargs, write=False)
+
+    def write(self, fn, *args, **kwargs):
+        return self.submit(self.writer, fn, args, kwargs, write=True)
+
+    # on_result, on_error, on_progress, on_cancelled and on_finished are connected to the task's signals
+    # before it starts, so even a task that finishes at once delivers them
+    # returns the task so the caller can cancel it; with start=False it isn't queued yet: connect anything else
+    # to its signals first, then pass it to start()
+    def submit(self, pool, fn, args, kwargs, write):
+        callbacks = {name: kwargs.pop(name, None)
+                     for name in ("on_result", "on_error", "on_progress", "on_cancelled", "on_finished")}
+        with_progress = kwargs.pop("with_progress", False)
+        start = kwargs.pop("start", True)
+
+        task = DatabaseTask(self.manager, fn, args, kwargs, with_progress, write)
+        task.pool = pool
+        if callbacks["on_result"]:
+            task.signals.result.connect(callbacks["on_result"])
+        if callbacks["on_error"]:
+            task.signals.error.connect(callbacks["on_error"])
+        if callbacks["on_progress"]:
+            task.signals.progress.connect(callbacks["on_progress"])
+        if callbacks["on_cancelled"]:
+            task.signals.cancelled.connect(callbacks["on_cancelled"])
+        if callbacks["on_finished"]:
+            task.signals.finished.connect(callbacks["on_finished"])
+        task.signals.finished.connect(lambda: self.tasks.discard(task))
+
+        self.tasks.add(task)
+        if start:
+            self.start(task)
+        return task
+
+    # queues a task made with start=False
+    def start(self, task):
+        task.pool.start(task)
+
+    # cancels everything still running and waits for the pools to drain, e.g. when the window closes
+    def shutdown(self):
+        for task in list(self.tasks):
+            task.cancel()
+        self.readers.waitForDone()
+        self.writer.waitForDone()